@@ -0,0 +1,180 @@
+###############################################################################
+#  Load-aware admission control
+#  根据实测推理能力(推理fps vs 25fps目标)、队列深度和内存决定是否接纳新会话，
+#  并估算还能容纳多少会话，供外部负载均衡使用
+###############################################################################
+
+import os
+import math
+import time
+import asyncio
+import threading
+from collections import deque
+from typing import Iterable, Optional, Tuple
+
+import torch
+
+from logger import logger
+
+
+def get_rss_bytes() -> int:
+    """当前进程常驻内存(字节)"""
+    try:
+        import psutil
+        return psutil.Process(os.getpid()).memory_info().rss
+    except ImportError:
+        pass
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError):
+        return 0
+
+def get_gpu_memory() -> Tuple[int, int]:
+    """GPU显存 (空闲字节, 总字节)，无GPU时返回(0,0)"""
+    if not torch.cuda.is_available():
+        return 0, 0
+    try:
+        return torch.cuda.mem_get_info()
+    except Exception:
+        return 0, 0
+
+
+class AdmissionController:
+    """
+    准入控制器
+
+    inference线程每推理一个batch调用 record_infer() 上报耗时，
+    /offer 调用 check() 判断是否接纳，/capacity 调用 capacity() 上报剩余容量。
+    """
+
+    def __init__(self, opt, window: float = 10.0):
+        """
+        Args:
+            opt: 启动参数，使用 admission/max_session/admission_util/admission_max_mem/admission_gpu_reserve
+            window: 统计推理耗时的滑动窗口(秒)
+        """
+        self.mode = opt.admission
+        self.max_session = opt.max_session
+        self.target_fps = opt.fps / 2  # 视频25fps
+        self.target_util = opt.admission_util
+        self.max_mem = opt.admission_max_mem * 1024**2
+        self.gpu_reserve = opt.admission_gpu_reserve * 1024**2
+        self.window = window
+        self._samples = deque()  # (timestamp, frames, elapsed)
+        self._lock = threading.Lock()
+        self.baseline_rss = get_rss_bytes()
+
+    def record_infer(self, sessionid, frames: int, elapsed: float):
+        now = time.perf_counter()
+        with self._lock:
+            self._samples.append((now, frames, elapsed))
+            while self._samples and now - self._samples[0][0] > self.window:
+                self._samples.popleft()
+
+    def _infer_cost(self) -> Tuple[float, float]:
+        """返回 (每帧推理耗时秒, 窗口内推理忙碌占比)"""
+        from batchinfer import get_infer_service
+        now = time.perf_counter()
+        with self._lock:
+            samples = [s for s in self._samples if now - s[0] <= self.window]
+        frames = sum(s[1] for s in samples)
+        elapsed = sum(s[2] for s in samples)
+        util = elapsed / self.window
+        service = get_infer_service()
+        if service is not None:
+            #批处理模式下各会话的耗时包含排队时间，用服务的真实推理速度估算
+            stats = service.stats()
+            if stats['infer_fps'] > 0:
+                cost = 1.0 / stats['infer_fps']
+                return cost, frames * cost / self.window
+        if frames == 0:
+            return 0.0, 0.0
+        return elapsed / frames, util
+
+    def capacity(self, sessions: Iterable) -> dict:
+        """估算当前负载和还能容纳的会话数"""
+        sessions = list(sessions)
+        num = len(sessions)
+        cost, util = self._infer_cost()
+        rss = get_rss_bytes()
+        gpu_free, gpu_total = get_gpu_memory()
+        reason = ''
+
+        free = math.inf
+        if cost > 0:
+            #按每个会话都以25fps说话估算推理能力
+            per_session = self.target_fps * cost
+            free = math.floor(self.target_util / per_session) - num
+            if free <= 0:
+                reason = 'inference capacity'
+
+        #正在说话的会话视频队列见底，说明推理已跟不上
+        starving = 0
+        for nerfreal in sessions:
+            if nerfreal is None or not nerfreal.is_speaking():
+                continue
+            if nerfreal.get_queue_depths().get('video', 1) == 0:
+                starving += 1
+        if starving > 0 and starving * 2 >= num:
+            free = min(free, 0)
+            reason = 'render queues starving'
+
+        if self.max_mem > 0 and rss > 0:
+            per_session_mem = (rss - self.baseline_rss) / num if num > 0 else 0
+            if rss >= self.max_mem:
+                free = min(free, 0)
+                reason = 'memory'
+            elif per_session_mem > 0:
+                free = min(free, math.floor((self.max_mem - rss) / per_session_mem))
+        if self.gpu_reserve > 0 and gpu_total > 0 and gpu_free < self.gpu_reserve:
+            free = min(free, 0)
+            reason = 'gpu memory'
+
+        if self.mode != 'off' and self.max_session > 0:
+            free = min(free, self.max_session - num)
+            if free <= 0 and not reason:
+                reason = 'max session'
+
+        return {
+            'sessions': num,
+            'free_sessions': max(0, free) if free != math.inf else -1,  # -1: 尚无推理数据，容量未知
+            'infer_fps': 1.0 / cost if cost > 0 else 0.0,
+            'infer_util': util,
+            'target_fps': self.target_fps,
+            'rss_mb': rss / 1024**2,
+            'gpu_free_mb': gpu_free / 1024**2,
+            'gpu_total_mb': gpu_total / 1024**2,
+            'reason': reason,
+        }
+
+    def check(self, sessions: Iterable) -> Tuple[bool, str]:
+        """判断是否可以接纳一个新会话"""
+        if self.mode == 'off':
+            return True, ''
+        cap = self.capacity(sessions)
+        if cap['free_sessions'] == 0:
+            return False, cap['reason']
+        return True, ''
+
+    async def wait_for_capacity(self, sessions_fn, timeout: float) -> Tuple[bool, str]:
+        """排队等待容量，超时返回False"""
+        deadline = time.time() + timeout
+        while True:
+            ok, reason = self.check(sessions_fn())
+            if ok or time.time() >= deadline:
+                return ok, reason
+            await asyncio.sleep(0.5)
+
+
+# 全局实例
+_admission = None
+
+def init_admission(opt) -> AdmissionController:
+    global _admission
+    if _admission is None:
+        _admission = AdmissionController(opt)
+    return _admission
+
+def get_admission() -> Optional[AdmissionController]:
+    return _admission
@@ -36,13 +36,21 @@ from aiortc import RTCPeerConnection, RTCSessionDescription,RTCIceServer,RTCConf
 from aiortc.rtcrtpsender import RTCRtpSender
 from webrtc import HumanPlayer
 from basereal import BaseReal
-from llm import llm_response
+from llm import init_llm,get_llm
+from admission import init_admission,get_admission
+from avatarregistry import init_avatar_registry,get_avatar_registry
+from idlecache import init_idle_cache,idle_cache_stats
+from modelregistry import init_model_registry,get_model_registry
+import metrics
 
 import argparse
 import random
 import shutil
+import os
+import time
 import asyncio
 import torch
+import copy
 from typing import Dict
 from logger import logger
 import gc
@@ -54,10 +62,16 @@ nerfreals:Dict[int, BaseReal] = {} #sessionid:BaseReal
 opt = None
 model = None
 avatar = None
+session_pool = None
+session_manager = None
         
 
+RENDER_DIR = 'data/renders'
+
 #####webrtc###############################
 pcs = set()
+session_pcs:Dict[int, RTCPeerConnection] = {} #sessionid:当前连接，重连时被新连接取代
+pc_pool = []
 
 def randN(N)->int:
     '''生成长度为 N的随机数 '''
@@ -65,59 +79,140 @@ def randN(N)->int:
     max = pow(10, N)
     return random.randint(min, max - 1)
 
-def build_nerfreal(sessionid:int)->BaseReal:
-    opt.sessionid=sessionid
-    if opt.model == 'wav2lip':
-        from lipreal import LipReal
-        nerfreal = LipReal(opt,model,avatar)
-    elif opt.model == 'musetalk':
-        from musereal import MuseReal
-        nerfreal = MuseReal(opt,model,avatar)
-    # elif opt.model == 'ernerf':
-    #     from nerfreal import NeRFReal
-    #     nerfreal = NeRFReal(opt,model,avatar)
-    elif opt.model == 'ultralight':
-        from lightreal import LightReal
-        nerfreal = LightReal(opt,model,avatar)
+def new_sessionid()->int:
+    #预热池中正在构建或尚未取出的会话还不在nerfreals里，也要避开
+    sessionid = randN(6)
+    while sessionid in nerfreals or (session_pool is not None and session_pool.reserved(sessionid)):
+        sessionid = randN(6)
+    return sessionid
+
+def build_nerfreal(sessionid:int,avatar_id:str=None)->BaseReal:
+    #每个会话使用独立的opt副本，避免并发构建(预热池/按需)时sessionid互相覆盖
+    sessopt = copy.copy(opt)
+    sessopt.sessionid=sessionid
+    sessopt.avatar_id=avatar_id or opt.avatar_id
+    registry = get_avatar_registry()
+    avatar = registry.acquire(sessopt.avatar_id)
+    try:
+        if opt.model == 'wav2lip':
+            from lipreal import LipReal
+            nerfreal = LipReal(sessopt,model,avatar)
+        elif opt.model == 'musetalk':
+            from musereal import MuseReal
+            nerfreal = MuseReal(sessopt,model,avatar)
+        # elif opt.model == 'ernerf':
+        #     from nerfreal import NeRFReal
+        #     nerfreal = NeRFReal(opt,model,avatar)
+        elif opt.model == 'ultralight':
+            from lightreal import LightReal
+            nerfreal = LightReal(sessopt,model,avatar)
+    except Exception:
+        registry.release(sessopt.avatar_id)
+        raise
     return nerfreal
 
+def create_pc()->RTCPeerConnection:
+    #ice_server = RTCIceServer(urls='stun:stun.l.google.com:19302')
+    ice_server = RTCIceServer(urls='stun:stun.miwifi.com:3478')
+    return RTCPeerConnection(configuration=RTCConfiguration(iceServers=[ice_server]))
+
+def refill_pc_pool():
+    while len(pc_pool) < opt.session_pool:
+        pc_pool.append(create_pc())
+
+def acquire_pc()->RTCPeerConnection:
+    if opt.pool_pc and pc_pool:
+        pc = pc_pool.pop()
+        asyncio.get_event_loop().call_soon(refill_pc_pool)
+        return pc
+    return create_pc()
+
 #@app.route('/offer', methods=['POST'])
 async def offer(request):
     params = await request.json()
     offer = RTCSessionDescription(sdp=params["sdp"], type=params["type"])
+    #带上原sessionid的offer在宽限期内重新接入已断开的会话，只需要重新建立ICE/DTLS；
+    #会话仍在线时不接管，按新会话处理
+    player = None
+    if params.get('sessionid') is not None and opt.reconnect_grace>0:
+        player = session_manager.reattach(int(params['sessionid']))
+    if player is not None:
+        sessionid = int(params['sessionid'])
+        logger.info('sessionid=%d reconnect',sessionid)
+        return await answer_offer(offer,sessionid,player)
+
+    avatar_id = params.get('avatar_id') or opt.avatar_id
+    if not get_avatar_registry().exists(avatar_id):
+        return web.Response(
+            content_type="application/json",
+            text=json.dumps(
+                {"code": -1, "msg": f"avatar {avatar_id} not found"}
+            ),
+        )
 
-    # if len(nerfreals) >= opt.max_session:
-    #     logger.info('reach max session')
-    #     return web.Response(
-    #         content_type="application/json",
-    #         text=json.dumps(
-    #             {"code": -1, "msg": "reach max session"}
-    #         ),
-    #     )
-    sessionid = randN(6) #len(nerfreals)
-    nerfreals[sessionid] = None
-    logger.info('sessionid=%d, session num=%d',sessionid,len(nerfreals))
-    nerfreal = await asyncio.get_event_loop().run_in_executor(None, build_nerfreal,sessionid)
-    nerfreals[sessionid] = nerfreal
-    
-    #ice_server = RTCIceServer(urls='stun:stun.l.google.com:19302')
-    ice_server = RTCIceServer(urls='stun:stun.miwifi.com:3478')
-    pc = RTCPeerConnection(configuration=RTCConfiguration(iceServers=[ice_server]))
+    admission = get_admission()
+    if opt.admission=='queue':
+        ok,reason = await admission.wait_for_capacity(lambda:nerfreals.values(),opt.admission_timeout)
+    else:
+        ok,reason = admission.check(nerfreals.values())
+    if not ok:
+        logger.info('reject session: %s',reason)
+        return web.Response(
+            status=503,
+            headers={"Retry-After": "5"},
+            content_type="application/json",
+            text=json.dumps(
+                {"code": -1, "msg": f"server busy: {reason}"}
+            ),
+        )
+    #预热池中的会话都使用默认形象
+    pooled = None
+    if session_pool is not None and avatar_id==opt.avatar_id:
+        pooled = session_pool.acquire()
+    if pooled is not None:
+        sessionid,nerfreal = pooled
+        session_manager.adopt(sessionid)
+        nerfreals[sessionid] = nerfreal
+        logger.info('sessionid=%d(pooled), session num=%d',sessionid,len(nerfreals))
+    else:
+        sessionid = new_sessionid() #len(nerfreals)
+        nerfreals[sessionid] = None
+        logger.info('sessionid=%d, session num=%d',sessionid,len(nerfreals))
+        try:
+            nerfreal = await asyncio.get_event_loop().run_in_executor(None, session_manager.build,sessionid,avatar_id)
+        except Exception:
+            del nerfreals[sessionid]
+            raise
+        nerfreals[sessionid] = nerfreal
+
+    player = HumanPlayer(nerfreals[sessionid])
+    session_manager.attach_player(sessionid,player)
+    return await answer_offer(offer,sessionid,player)
+
+async def answer_offer(offer,sessionid,player):
+    pc = acquire_pc()
     pcs.add(pc)
+    old_pc = session_pcs.get(sessionid)
+    session_pcs[sessionid] = pc
+    if old_pc is not None: #旧连接可能还没检测到断开，先关闭，track只能由一个连接读取
+        await old_pc.close()
 
     @pc.on("connectionstatechange")
     async def on_connectionstatechange():
         logger.info("Connection state is %s" % pc.connectionState)
+        if pc.connectionState not in ("failed","closed"):
+            return
         if pc.connectionState == "failed":
             await pc.close()
-            pcs.discard(pc)
-            del nerfreals[sessionid]
-        if pc.connectionState == "closed":
-            pcs.discard(pc)
-            del nerfreals[sessionid]
-            # gc.collect()
+        pcs.discard(pc)
+        if session_pcs.get(sessionid) is not pc: #已被重连的新连接取代
+            return
+        del session_pcs[sessionid]
+        if opt.reconnect_grace>0:
+            session_manager.detach(sessionid,opt.reconnect_grace)
+        else:
+            await session_manager.close(sessionid)
 
-    player = HumanPlayer(nerfreals[sessionid])
     audio_sender = pc.addTrack(player.audio)
     video_sender = pc.addTrack(player.video)
     capabilities = RTCRtpSender.getCapabilities("video")
@@ -131,6 +226,7 @@ async def offer(request):
 
     answer = await pc.createAnswer()
     await pc.setLocalDescription(answer)
+    player.set_video_sender(video_sender,pc.localDescription.sdp)
 
     #return jsonify({"sdp": pc.localDescription.sdp, "type": pc.localDescription.type})
 
@@ -150,9 +246,9 @@ async def human(request):
             nerfreals[sessionid].flush_talk()
 
         if params['type']=='echo':
-            nerfreals[sessionid].put_msg_txt(params['text'])
+            nerfreals[sessionid].put_text(params['text'])
         elif params['type']=='chat':
-            asyncio.get_event_loop().run_in_executor(None, llm_response, params['text'],nerfreals[sessionid])                         
+            get_llm().start(params['text'],nerfreals[sessionid])
             #nerfreals[sessionid].put_msg_txt(res)
 
         return web.Response(
@@ -193,13 +289,29 @@ async def interrupt_talk(request):
         )
 
 async def humanaudio(request):
+    '''上传音频文件驱动口型，边接收边解码；sessionid字段需在file之前，或放在url参数中
+    (经--workers的路由进程转发时只能放在url参数中)'''
     try:
-        form= await request.post()
-        sessionid = int(form.get('sessionid',0))
-        fileobj = form["file"]
-        filename=fileobj.filename
-        filebytes=fileobj.file.read()
-        nerfreals[sessionid].put_audio_file(filebytes)
+        from audioingest import StreamingAudioDecoder
+        sessionid = int(request.query.get('sessionid',0))
+        reader = await request.multipart()
+        decoder = None
+        async for part in reader:
+            if part.name == 'sessionid':
+                sessionid = int(await part.text())
+            elif part.name == 'file':
+                decoder = StreamingAudioDecoder(nerfreals[sessionid])
+                decoder.start()
+                try:
+                    while True:
+                        chunk = await part.read_chunk(64*1024)
+                        if not chunk:
+                            break
+                        decoder.write(chunk)
+                finally:
+                    decoder.finish()
+        if decoder is None:
+            raise ValueError('no file uploaded')
 
         return web.Response(
             content_type="application/json",
@@ -216,6 +328,65 @@ async def humanaudio(request):
             ),
         )
 
+async def audio_ingest(request):
+    '''WebSocket实时推送音频，协议见 audioingest.py'''
+    sessionid = int(request.query.get('sessionid',0))
+    if nerfreals.get(sessionid) is None:
+        return web.Response(
+            content_type="application/json",
+            text=json.dumps(
+                {"code": -1, "msg": f"session {sessionid} not found"}
+            ),
+        )
+    import audioingest
+    return await audioingest.serve(request,nerfreals[sessionid],opt.ingest_buffer_ms)
+
+def run_offline_render(out_path:str,audio:bytes=None,text:str=None,avatar_id:str=None)->dict:
+    '''用独立的会话离线渲染一段视频，渲染完即销毁会话'''
+    from offline_render import render_offline
+    sessionid = new_sessionid()
+    nerfreal = build_nerfreal(sessionid,avatar_id)
+    try:
+        return render_offline(nerfreal,out_path,audio=audio,text=text)
+    finally:
+        nerfreal.close()
+        get_avatar_registry().release(nerfreal.opt.avatar_id)
+        metrics.remove_session(sessionid)
+
+async def render_clip(request):
+    '''离线渲染：json {"text":..,"avatar_id":..} 或 multipart 上传 file(可带avatar_id)，返回MP4地址和实时率'''
+    try:
+        if request.content_type == 'multipart/form-data':
+            form = await request.post()
+            audio = form["file"].file.read()
+            text = None
+            avatar_id = form.get('avatar_id')
+        else:
+            params = await request.json()
+            audio = None
+            text = params.get('text')
+            avatar_id = params.get('avatar_id')
+        if avatar_id and not get_avatar_registry().exists(avatar_id):
+            raise ValueError(f'avatar {avatar_id} not found')
+        name = f'{int(time.time())}_{randN(6)}.mp4'
+        result = await asyncio.get_event_loop().run_in_executor(
+            None, run_offline_render, os.path.join(RENDER_DIR,name), audio, text, avatar_id)
+        result['url'] = f'/renders/{name}'
+        return web.Response(
+            content_type="application/json",
+            text=json.dumps(
+                {"code": 0, "data": result}
+            ),
+        )
+    except Exception as e:
+        logger.exception('exception:')
+        return web.Response(
+            content_type="application/json",
+            text=json.dumps(
+                {"code": -1, "msg": str(e)}
+            ),
+        )
+
 async def set_audiotype(request):
     try:
         params = await request.json()
@@ -275,11 +446,100 @@ async def is_speaking(request):
     )
 
 
+async def events(request):
+    '''按会话推送说话状态和eventpoint(Server-Sent-Events)，代替轮询 /is_speaking'''
+    sessionid = int(request.query.get('sessionid',0))
+    if sessionid not in nerfreals:
+        return web.Response(
+            content_type="application/json",
+            text=json.dumps(
+                {"code": -1, "msg": f"session {sessionid} not found"}
+            ),
+        )
+    from eventhub import get_event_hub
+    return await get_event_hub().stream(request,sessionid)
+
+async def infer_stats(request):
+    from batchinfer import get_infer_service
+    service = get_infer_service()
+    return web.Response(
+        content_type="application/json",
+        text=json.dumps(
+            {"code": 0, "data": service.stats() if service is not None else None}
+        ),
+    )
+
+async def capacity(request):
+    return web.Response(
+        content_type="application/json",
+        text=json.dumps(
+            {"code": 0, "data": get_admission().capacity(nerfreals.values())}
+        ),
+    )
+
+async def metrics_handler(request):
+    metrics.SESSIONS.set(len(nerfreals))
+    metrics.QUEUE_DEPTH.clear()
+    for sessionid,nerfreal in list(nerfreals.items()):
+        if nerfreal is None:
+            continue
+        for name,depth in nerfreal.get_queue_depths().items():
+            metrics.QUEUE_DEPTH.set(depth,sessionid=sessionid,queue=name)
+    return web.Response(
+        body=metrics.render().encode('utf-8'),
+        headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8"},
+    )
+
+async def admin_sessions(request):
+    return web.Response(
+        content_type="application/json",
+        text=json.dumps(
+            {"code": 0, "data": session_manager.stats()}
+        ),
+    )
+
+async def admin_avatars(request):
+    return web.Response(
+        content_type="application/json",
+        text=json.dumps(
+            {"code": 0, "data": dict(get_avatar_registry().stats(),idle_cache=idle_cache_stats())}
+        ),
+    )
+
+async def admin_models(request):
+    return web.Response(
+        content_type="application/json",
+        text=json.dumps(
+            {"code": 0, "data": get_model_registry().stats()}
+        ),
+    )
+
+async def admin_llm(request):
+    return web.Response(
+        content_type="application/json",
+        text=json.dumps(
+            {"code": 0, "data": get_llm().stats()}
+        ),
+    )
+
+async def worker_stats(request):
+    return web.Response(
+        content_type="application/json",
+        text=json.dumps(
+            {"code": 0, "data": {"worker_id": opt.worker_id, "sessions": list(nerfreals.keys()),
+                                 "capacity": get_admission().capacity(nerfreals.values()),
+                                 "session_stats": session_manager.stats()}}
+        ),
+    )
+
 async def on_shutdown(app):
+    if session_pool is not None:
+        session_pool.stop()
     # close peer connections
-    coros = [pc.close() for pc in pcs]
+    coros = [pc.close() for pc in pcs] + [pc.close() for pc in pc_pool]
     await asyncio.gather(*coros)
     pcs.clear()
+    pc_pool.clear()
 
 async def post(url,data):
     try:
@@ -329,6 +589,8 @@ if __name__ == '__main__':
 
     #musetalk opt
     parser.add_argument('--avatar_id', type=str, default='avator_1', help="define which avatar in data/avatars")
+    parser.add_argument('--lazy_load', action='store_true', help="load model weights and the default avatar on first use instead of at startup")
+    parser.add_argument('--avatar_cache_mb', type=int, default=0, help="memory budget(MB) for loaded avatars, least recently used idle avatars are evicted, 0 to disable")
     #parser.add_argument('--bbox_shift', type=int, default=5)
     parser.add_argument('--batch_size', type=int, default=16, help="infer batch")
 
@@ -337,17 +599,48 @@ if __name__ == '__main__':
     parser.add_argument('--tts', type=str, default='edgetts', help="tts service type") #xtts gpt-sovits cosyvoice fishtts tencent doubao indextts2 azuretts
     parser.add_argument('--REF_FILE', type=str, default="zh-CN-YunxiaNeural",help="参考文件名或语音模型ID，默认值为 edgetts的语音模型ID zh-CN-YunxiaNeural, 若--tts指定为azuretts, 可以使用Azure语音模型ID, 如zh-CN-XiaoxiaoMultilingualNeural")
     parser.add_argument('--REF_TEXT', type=str, default=None)
+    parser.add_argument('--tts_segment_chars', type=int, default=0, help="min chars per tts request after the first clause, 0 uses the tts backend default")
     parser.add_argument('--TTS_SERVER', type=str, default='http://127.0.0.1:9880') # http://localhost:9000
     # parser.add_argument('--CHARACTER', type=str, default='test')
     # parser.add_argument('--EMOTION', type=str, default='default')
 
+    parser.add_argument('--llm_url', type=str, default=os.getenv('LLM_BASE_URL'), help="OpenAI compatible chat api base url, default dashscope")
+    parser.add_argument('--llm_model', type=str, default=os.getenv('LLM_MODEL'), help="chat model name, default qwen-plus")
+    parser.add_argument('--llm_cache_size', type=int, default=0, help="cache answers of up to N distinct questions, 0 to disable")
+    parser.add_argument('--llm_cache_ttl', type=float, default=3600, help="seconds a cached answer stays valid, 0 never expires")
+
     parser.add_argument('--model', type=str, default='musetalk') #musetalk wav2lip ultralight
 
     parser.add_argument('--transport', type=str, default='rtcpush') #webrtc rtcpush virtualcam
     parser.add_argument('--push_url', type=str, default='http://localhost:1985/rtc/v1/whip/?app=live&stream=livestream') #rtmp://localhost/live/livestream
 
     parser.add_argument('--max_session', type=int, default=1)  #multi session count
+    parser.add_argument('--reconnect_grace', type=float, default=0, help="seconds a session survives a dropped connection waiting for /offer with its sessionid, 0 closes it at once")
+    parser.add_argument('--batch_infer', action='store_true', help="share one batched inference service across sessions")
+    parser.add_argument('--batch_infer_max', type=int, default=64, help="max frames per cross-session batch")
+    parser.add_argument('--batch_infer_wait', type=float, default=10, help="max wait(ms) before running a partial batch")
+    parser.add_argument('--session_pool', type=int, default=0, help="number of pre-warmed sessions kept ready for /offer")
+    parser.add_argument('--pool_pc', action='store_true', help="also keep pre-created RTCPeerConnections in the pool")
+    parser.add_argument('--admission', type=str, default='off', choices=['off','reject','queue'], help="admission control for new sessions")
+    parser.add_argument('--admission_timeout', type=float, default=10, help="max seconds a new session waits in queue mode")
+    parser.add_argument('--admission_util', type=float, default=0.85, help="target inference utilization used to compute capacity")
+    parser.add_argument('--admission_max_mem', type=int, default=0, help="resident memory limit(MB), 0 to disable")
+    parser.add_argument('--admission_gpu_reserve', type=int, default=0, help="min free gpu memory(MB) to admit a session, 0 to disable")
+    parser.add_argument('--cpu_budget', type=int, default=0, help="total cpu cores shared by all sessions' torch/opencv threads, 0 to disable")
+    parser.add_argument('--thread_weights', type=str, default='', help="per stage share of a session's cores, e.g. infer=2,process=2, stages not listed get weight 1")
+    parser.add_argument('--cpu_affinity', action='store_true', help="pin each session's threads to its own cores")
+    parser.add_argument('--idle_cache', action='store_true', help="encode each avatar's idle loop to H264 once and send the cached packets while a session is silent")
+    parser.add_argument('--idle_gop', type=int, default=25, help="keyframe interval of the cached idle loop, live encoding can only switch to the cache at keyframes")
+    parser.add_argument('--paste_workers', type=int, default=1, help="threads per session for paste-back and frame conversion, frames stay in order; 1 to paste back on the output thread")
+    parser.add_argument('--render_ahead', type=int, default=0, help="max video frames rendered ahead of playback while queued speech is known, 0 to disable")
+    parser.add_argument('--ingest_buffer_ms', type=int, default=500, help="max audio backlog(ms) for /ws/audio, older audio is dropped beyond it")
+    parser.add_argument('--idle_hibernate', type=float, default=0, help="seconds without input before a session only plays its idle loop, 0 to disable")
+    parser.add_argument('--workers', type=int, default=0, help="run N worker processes behind an in-app router (webrtc only)")
+    parser.add_argument('--worker_id', type=int, default=-1, help=argparse.SUPPRESS)
     parser.add_argument('--listenport', type=int, default=8010, help="web listen port")
+    parser.add_argument('--offline_audio', type=str, default='', help="render this audio file to --offline_out and exit")
+    parser.add_argument('--offline_text', type=str, default='', help="render tts of this text to --offline_out and exit")
+    parser.add_argument('--offline_out', type=str, default='data/renders/offline.mp4', help="output mp4 of offline render")
     
     # RVM background removal options
     parser.add_argument('--enable_rvm', action='store_true', help="Enable RVM background removal for transparent background")
@@ -371,28 +664,68 @@ if __name__ == '__main__':
         with open(opt.customvideo_config,'r') as file:
             opt.customopt = json.load(file)
 
+    if opt.workers>0 and not (opt.offline_audio or opt.offline_text):
+        if opt.transport=='webrtc':
+            from shardrouter import run_router
+            run_router(opt)
+            exit(0)
+        logger.warning('--workers only supports webrtc transport, run in single process')
+
+    if opt.cpu_budget>0:
+        from threadbudget import init_thread_budget
+        init_thread_budget(opt.cpu_budget,opt.thread_weights,opt.cpu_affinity)
+
     # if opt.model == 'ernerf':       
     #     from nerfreal import NeRFReal,load_model,load_avatar
     #     model = load_model(opt)
     #     avatar = load_avatar(opt) 
+    #懒加载时模型和默认形象都推迟到第一个会话创建时加载，跳过预热
+    init_model_registry(opt.lazy_load)
+    init_idle_cache(opt.idle_gop)
+    init_llm(opt.llm_url,opt.llm_model,cache_size=opt.llm_cache_size,cache_ttl=opt.llm_cache_ttl)
     if opt.model == 'musetalk':
-        from musereal import MuseReal,load_model,load_avatar,warm_up
+        from musereal import MuseReal,load_model,load_avatar,warm_up,infer_batch
         logger.info(opt)
         model = load_model()
-        avatar = load_avatar(opt.avatar_id) 
-        warm_up(opt.batch_size,model)      
+        avatar_registry = init_avatar_registry(load_avatar,opt.avatar_cache_mb)
+        avatar_registry.pin(opt.avatar_id) #默认形象常驻，懒加载时第一次使用后也不会被淘汰
+        if not opt.lazy_load:
+            avatar = avatar_registry.acquire(opt.avatar_id)
+            warm_up(opt.batch_size,model)      
     elif opt.model == 'wav2lip':
-        from lipreal import LipReal,load_model,load_avatar,warm_up
+        from lipreal import LipReal,load_model,load_avatar,warm_up,infer_batch
         logger.info(opt)
         model = load_model("./models/wav2lip.pth")
-        avatar = load_avatar(opt.avatar_id)
-        warm_up(opt.batch_size,model,256)
+        avatar_registry = init_avatar_registry(load_avatar,opt.avatar_cache_mb)
+        avatar_registry.pin(opt.avatar_id) #默认形象常驻，懒加载时第一次使用后也不会被淘汰
+        if not opt.lazy_load:
+            avatar = avatar_registry.acquire(opt.avatar_id)
+            warm_up(opt.batch_size,model,256)
     elif opt.model == 'ultralight':
-        from lightreal import LightReal,load_model,load_avatar,warm_up
+        from lightreal import LightReal,load_model,load_avatar,warm_up,infer_batch
         logger.info(opt)
         model = load_model(opt)
-        avatar = load_avatar(opt.avatar_id)
-        warm_up(opt.batch_size,avatar,160)
+        avatar_registry = init_avatar_registry(load_avatar,opt.avatar_cache_mb)
+        avatar_registry.pin(opt.avatar_id) #默认形象常驻，懒加载时第一次使用后也不会被淘汰
+        if not opt.lazy_load:
+            avatar = avatar_registry.acquire(opt.avatar_id)
+            warm_up(opt.batch_size,avatar,160)
+
+    init_admission(opt)
+    from sessionmgr import SessionManager
+    session_manager = SessionManager(nerfreals,build_nerfreal)
+    if opt.batch_infer:
+        from batchinfer import init_infer_service
+        init_infer_service(infer_batch,opt.batch_infer_max,opt.batch_infer_wait/1000)
+
+    if opt.offline_audio or opt.offline_text:
+        audio = None
+        if opt.offline_audio:
+            with open(opt.offline_audio,'rb') as f:
+                audio = f.read()
+        result = run_offline_render(opt.offline_out,audio=audio,text=opt.offline_text)
+        print(json.dumps(result,indent=2,ensure_ascii=False))
+        exit(0)
 
     # if opt.transport=='rtmp':
     #     thread_quit = Event()
@@ -411,10 +744,21 @@ if __name__ == '__main__':
     appasync.router.add_post("/offer", offer)
     appasync.router.add_post("/human", human)
     appasync.router.add_post("/humanaudio", humanaudio)
+    appasync.router.add_get("/ws/audio", audio_ingest)
+    appasync.router.add_post("/render", render_clip)
     appasync.router.add_post("/set_audiotype", set_audiotype)
     appasync.router.add_post("/record", record)
     appasync.router.add_post("/interrupt_talk", interrupt_talk)
     appasync.router.add_post("/is_speaking", is_speaking)
+    appasync.router.add_get("/events", events)
+    appasync.router.add_get("/infer_stats", infer_stats)
+    appasync.router.add_get("/worker_stats", worker_stats)
+    appasync.router.add_get("/capacity", capacity)
+    appasync.router.add_get("/metrics", metrics_handler)
+    appasync.router.add_get("/admin/sessions", admin_sessions)
+    appasync.router.add_get("/admin/avatars", admin_avatars)
+    appasync.router.add_get("/admin/models", admin_models)
+    appasync.router.add_get("/admin/llm", admin_llm)
     
     # Add transparent video stream WebSocket if enabled
     if opt.enable_transparent_stream:
@@ -422,6 +766,8 @@ if __name__ == '__main__':
         appasync.router.add_get("/transparent_video", transparent_video_handler)
         logger.info("Transparent video stream enabled at /transparent_video")
     
+    os.makedirs(RENDER_DIR,exist_ok=True)
+    appasync.router.add_static('/renders',path=RENDER_DIR)
     appasync.router.add_static('/',path='web')
 
     # Configure default CORS settings.
@@ -443,9 +789,16 @@ if __name__ == '__main__':
         pagename='rtcpushapi.html'
     logger.info('start http server; http://<serverip>:'+str(opt.listenport)+'/'+pagename)
     logger.info('如果使用webrtc，推荐访问webrtc集成前端: http://<serverip>:'+str(opt.listenport)+'/dashboard.html')
+    if opt.session_pool>0 and opt.transport=='webrtc':
+        from sessionpool import SessionPool
+        session_pool = SessionPool(session_manager.prebuild,new_sessionid,opt.session_pool)
+        session_pool.start()
+
     def run_server(runner):
         loop = asyncio.new_event_loop()
         asyncio.set_event_loop(loop)
+        if opt.pool_pc and opt.session_pool>0:
+            loop.call_soon(refill_pc_pool)
         loop.run_until_complete(runner.setup())
         site = web.TCPSite(runner, '0.0.0.0', opt.listenport)
         loop.run_until_complete(site.start())
@@ -0,0 +1,354 @@
+###############################################################################
+#  Real-time audio ingest
+#  通过WebSocket接收外部推送的音频(16kHz PCM 或 Opus)，按20ms切块后直接
+#  送入会话的 put_audio_frame 驱动口型。
+#
+#  连接: ws://<server>/ws/audio?sessionid=N&codec=pcm|opus
+#  二进制消息: [uint32 seq, little-endian][payload]
+#      pcm : payload 为 16kHz 单声道 s16le 采样
+#      opus: payload 为一个 Opus 包(任意采样率，解码后重采样到16kHz)
+#  文本消息(JSON):
+#      {"type":"event","data":{...}}  附加到下一个音频块的eventpoint
+#      {"type":"end"}                 本段音频结束，补齐并送出剩余采样
+#      {"type":"flush"}               丢弃已缓存的音频(打断)
+#  服务端每收到25个音频包回复一次 {"type":"ack","seq":..,"buffered_ms":..,"dropped":..}
+#
+#  StreamingAudioDecoder 用于 /humanaudio：上传的文件边接收边在后台线程解码，
+#  解码出的音频立即送入会话，不必等整个文件上传和解码完成
+###############################################################################
+
+import json
+import time
+import queue
+import struct
+import threading
+
+import numpy as np
+import aiohttp
+from aiohttp import web
+
+from logger import logger
+import metrics
+
+HEADER = struct.Struct('<I')
+ACK_INTERVAL = 25
+
+
+class TrimResult:
+    def __init__(self):
+        self.dropped = []   #要丢弃的块的下标，升序
+        self.moved = {}     #下标 -> 移到这一块上的eventpoint
+
+
+def trim_backlog(eventpoints: list, max_buffer: int) -> TrimResult:
+    """
+    计算积压的音频块中要丢弃哪些，留出放入下一块的位置(剩余 max_buffer-1 块)
+
+    Args:
+        eventpoints: 按放入顺序排列的各块eventpoint
+        max_buffer: 最多积压的块数
+    """
+    result = TrimResult()
+    eventpoints = list(eventpoints)
+    remain = len(eventpoints)
+    i = 0
+    while remain >= max_buffer and i < len(eventpoints):
+        eventpoint = eventpoints[i]
+        if eventpoint:
+            if i + 1 < len(eventpoints) and not eventpoints[i + 1]:
+                eventpoints[i + 1] = eventpoint
+                result.moved[i + 1] = eventpoint
+            else: #下一块也有事件点，保留这一块
+                i += 1
+                continue
+        result.dropped.append(i)
+        result.moved.pop(i, None)
+        remain -= 1
+        i += 1
+    return result
+
+
+class AudioIngest:
+    """
+    单个连接的音频接收状态：序号检查、解码、切块和积压控制
+
+    积压控制：本连接送入会话ASR输入队列、尚未被取走的音频超过 max_buffer_ms 时丢弃其中最旧的块，
+    上游突发推送不会让口型延迟无限增长；TTS等其它来源放入的音频不受影响。
+    带eventpoint的块丢弃时事件点移到本连接的下一块，下一块也带事件点时保留该块，
+    客户端不会漏掉话语开始/结束的状态事件
+    """
+
+    def __init__(self, nerfreal, codec: str = 'pcm', max_buffer_ms: int = 500):
+        if codec not in ('pcm', 'opus'):
+            raise ValueError(f'unsupported codec {codec}')
+        self.nerfreal = nerfreal
+        self.codec = codec
+        self.chunk = nerfreal.chunk
+        self.max_buffer = max(1, max_buffer_ms // 20)
+        self.expected_seq = None
+        self.packets = 0
+        self.frames = 0
+        self.dropped = 0
+        self.gaps = 0
+        self.duplicates = 0
+        self._pending = np.zeros(0, dtype=np.float32)
+        self._datainfo = {}
+        self._pushed = {}   #id(音频块) -> 音频块，本连接送入ASR队列的块
+        if codec == 'opus':
+            import av
+            self._decoder = av.CodecContext.create('opus', 'r')
+            self._resampler = av.AudioResampler(format='s16', layout='mono', rate=16000)
+
+    def feed(self, data: bytes) -> bool:
+        """处理一个音频包，重复或过期的包返回False"""
+        if len(data) < HEADER.size:
+            raise ValueError('packet too short')
+        seq, = HEADER.unpack_from(data)
+        if self.expected_seq is not None:
+            if seq < self.expected_seq:
+                self.duplicates += 1
+                return False
+            if seq > self.expected_seq:
+                self.gaps += seq - self.expected_seq
+                logger.debug(f'audio ingest gap: expect seq {self.expected_seq}, got {seq}')
+        self.expected_seq = seq + 1
+        self.packets += 1
+        self._push(self._decode(memoryview(data)[HEADER.size:]))
+        return True
+
+    def _decode(self, payload) -> np.ndarray:
+        if self.codec == 'pcm':
+            if len(payload) % 2:
+                raise ValueError('pcm payload must be 16bit samples')
+            return np.frombuffer(payload, dtype='<i2').astype(np.float32) / 32768
+        import av
+        samples = []
+        for frame in self._decoder.decode(av.Packet(bytes(payload))):
+            for resampled in self._resampler.resample(frame):
+                samples.append(resampled.to_ndarray().reshape(-1))
+        if not samples:
+            return np.zeros(0, dtype=np.float32)
+        return np.concatenate(samples).astype(np.float32) / 32768
+
+    def _push(self, samples: np.ndarray):
+        if len(self._pending):
+            samples = np.concatenate((self._pending, samples))
+        count = len(samples) // self.chunk
+        for i in range(count):
+            self._trim()
+            chunk = samples[i*self.chunk:(i+1)*self.chunk]
+            self._pushed[id(chunk)] = chunk
+            self.nerfreal.put_audio_frame(chunk, self._datainfo)
+            self._datainfo = {}
+            self.frames += 1
+        self._pending = samples[count*self.chunk:]
+
+    def _trim(self):
+        """本连接的积压超过上限时丢弃其中最旧的音频块，保留事件点"""
+        q = self.nerfreal.asr.queue
+        with q.mutex: #ASR线程同时在取，直接操作队列内部的deque
+            items = q.queue
+            #已被ASR取走的块不再记录
+            queued = {id(item[0]): item[0] for item in items}
+            self._pushed = {key: chunk for key, chunk in queued.items() if key in self._pushed}
+            mine = [i for i, item in enumerate(items) if id(item[0]) in self._pushed]
+            drop = trim_backlog([items[i][1] for i in mine], self.max_buffer)
+            for k, eventpoint in drop.moved.items():
+                i = mine[k]
+                items[i] = (items[i][0], eventpoint)
+            for k in reversed(drop.dropped):
+                i = mine[k]
+                del self._pushed[id(items[i][0])]
+                del items[i]
+            dropped = len(drop.dropped)
+            if dropped:
+                q.not_full.notify(dropped) #唤醒阻塞在put上的生产者
+        if dropped:
+            self.dropped += dropped
+            metrics.FRAMES_DROPPED.inc(dropped, sessionid=self.nerfreal.sessionid, stage='ingest')
+
+    def set_event(self, data: dict):
+        self._datainfo = data or {}
+
+    def end(self):
+        """补零送出不足20ms的剩余采样"""
+        if len(self._pending):
+            self._push(np.zeros(self.chunk - len(self._pending), dtype=np.float32))
+
+    def flush(self):
+        self._pending = np.zeros(0, dtype=np.float32)
+        self._datainfo = {}
+        self.nerfreal.flush_talk()
+
+    def buffered_ms(self) -> int:
+        return self.nerfreal.asr.queue.qsize() * 20
+
+    def stats(self) -> dict:
+        return {
+            'seq': self.expected_seq,
+            'packets': self.packets,
+            'frames': self.frames,
+            'dropped': self.dropped,
+            'gaps': self.gaps,
+            'duplicates': self.duplicates,
+            'buffered_ms': self.buffered_ms(),
+        }
+
+
+class _BytesPipe:
+    """事件循环写入、解码线程阻塞读取的字节流，只有read()，解码器按不可seek的流处理"""
+
+    def __init__(self):
+        self._queue = queue.Queue()
+        self._buf = b''
+        self._eof = False
+        self.keep = True    #保留收到的全部数据，流式解码失败时整体解码
+        self.received = []
+
+    def feed(self, data: bytes):
+        if self.keep:
+            self.received.append(data)
+        self._queue.put(data)
+
+    def feed_eof(self):
+        self._queue.put(None)
+
+    def _fill(self) -> bool:
+        while not self._buf and not self._eof:
+            data = self._queue.get()
+            if data is None:
+                self._eof = True
+            else:
+                self._buf = data
+        return bool(self._buf)
+
+    def read(self, size: int = -1) -> bytes:
+        if size is None or size < 0:
+            out = []
+            while self._fill():
+                out.append(self._buf)
+                self._buf = b''
+            return b''.join(out)
+        if not self._fill():
+            return b''
+        out, self._buf = self._buf[:size], self._buf[size:]
+        return out
+
+
+class StreamingAudioDecoder:
+    """
+    上传音频的增量解码
+
+    使用方法:
+        decoder = StreamingAudioDecoder(nerfreal)
+        decoder.start()
+        decoder.write(chunk)   # 事件循环中，每收到一段请求体调用
+        decoder.finish()       # 请求体接收完毕
+    """
+
+    def __init__(self, nerfreal, datainfo: dict = None):
+        self.nerfreal = nerfreal
+        self.datainfo = datainfo or {}
+        self.chunk = nerfreal.chunk
+        self.frames = 0
+        self.first_frame_time = None
+        self._pipe = _BytesPipe()
+        self._pending = np.zeros(0, dtype=np.float32)
+        self._start_time = time.perf_counter()
+        self._thread = threading.Thread(target=self._run, daemon=True, name='audio-decode')
+
+    def start(self):
+        self._thread.start()
+
+    def write(self, data: bytes):
+        self._pipe.feed(data)
+
+    def finish(self):
+        self._pipe.feed_eof()
+
+    def _push(self, samples: np.ndarray):
+        if len(self._pending):
+            samples = np.concatenate((self._pending, samples))
+        count = len(samples) // self.chunk
+        for i in range(count):
+            self.nerfreal.put_audio_frame(samples[i*self.chunk:(i+1)*self.chunk], self.datainfo)
+            self.frames += 1
+        self._pending = samples[count*self.chunk:]
+        if self.frames and self.first_frame_time is None:
+            self.first_frame_time = time.perf_counter() - self._start_time
+            #已经开始送出音频，不再需要整体解码的后备数据
+            self._pipe.keep = False
+            self._pipe.received = []
+            logger.info(f'humanaudio first chunk after {self.first_frame_time*1000:.0f}ms')
+
+    def _flush(self):
+        """补零送出不足20ms的剩余采样，同 AudioIngest.end"""
+        if len(self._pending):
+            self._push(np.zeros(self.chunk - len(self._pending), dtype=np.float32))
+
+    def _run(self):
+        import av
+        try:
+            container = av.open(self._pipe, mode='r')
+            resampler = av.AudioResampler(format='s16', layout='mono', rate=16000)
+            for frame in container.decode(audio=0):
+                for resampled in resampler.resample(frame):
+                    self._push(resampled.to_ndarray().reshape(-1).astype(np.float32) / 32768)
+            #取出重采样器中缓存的尾部采样
+            for resampled in resampler.resample(None):
+                self._push(resampled.to_ndarray().reshape(-1).astype(np.float32) / 32768)
+            container.close()
+            self._flush()
+        except Exception as e:
+            if self.frames > 0:
+                logger.warning(f'humanaudio decode stopped after {self.frames} chunks: {e}')
+                self._pipe.read() #丢弃剩余的上传数据
+                return
+            #非流式格式(如moov在末尾的mp4)无法边收边解，收完后整体解码
+            logger.info(f'humanaudio streaming decode failed({e}), decode whole file')
+            self._pipe.read()
+            self.nerfreal.put_audio_file(b''.join(self._pipe.received), self.datainfo)
+            self._pipe.received = []
+            return
+        logger.info(f'humanaudio decoded {self.frames} chunks in {time.perf_counter()-self._start_time:.2f}s')
+
+
+async def serve(request: web.Request, nerfreal, max_buffer_ms: int = 500) -> web.WebSocketResponse:
+    """WebSocket音频推送接口"""
+    ws = web.WebSocketResponse(heartbeat=30)
+    await ws.prepare(request)
+    try:
+        ingest = AudioIngest(nerfreal, request.query.get('codec', 'pcm'), max_buffer_ms)
+    except Exception as e:
+        await ws.send_json({'type': 'error', 'msg': str(e)})
+        await ws.close()
+        return ws
+    logger.info(f'audio ingest opened for session {nerfreal.sessionid}, codec={ingest.codec}')
+    async for msg in ws:
+        if msg.type == aiohttp.WSMsgType.BINARY:
+            try:
+                accepted = ingest.feed(msg.data)
+            except Exception as e:
+                logger.warning(f'audio ingest packet error: {e}')
+                await ws.send_json({'type': 'error', 'msg': str(e)})
+                continue
+            if accepted and ingest.packets % ACK_INTERVAL == 0:
+                await ws.send_json({'type': 'ack', 'seq': ingest.expected_seq - 1,
+                                    'buffered_ms': ingest.buffered_ms(), 'dropped': ingest.dropped})
+        elif msg.type == aiohttp.WSMsgType.TEXT:
+            try:
+                cmd = json.loads(msg.data)
+            except ValueError:
+                await ws.send_json({'type': 'error', 'msg': 'invalid json'})
+                continue
+            if cmd.get('type') == 'event':
+                ingest.set_event(cmd.get('data'))
+            elif cmd.get('type') == 'end':
+                ingest.end()
+            elif cmd.get('type') == 'flush':
+                ingest.flush()
+        elif msg.type == aiohttp.WSMsgType.ERROR:
+            break
+    ingest.end()
+    logger.info(f'audio ingest closed for session {nerfreal.sessionid}: {ingest.stats()}')
+    return ws
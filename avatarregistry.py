@@ -0,0 +1,196 @@
+###############################################################################
+#  Avatar registry
+#  按avatar_id从data/avatars懒加载形象数据，多个形象共用同一份模型权重；
+#  超出内存预算时淘汰最久未使用且没有会话在用的形象
+###############################################################################
+
+import os
+import re
+import time
+import threading
+from collections import OrderedDict
+from typing import Callable, Dict, Optional
+
+import numpy as np
+import torch
+
+from logger import logger
+from idlecache import release_idle_cache
+from modelregistry import get_model_registry
+
+AVATAR_ROOT = './data/avatars'
+_AVATAR_ID_RE = re.compile(r'^[\w\-.]+$')
+
+
+def estimate_bytes(obj) -> int:
+    """估算形象数据(嵌套的list/tuple/dict中的ndarray和tensor)占用的内存，
+    不计模型注册表中多个形象共享的模型"""
+    if isinstance(obj, (list, tuple)):
+        return sum(estimate_bytes(item) for item in obj)
+    if isinstance(obj, dict):
+        return sum(estimate_bytes(item) for item in obj.values())
+    if isinstance(obj, np.ndarray):
+        return obj.nbytes
+    if isinstance(obj, torch.Tensor):
+        return obj.element_size() * obj.nelement()
+    if get_model_registry().owns(obj):
+        return 0
+    if isinstance(obj, torch.nn.Module):
+        return sum(p.element_size() * p.nelement() for p in obj.parameters())
+    return 0
+
+
+class AvatarEntry:
+    def __init__(self, avatar_id: str, data, nbytes: int, load_time: float):
+        self.avatar_id = avatar_id
+        self.data = data
+        self.nbytes = nbytes
+        self.load_time = load_time
+        self.refs = 0
+        self.last_used = time.time()
+
+    def info(self) -> dict:
+        return {
+            'avatar_id': self.avatar_id,
+            'size_mb': self.nbytes / 1024**2,
+            'refs': self.refs,
+            'load_time': self.load_time,
+            'last_used': self.last_used,
+        }
+
+
+class AvatarRegistry:
+    """
+    形象注册表
+
+    使用方法:
+        registry = AvatarRegistry(load_avatar, budget_mb=4096)
+        avatar = registry.acquire('avator_1')   # 会话创建时
+        registry.release('avator_1')            # 会话销毁时
+    """
+
+    def __init__(self, load_fn: Callable, budget_mb: int = 0, root: str = AVATAR_ROOT):
+        """
+        Args:
+            load_fn: 加载形象的函数 load_fn(avatar_id)，即各模型模块的 load_avatar
+            budget_mb: 已加载形象的内存预算(MB)，0表示不限制
+            root: 形象目录
+        """
+        self.load_fn = load_fn
+        self.budget = budget_mb * 1024**2
+        self.root = root
+        self._entries: 'OrderedDict[str, AvatarEntry]' = OrderedDict()  #按最近使用排序
+        self._lock = threading.Lock()
+        self._loading: Dict[str, threading.Lock] = {}
+        self._pinned = set()  #常驻形象，加载后不会被淘汰
+        self.loads = 0
+        self.hits = 0
+        self.evictions = 0
+
+    def exists(self, avatar_id: str) -> bool:
+        if not avatar_id or not _AVATAR_ID_RE.match(avatar_id) or avatar_id.startswith('.'):
+            return False
+        return os.path.isdir(os.path.join(self.root, avatar_id))
+
+    def list_avatars(self) -> list:
+        if not os.path.isdir(self.root):
+            return []
+        return sorted(name for name in os.listdir(self.root) if self.exists(name))
+
+    def acquire(self, avatar_id: str):
+        """获取形象数据并增加引用计数，未加载时在调用线程中加载"""
+        if not self.exists(avatar_id):
+            raise FileNotFoundError(f'avatar {avatar_id} not found in {self.root}')
+        with self._lock:
+            entry = self._take(avatar_id)
+            if entry is not None:
+                self.hits += 1
+                return entry.data
+            load_lock = self._loading.setdefault(avatar_id, threading.Lock())
+        #同一个形象只加载一次，不同形象可以并发加载
+        with load_lock:
+            with self._lock:
+                entry = self._take(avatar_id)
+                if entry is not None:
+                    self.hits += 1
+                    return entry.data
+            t = time.perf_counter()
+            data = self.load_fn(avatar_id)
+            entry = AvatarEntry(avatar_id, data, estimate_bytes(data), time.perf_counter() - t)
+            logger.info(f'avatar {avatar_id} loaded in {entry.load_time:.2f}s, {entry.nbytes/1024**2:.1f}MB')
+            with self._lock:
+                self._entries[avatar_id] = entry
+                self._loading.pop(avatar_id, None)
+                self.loads += 1
+                self._take(avatar_id)
+                self._evict()
+            return data
+
+    def pin(self, avatar_id: str):
+        """标记形象常驻：可以在加载之前调用，加载后不会被淘汰"""
+        if not self.exists(avatar_id):
+            raise FileNotFoundError(f'avatar {avatar_id} not found in {self.root}')
+        with self._lock:
+            self._pinned.add(avatar_id)
+
+    def release(self, avatar_id: str):
+        with self._lock:
+            entry = self._entries.get(avatar_id)
+            if entry is None:
+                return
+            entry.refs = max(0, entry.refs - 1)
+            entry.last_used = time.time()
+            self._evict()
+
+    def _take(self, avatar_id: str) -> Optional[AvatarEntry]:
+        entry = self._entries.get(avatar_id)
+        if entry is not None:
+            entry.refs += 1
+            entry.last_used = time.time()
+            self._entries.move_to_end(avatar_id)
+        return entry
+
+    def _evict(self):
+        """按最近最少使用淘汰没有会话引用的形象，直到满足内存预算"""
+        if self.budget <= 0:
+            return
+        total = sum(entry.nbytes for entry in self._entries.values())
+        for avatar_id in list(self._entries):
+            if total <= self.budget:
+                break
+            entry = self._entries[avatar_id]
+            if entry.refs > 0 or avatar_id in self._pinned:
+                continue
+            del self._entries[avatar_id]
+            release_idle_cache(avatar_id)
+            total -= entry.nbytes
+            self.evictions += 1
+            logger.info(f'evict avatar {avatar_id}, {entry.nbytes/1024**2:.1f}MB')
+        if total > self.budget:
+            logger.warning(f'avatars in use take {total/1024**2:.1f}MB, over budget {self.budget/1024**2:.1f}MB')
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                'budget_mb': self.budget / 1024**2,
+                'loaded_mb': sum(entry.nbytes for entry in self._entries.values()) / 1024**2,
+                'loads': self.loads,
+                'hits': self.hits,
+                'evictions': self.evictions,
+                'pinned': sorted(self._pinned),
+                'loaded': [entry.info() for entry in self._entries.values()],
+                'available': self.list_avatars(),
+            }
+
+
+# 全局实例
+_avatar_registry = None
+
+def init_avatar_registry(load_fn: Callable, budget_mb: int = 0) -> AvatarRegistry:
+    global _avatar_registry
+    if _avatar_registry is None:
+        _avatar_registry = AvatarRegistry(load_fn, budget_mb)
+    return _avatar_registry
+
+def get_avatar_registry() -> Optional[AvatarRegistry]:
+    return _avatar_registry
@@ -23,6 +23,7 @@ from queue import Queue
 import torch.multiprocessing as mp
 
 from basereal import BaseReal
+import metrics
 
 
 class BaseASR:
@@ -65,6 +66,8 @@ class BaseASR:
             else:
                 frame = np.zeros(self.chunk, dtype=np.float32)
                 type = 1
+                if self.parent:
+                    metrics.SILENCE_FRAMES.inc(sessionid=self.parent.sessionid)
             eventpoint = None
 
         return frame,type,eventpoint 
@@ -84,5 +87,10 @@ class BaseASR:
     def run_step(self):
         pass
 
+    def put_feat(self,feat):
+        '''特征带上当前的打断代数放入feat_queue，推理线程据此把打断前的特征和音频帧成对丢弃'''
+        cursor = getattr(self.parent,'frame_cursor',None)
+        self.feat_queue.put((cursor.generation if cursor is not None else 0,feat))
+
     def get_next_feat(self,block,timeout):        
-        return self.feat_queue.get(block,timeout)
\ No newline at end of file
+        return self.feat_queue.get(block,timeout)[1]
\ No newline at end of file
@@ -40,6 +40,13 @@ from fractions import Fraction
 
 from ttsreal import EdgeTTS,SovitsTTS,XTTS,CosyVoiceTTS,FishTTS,TencentTTS,DoubaoTTS,IndexTTS2,AzureTTS
 from logger import logger
+import metrics
+from threadbudget import apply_thread_budget,release_thread_budget
+from eventhub import get_event_hub,StateEvent
+from textsegmenter import TextSegmenter,segment_chars_for
+from compositor import FrameRing,ComposePool
+from framecursor import FrameCursor,drain_queue
+from idlecache import get_idle_cache
 
 from tqdm import tqdm
 
@@ -100,6 +107,20 @@ class BaseReal:
             self.tts = AzureTTS(opt,self)
 
         self.speaking = False
+        self.frame_cursor = FrameCursor()
+        self.interrupt_event = Event()  #打断请求，渲染线程在下一轮清空各级队列
+        self.interrupt_start = None     #打断请求时间(说话中才记录)，用于统计打断到静音的延迟
+        self.interrupt_time = None
+        self.interrupt_latency = None
+        self.last_active = time.time()
+        self.hibernating = False
+        self.audio_track = None
+        self.video_track = None
+        self.loop = None
+        self.llm_tasks = set()  #进行中的LLM对话任务，打断时取消
+        self.frame_sink = None #离线渲染时接收合成好的帧 frame_sink(image,audio_frames)
+        self.frame_ring = FrameRing(3) #贴回的输出缓冲，帧在process_frames的一轮内用完
+        self.compose_pool = None #--paste_workers>1时的合成线程池
 
         self.recording = False
         self._record_video_pipe = None
@@ -202,9 +223,22 @@ class BaseReal:
         return self.rvm_processor.process_frame_rgba(frame)
 
     def put_msg_txt(self,msg,datainfo:dict={}):
+        self.wake()
         self.tts.put_msg_txt(msg,datainfo)
     
+    def new_segmenter(self,emit=None)->TextSegmenter:
+        '''按当前TTS后端配置的文本分段器，片段默认送入put_msg_txt'''
+        chars = getattr(self.opt,'tts_segment_chars',0) or segment_chars_for(self.opt.tts)
+        return TextSegmenter(emit or self.put_msg_txt,chars,on_start=self.tts.mark_utterance)
+
+    def put_text(self,text,datainfo:dict={}):
+        '''整段文本分段后送入TTS，第一段尽快开始合成'''
+        segmenter = self.new_segmenter(lambda segment: self.put_msg_txt(segment,datainfo))
+        segmenter.feed(text)
+        segmenter.flush()
+    
     def put_audio_frame(self,audio_chunk,datainfo:dict={}): #16khz 20ms pcm
+        self.wake()
         self.asr.put_audio_frame(audio_chunk,datainfo)
 
     def put_audio_file(self,filebyte,datainfo:dict={}): 
@@ -234,11 +268,159 @@ class BaseReal:
         return stream
 
     def flush_talk(self):
+        '''打断当前说话：TTS和ASR输入队列立即清空，其余各级队列由渲染线程在下一轮清空'''
         self.tts.flush_talk()
         self.asr.flush_talk()
+        for task in list(self.llm_tasks): #可能在非事件循环线程调用
+            task.get_loop().call_soon_threadsafe(task.cancel)
+        if self.speaking:
+            self.interrupt_start = time.perf_counter()
+        self.interrupt_event.set()
+
+    def drain_pipeline(self):
+        '''渲染线程中调用：清空打断前的音频、特征、推理结果和待播放帧，
+        帧序号退回到最后一帧已送出画面之后，待机画面从打断处继续'''
+        self.interrupt_event.clear()
+        cursor = self.frame_cursor
+        #推理线程取音频帧、放结果帧都持有cursor.lock，只在加generation和清空内部队列时持有
+        dropped = cursor.interrupt(self.res_frame_queue,self.asr.feat_queue,self.asr.output_queue)
+        #恢复warm_up后的对齐：输出队列比特征领先r帧，ASR上下文换成静音。
+        #特征只在本线程的run_step中产生，返回之前推理线程取不到新特征，不会动这些音频帧
+        silence = np.zeros(self.chunk, dtype=np.float32)
+        self.asr.frames = [silence]*(self.asr.stride_left_size+self.asr.stride_right_size)
+        for _ in range(self.asr.stride_right_size):
+            self.asr.output_queue.put((silence,1,None))
+        if self.video_track is not None:
+            #待播放帧在锁外清空，FrameQueue可在本线程直接取出，不经事件循环往返
+            tracked = self._drain_tracks()
+            cursor.rewind(tracked)
+            dropped += tracked
+        if dropped:
+            metrics.FRAMES_DROPPED.inc(dropped,sessionid=self.sessionid,stage='interrupt')
+        get_event_hub().publish(self.sessionid,'interrupt',{'dropped':dropped})
+        self.interrupt_time,self.interrupt_start = self.interrupt_start,None
+        logger.info(f'session {self.sessionid} interrupted, {dropped} frames dropped')
+
+    def _drain_tracks(self)->int:
+        '''清空待播放的音视频帧，返回丢弃的视频帧数'''
+        drain_queue(self.audio_track._queue)
+        return drain_queue(self.video_track._queue)
 
     def is_speaking(self)->bool:
         return self.speaking
+
+    def render_delay(self,video_track,threshold:float)->float:
+        '''渲染循环每轮之后的等待时间。threshold为实时模式下视频队列允许积压的帧数；
+        开启render_ahead且已知的语音领先于播放时，提前渲染最多render_ahead帧来吸收推理抖动'''
+        if video_track is None:
+            return 0
+        qsize = video_track._queue.qsize()
+        ahead = getattr(self.opt,'render_ahead',0)
+        if ahead>threshold and self.asr.queue.qsize()>=self.batch_size*2:
+            if qsize<ahead:
+                return 0
+            return 0.04*self.batch_size*0.8 #缓冲已满，等播放消耗大约一批
+        if qsize>=threshold:
+            return 0.04*qsize*0.8
+        return 0
+
+    def wake(self):
+        '''有新的输入，退出休眠'''
+        self.last_active = time.time()
+        if self.hibernating:
+            self.hibernating = False
+            logger.info(f'session {self.sessionid} resume')
+
+    def check_hibernate(self)->bool:
+        '''渲染循环每轮调用，返回本轮是否只输出待机画面'''
+        idle = getattr(self.opt,'idle_hibernate',0)
+        if idle<=0 or self.hibernating:
+            return self.hibernating
+        if time.time()-self.last_active < idle or self.speaking or self.curr_state>1:
+            return False
+        if not self.tts.msgqueue.empty() or not self.asr.queue.empty():
+            return False
+        try:
+            if self.asr.feat_queue.qsize()>0: #等推理线程取走已提取的特征
+                return False
+        except NotImplementedError: #mp.Queue on macOS
+            pass
+        self.hibernating = True
+        #wake()可能在上面的判断之后才更新last_active，这里再确认一次
+        if time.time()-self.last_active < idle:
+            self.hibernating = False
+            return False
+        logger.info(f'session {self.sessionid} hibernate after {idle}s idle')
+        return True
+
+    def idle_step(self):
+        '''休眠时代替asr.run_step：不提取特征、不推理，直接输出一批待机帧和静音'''
+        index = self.frame_cursor.claim(self.batch_size)
+        length = len(self.frame_list_cycle)
+        silence = np.zeros(self.chunk, dtype=np.float32)
+        for i in range(self.batch_size):
+            self.res_frame_queue.put((None,self.mirror_index(length,index+i),[(silence,1,None),(silence,1,None)]))
+
+    def owned_bytes(self)->int:
+        '''会话独占数据(自定义动作图片/音频、队列中的帧)占用的字节数'''
+        total = 0
+        for frames in self.custom_img_cycle.values():
+            total += sum(frame.nbytes for frame in frames)
+        for stream in self.custom_audio_cycle.values():
+            total += stream.nbytes
+        if hasattr(self,'asr'):
+            total += sum(item[0].nbytes for item in list(self.asr.queue.queue))
+        return total
+
+    def close(self,timeout:float=5)->bool:
+        '''释放会话资源，需在渲染线程退出后调用。返回所有线程是否都已退出'''
+        self.stop_recording()
+        self.tts.flush_talk()
+        alive = False
+        if self.tts.thread is not None:
+            self.tts.thread.join(timeout)
+            alive = self.tts.thread.is_alive()
+            self.tts.thread = None
+        queues = [self.tts.msgqueue]
+        if hasattr(self,'asr'):
+            queues += [self.asr.queue,self.asr.output_queue,self.asr.feat_queue]
+            self.asr.frames = []
+        if hasattr(self,'res_frame_queue'):
+            queues.append(self.res_frame_queue)
+        for q in queues:
+            try:
+                while True:
+                    q.get_nowait()
+            except queue.Empty:
+                pass
+            if hasattr(q,'cancel_join_thread'): #mp.Queue
+                q.close()
+                q.cancel_join_thread()
+        self.custom_img_cycle.clear()
+        self.custom_audio_cycle.clear()
+        self.audio_track = None
+        self.video_track = None
+        return not alive
+
+    def get_queue_depths(self)->dict:
+        '''各级队列当前长度'''
+        queues = {'tts':self.tts.msgqueue}
+        if hasattr(self,'asr'):
+            queues['asr'] = self.asr.queue
+            queues['feat'] = self.asr.feat_queue
+        if hasattr(self,'res_frame_queue'):
+            queues['res_frame'] = self.res_frame_queue
+        if self.video_track is not None:
+            queues['video'] = self.video_track._queue
+        if self.audio_track is not None:
+            queues['audio'] = self.audio_track._queue
+        depths = {}
+        for name,q in queues.items():
+            try:
+                depths[name] = q.qsize()
+            except NotImplementedError: #mp.Queue on macOS
+                pass
+        return depths
     
     def __loadcustom(self):
         for item in self.opt.customopt:
@@ -259,7 +441,12 @@ class BaseReal:
             self.custom_index[key]=0
 
     def notify(self,eventpoint):
+        '''帧实际送出时调用，推送给订阅了该会话事件的客户端'''
+        if isinstance(eventpoint,StateEvent):
+            get_event_hub().publish(self.sessionid,'state',dict(eventpoint))
+            return
         logger.info("notify:%s",eventpoint)
+        get_event_hub().publish(self.sessionid,'eventpoint',eventpoint)
 
     def start_recording(self):
         """开始录制视频"""
@@ -360,6 +547,8 @@ class BaseReal:
         self._record_video_pipe.wait()
         self._record_audio_pipe.stdin.close()
         self._record_audio_pipe.wait()
+        self._record_video_pipe = None
+        self._record_audio_pipe = None
         cmd_combine_audio = f"ffmpeg -y -i temp{self.opt.sessionid}.aac -i temp{self.opt.sessionid}.mp4 -c:v copy -c:a copy data/record.mp4"
         os.system(cmd_combine_audio) 
         #os.remove(output_path)
@@ -385,13 +574,56 @@ class BaseReal:
         print('set_custom_state:',audiotype)
         if self.custom_audio_index.get(audiotype) is None:
             return
+        self.wake()
         self.curr_state = audiotype
         if reinit:
             self.custom_audio_index[audiotype] = 0
             self.custom_index[audiotype] = 0
 
+    def _compose_frame(self,res_frame,idx:int,to_video:bool):
+        '''贴回一帧说话帧，to_video时同时转换成VideoFrame，在合成线程池中执行'''
+        t = time.perf_counter()
+        frame = self.paste_back_frame(res_frame,idx)
+        metrics.PASTE_BACK.observe(time.perf_counter()-t,sessionid=self.sessionid)
+        return frame,(VideoFrame.from_ndarray(frame, format="bgr24") if to_video else None)
+
+    def _next_frame(self,pool:ComposePool,to_video:bool):
+        '''
+        取下一帧 (res_frame,idx,audio_frames,composed)
+        使用合成线程池时预取后面的帧并提交说话帧的贴回，composed为贴回结果的Future，按原顺序返回
+        '''
+        if pool is None:
+            res_frame,idx,audio_frames = self.res_frame_queue.get(block=True, timeout=1)
+            return res_frame,idx,audio_frames,None
+        while True:
+            while not pool.full():
+                try: #还有在途的帧时不等待，先输出最早的帧
+                    res_frame,idx,audio_frames = self.res_frame_queue.get(block=not pool.pending(), timeout=1)
+                except queue.Empty:
+                    if not pool.pending():
+                        raise
+                    break
+                item = (res_frame,idx,audio_frames,self.frame_cursor.generation)
+                if audio_frames[0][1]!=0 and audio_frames[1][1]!=0: #静音帧不需要贴回
+                    pool.submit(None,tag=item)
+                else:
+                    pool.submit(self._compose_frame,res_frame,idx,to_video,tag=item)
+            composed,(res_frame,idx,audio_frames,gen) = pool.pop()
+            if gen == self.frame_cursor.generation:
+                return res_frame,idx,audio_frames,composed
+            metrics.FRAMES_DROPPED.inc(sessionid=self.sessionid,stage='interrupt') #打断前预取的帧
+
+    def _put_track(self,track,item,quit_event):
+        '''把帧交给track播放，队列满时等待recv取走，会话退出时放弃'''
+        while not track._queue.put(item,timeout=0.5):
+            if quit_event.is_set():
+                return
+
     def process_frames(self,quit_event,loop=None,audio_track=None,video_track=None):
         enable_transition = False  # 设置为False禁用过渡效果，True启用
+        self.audio_track = audio_track
+        self.video_track = video_track
+        self.loop = loop
         
         if enable_transition:
             _last_speaking = False
@@ -407,12 +639,28 @@ class BaseReal:
             audio_tmp = queue.Queue(maxsize=3000)
             audio_thread = Thread(target=play_audio, args=(quit_event,audio_tmp,), daemon=True, name="pyaudio_stream")
             audio_thread.start()
-        
+
+        #合成线程池：贴回和转换VideoFrame在多个线程中并行，帧仍按顺序和音频一起输出
+        pool = None
+        if getattr(self.opt,'paste_workers',1)>1:
+            pool = ComposePool(self.opt.paste_workers,self.sessionid)
+            self.frame_ring = FrameRing(max(self.frame_ring.size,pool.max_pending+2)) #在途的帧加上正在输出的帧
+            self.compose_pool = pool
+        #RVM和过渡效果会改变贴回后的帧，这时在输出前再转换VideoFrame
+        to_video = self.opt.transport!='virtualcam' and self.frame_sink is None and not self.enable_rvm and not enable_transition
+        #静音帧直接发送预编码的待机循环(协商为H264时)
+        use_idle_cache = to_video and getattr(self.opt,'idle_cache',False)
+        last_idx = None
+
+        last_speaking = None
         while not quit_event.is_set():
+            apply_thread_budget('process',self.sessionid)
             try:
-                res_frame,idx,audio_frames = self.res_frame_queue.get(block=True, timeout=1)
+                res_frame,idx,audio_frames,composed = self._next_frame(pool,to_video)
             except queue.Empty:
                 continue
+            video_frame = None
+            prev_idx,last_idx = last_idx,idx
             
             if enable_transition:
                 # 检测状态变化
@@ -424,6 +672,10 @@ class BaseReal:
 
             if audio_frames[0][1]!=0 and audio_frames[1][1]!=0: #全为静音数据，只需要取fullimg
                 self.speaking = False
+                if self.interrupt_time is not None: #打断后的第一帧静音
+                    self.interrupt_latency = time.perf_counter()-self.interrupt_time
+                    self.interrupt_time = None
+                    metrics.INTERRUPT_LATENCY.observe(self.interrupt_latency,sessionid=self.sessionid)
                 audiotype = audio_frames[0][1]
                 if self.custom_index.get(audiotype) is not None: #有自定义视频
                     mirindex = self.mirror_index(len(self.custom_img_cycle[audiotype]),self.custom_index[audiotype])
@@ -431,6 +683,11 @@ class BaseReal:
                     self.custom_index[audiotype] += 1
                 else:
                     target_frame = self.frame_list_cycle[idx]
+                    if use_idle_cache and video_track.codec=='H264':
+                        cache = get_idle_cache(self.opt.avatar_id,self.frame_list_cycle)
+                        pos = cache.position(prev_idx,idx)
+                        if pos is not None:
+                            video_frame = cache.packet(pos) #track在不能接续时再现场编码
                 
                 if enable_transition:
                     # 说话→静音过渡
@@ -446,9 +703,13 @@ class BaseReal:
             else:
                 self.speaking = True
                 try:
-                    current_frame = self.paste_back_frame(res_frame,idx)
+                    if composed is not None:
+                        current_frame,video_frame = composed.result()
+                    else:
+                        current_frame,video_frame = self._compose_frame(res_frame,idx,to_video)
                 except Exception as e:
                     logger.warning(f"paste_back_frame error: {e}")
+                    metrics.FRAMES_DROPPED.inc(sessionid=self.sessionid,stage='paste_back')
                     continue
                 if enable_transition:
                     # 静音→说话过渡
@@ -462,10 +723,24 @@ class BaseReal:
                 else:
                     combine_frame = current_frame
 
+            if self.frame_sink is not None: #离线渲染，不做实时输出
+                self.frame_sink(combine_frame,audio_frames)
+                continue
+
+            #说话状态变化时在对应视频帧上附加标记，帧送出时再通知客户端
+            state_event = None
+            if self.speaking != last_speaking:
+                last_speaking = self.speaking
+                state_event = StateEvent(speaking=self.speaking)
+
             if self.opt.transport=='virtualcam':
+                if state_event is not None:
+                    self.notify(state_event)
                 # 应用RVM背景去除（绿幕输出）
                 if self.enable_rvm:
+                    t = time.perf_counter()
                     combine_frame = self.apply_rvm(combine_frame)
+                    metrics.RVM_TIME.observe(time.perf_counter()-t,sessionid=self.sessionid)
                 if vircam==None:
                     height, width = combine_frame.shape[:2]
                     vircam = pyvirtualcam.Camera(width=width, height=height, fps=25, fmt=pyvirtualcam.PixelFormat.BGR, print_fps=True)
@@ -473,6 +748,7 @@ class BaseReal:
             else: #webrtc
                 # 应用RVM背景去除
                 if self.enable_rvm:
+                    t = time.perf_counter()
                     # 如果启用透明流，同时获取BGRA和绿幕BGR（共享一次推理）
                     if self.enable_transparent_stream and self.transparent_stream:
                         bgra_frame, combine_frame = self.apply_rvm_both(combine_frame)
@@ -480,9 +756,10 @@ class BaseReal:
                     else:
                         # 只需要绿幕输出
                         combine_frame = self.apply_rvm(combine_frame)
+                    metrics.RVM_TIME.observe(time.perf_counter()-t,sessionid=self.sessionid)
                         
-                new_frame = VideoFrame.from_ndarray(combine_frame, format="bgr24")
-                asyncio.run_coroutine_threadsafe(video_track._queue.put((new_frame,None)), loop)
+                new_frame = video_frame if video_frame is not None else VideoFrame.from_ndarray(combine_frame, format="bgr24")
+                self._put_track(video_track,(new_frame,state_event),quit_event)
             self.record_video_data(combine_frame)
 
             for audio_frame in audio_frames:
@@ -491,17 +768,22 @@ class BaseReal:
 
                 if self.opt.transport=='virtualcam':
                     audio_tmp.put(frame.tobytes()) #TODO
+                    if eventpoint:
+                        self.notify(eventpoint)
                 else: #webrtc
                     new_frame = AudioFrame(format='s16', layout='mono', samples=frame.shape[0])
                     new_frame.planes[0].update(frame.tobytes())
                     new_frame.sample_rate=16000
-                    asyncio.run_coroutine_threadsafe(audio_track._queue.put((new_frame,eventpoint)), loop)
+                    self._put_track(audio_track,(new_frame,eventpoint),quit_event)
                 self.record_audio_data(frame)
             if self.opt.transport=='virtualcam':
                 vircam.sleep_until_next_frame()
+        if pool is not None:
+            pool.shutdown()
         if self.opt.transport=='virtualcam':
             audio_thread.join()
             vircam.close()
+        release_thread_budget('process',self.sessionid)
         logger.info('basereal process_frames thread stop') 
     
     # def process_custom(self,audiotype:int,idx:int):
@@ -0,0 +1,281 @@
+###############################################################################
+#  Cross-session dynamic batching inference service
+#  多会话共享的动态批处理推理服务：收集所有会话待推理的batch，
+#  在延迟期限内合并成一次模型调用，再把结果分发回各会话
+###############################################################################
+
+import time
+import threading
+from threading import Thread, Event, Condition
+from collections import OrderedDict, deque
+from typing import Callable, Dict, Optional
+
+import numpy as np
+import torch
+
+from logger import logger
+
+
+class InferRequest:
+    """单个会话提交的一次推理请求"""
+
+    def __init__(self, sessionid, model, inputs: tuple, count: int):
+        self.sessionid = sessionid
+        self.model = model
+        self.inputs = inputs
+        self.count = count
+        self.submit_time = time.perf_counter()
+        self.start_time = 0.0
+        self.result = None
+        self.error = None
+        self.done = Event()
+
+
+class BatchInferService:
+    """
+    跨会话动态批处理推理服务
+
+    各会话的inference线程调用 infer() 提交自己的batch并阻塞等待结果；
+    服务线程按会话轮询(round-robin)取请求，凑满 max_batch 帧或等到
+    max_wait 期限后，用同一个模型做一次批量推理。
+
+    使用方法:
+        service = BatchInferService(infer_batch, max_batch=64, max_wait=0.01)
+        service.start()
+        pred = service.infer(sessionid, model, (mel_batch, img_batch))
+    """
+
+    def __init__(self, infer_fn: Callable, max_batch: int = 64, max_wait: float = 0.01):
+        """
+        Args:
+            infer_fn: 批量推理函数 infer_fn(model, *inputs)，返回可按第0维切片的结果
+            max_batch: 一次合并推理的最大帧数
+            max_wait: 最早请求的最长等待时间(秒)，超时即使未凑满也开始推理
+        """
+        self.infer_fn = infer_fn
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+
+        self._pending: "OrderedDict[int, deque]" = OrderedDict()  # sessionid -> 待处理请求
+        self._cond = Condition()
+        self._quit = Event()
+        self._thread: Optional[Thread] = None
+
+        # 统计信息
+        self._stats_lock = threading.Lock()
+        self._batch_count = 0
+        self._frame_count = 0
+        self._session_in_batch = 0
+        self._infer_time = 0.0
+        self._session_stats: Dict[int, dict] = {}
+
+    def start(self):
+        if self._thread is None:
+            self._quit.clear()
+            self._thread = Thread(target=self._run, name="batch-infer", daemon=True)
+            self._thread.start()
+            logger.info(f"batch infer service start, max_batch={self.max_batch}, max_wait={self.max_wait*1000:.1f}ms")
+
+    def stop(self):
+        self._quit.set()
+        with self._cond:
+            self._cond.notify_all()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        # 唤醒所有仍在等待的会话
+        with self._cond:
+            for reqs in self._pending.values():
+                for req in reqs:
+                    req.error = RuntimeError("batch infer service stopped")
+                    req.done.set()
+            self._pending.clear()
+
+    def infer(self, sessionid, model, inputs: tuple):
+        """提交一个batch并阻塞等待结果"""
+        count = len(inputs[0])
+        req = InferRequest(sessionid, model, inputs, count)
+        with self._cond:
+            if self._quit.is_set():
+                raise RuntimeError("batch infer service stopped")
+            self._pending.setdefault(sessionid, deque()).append(req)
+            self._cond.notify()
+        req.done.wait()
+        if req.error is not None:
+            raise req.error
+        self._record_session(req)
+        return req.result
+
+    def release(self, sessionid):
+        """会话结束时清理其统计信息"""
+        with self._cond:
+            reqs = self._pending.pop(sessionid, None)
+            if reqs:
+                for req in reqs:
+                    req.error = RuntimeError("session released")
+                    req.done.set()
+        with self._stats_lock:
+            self._session_stats.pop(sessionid, None)
+
+    def _pending_frames(self, model) -> int:
+        total = 0
+        for reqs in self._pending.values():
+            for req in reqs:
+                if req.model is model:
+                    total += req.count
+        return total
+
+    def _oldest(self) -> Optional[InferRequest]:
+        oldest = None
+        for reqs in self._pending.values():
+            if reqs and (oldest is None or reqs[0].submit_time < oldest.submit_time):
+                oldest = reqs[0]
+        return oldest
+
+    def _collect(self) -> list:
+        """等待并取出一批请求，只合并使用同一模型的请求"""
+        with self._cond:
+            while not self._quit.is_set():
+                oldest = self._oldest()
+                if oldest is None:
+                    self._cond.wait(0.1)
+                    continue
+                deadline = oldest.submit_time + self.max_wait
+                remaining = deadline - time.perf_counter()
+                if remaining > 0 and self._pending_frames(oldest.model) < self.max_batch:
+                    self._cond.wait(remaining)
+                    continue
+                return self._take(oldest.model)
+        return []
+
+    def _take(self, model) -> list:
+        """按会话轮询取请求，保证各会话公平"""
+        batch = []
+        total = 0
+        served = []
+        progress = True
+        while progress and total < self.max_batch:
+            progress = False
+            for sessionid, reqs in self._pending.items():
+                if not reqs or reqs[0].model is not model:
+                    continue
+                if batch and total + reqs[0].count > self.max_batch:
+                    continue
+                req = reqs.popleft()
+                batch.append(req)
+                total += req.count
+                served.append(sessionid)
+                progress = True
+                if total >= self.max_batch:
+                    break
+        # 本轮被服务的会话移到队尾，下一轮优先其他会话
+        for sessionid in dict.fromkeys(served):
+            reqs = self._pending.pop(sessionid)
+            if reqs:
+                self._pending[sessionid] = reqs
+        return batch
+
+    @staticmethod
+    def _concat(parts: list):
+        if isinstance(parts[0], torch.Tensor):
+            return torch.cat(parts, dim=0)
+        return np.concatenate(parts, axis=0)
+
+    def _run(self):
+        while not self._quit.is_set():
+            batch = self._collect()
+            if not batch:
+                continue
+            t = time.perf_counter()
+            for req in batch:
+                req.start_time = t
+            try:
+                if len(batch) == 1:
+                    inputs = batch[0].inputs
+                else:
+                    inputs = tuple(self._concat([req.inputs[i] for req in batch])
+                                   for i in range(len(batch[0].inputs)))
+                result = self.infer_fn(batch[0].model, *inputs)
+                offset = 0
+                for req in batch:
+                    req.result = result[offset:offset + req.count]
+                    offset += req.count
+            except Exception as e:
+                logger.exception('batch infer error')
+                for req in batch:
+                    req.error = e
+            elapsed = time.perf_counter() - t
+            for req in batch:
+                req.done.set()
+            self._record_batch(batch, elapsed)
+        logger.info('batch infer service stop')
+
+    def _record_batch(self, batch: list, elapsed: float):
+        frames = sum(req.count for req in batch)
+        with self._stats_lock:
+            self._batch_count += 1
+            self._frame_count += frames
+            self._session_in_batch += len(set(req.sessionid for req in batch))
+            self._infer_time += elapsed
+            batch_count = self._batch_count
+        if batch_count % 100 == 0:
+            stats = self.stats()
+            logger.info(f"------batch infer: avg batch={stats['avg_batch_size']:.1f} "
+                        f"fill={stats['fill_ratio']:.2f} sessions/batch={stats['avg_sessions_per_batch']:.2f} "
+                        f"fps={stats['infer_fps']:.1f} fairness={stats['fairness']:.3f}")
+
+    def _record_session(self, req: InferRequest):
+        now = time.perf_counter()
+        with self._stats_lock:
+            s = self._session_stats.setdefault(req.sessionid, {
+                'requests': 0, 'frames': 0, 'wait_time': 0.0, 'latency': 0.0})
+            s['requests'] += 1
+            s['frames'] += req.count
+            s['wait_time'] += req.start_time - req.submit_time
+            s['latency'] += now - req.submit_time
+
+    def stats(self) -> dict:
+        """批处理效率和各会话公平性统计"""
+        with self._stats_lock:
+            batch_count = self._batch_count
+            sessions = {}
+            for sessionid, s in self._session_stats.items():
+                n = max(s['requests'], 1)
+                sessions[sessionid] = {
+                    'requests': s['requests'],
+                    'frames': s['frames'],
+                    'avg_wait_ms': s['wait_time'] / n * 1000,
+                    'avg_latency_ms': s['latency'] / n * 1000,
+                }
+            result = {
+                'batches': batch_count,
+                'frames': self._frame_count,
+                'avg_batch_size': self._frame_count / batch_count if batch_count else 0.0,
+                'fill_ratio': self._frame_count / (batch_count * self.max_batch) if batch_count else 0.0,
+                'avg_sessions_per_batch': self._session_in_batch / batch_count if batch_count else 0.0,
+                'infer_fps': self._frame_count / self._infer_time if self._infer_time > 0 else 0.0,
+                'sessions': sessions,
+            }
+        # Jain公平性指数(基于各会话平均等待时间)，1表示完全公平
+        waits = [s['avg_latency_ms'] for s in sessions.values()]
+        if waits and sum(w * w for w in waits) > 0:
+            result['fairness'] = sum(waits) ** 2 / (len(waits) * sum(w * w for w in waits))
+        else:
+            result['fairness'] = 1.0
+        return result
+
+
+# 全局实例
+_infer_service = None
+
+def init_infer_service(infer_fn: Callable, max_batch: int = 64, max_wait: float = 0.01) -> BatchInferService:
+    """创建并启动全局批处理推理服务"""
+    global _infer_service
+    if _infer_service is None:
+        _infer_service = BatchInferService(infer_fn, max_batch, max_wait)
+        _infer_service.start()
+    return _infer_service
+
+def get_infer_service() -> Optional[BatchInferService]:
+    """获取批处理推理服务，未启用时返回None"""
+    return _infer_service
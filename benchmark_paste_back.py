@@ -0,0 +1,168 @@
+"""
+贴回(paste-back)基准测试
+模拟一个形象的背景帧循环，比较每帧 deepcopy 背景和使用 FrameRing 预分配缓冲的
+吞吐(帧/秒)，以及每帧新分配的内存(tracemalloc统计numpy的分配)。
+muse-* 模式比较MuseTalk的浮点mask混合(get_image_blending)和预计算定点alpha的
+整数混合(blend_face)，并输出两者结果的最大差值。--workers 大于1时同时测试
+ComposePool 多线程按顺序贴回的吞吐和各线程利用率
+
+用法:
+    python benchmark_paste_back.py --width 1920 --height 1080 --frames 500
+"""
+
+import copy
+import time
+import argparse
+import tracemalloc
+
+import cv2
+import numpy as np
+
+from compositor import FrameRing, ComposePool
+from musetalk.myutil import get_image_blending, prepare_blend_mask, blend_face
+
+
+def make_avatar(width: int, height: int, count: int, face: int):
+    rng = np.random.default_rng(0)
+    frames = [rng.integers(0, 255, (height, width, 3), dtype=np.uint8) for _ in range(count)]
+    y1, x1 = height // 3, width // 2 - face // 2
+    boxes = [(y1, y1 + face, x1, x1 + face) for _ in range(count)]
+    pred = rng.integers(0, 255, (256, 256, 3), dtype=np.uint8)
+    return frames, boxes, pred
+
+
+def make_masks(boxes):
+    """和genavatar_musetalk一样：人脸框扩大1.5倍为crop_box，mask只保留下半部分并模糊边缘"""
+    masks, crop_boxes, blend_masks = [], [], []
+    for y1, y2, x1, x2 in boxes:
+        s = int(max(x2 - x1, y2 - y1) // 2 * 1.5)
+        xc, yc = (x1 + x2) // 2, (y1 + y2) // 2
+        crop_box = (xc - s, yc - s, xc + s, yc + s)
+        mask = np.zeros((2 * s, 2 * s), dtype=np.uint8)
+        mask[y1 - crop_box[1]:y2 - crop_box[1], x1 - crop_box[0]:x2 - crop_box[0]] = 255
+        mask[:s] = 0
+        k = int(0.1 * 2 * s // 2 * 2) + 1
+        mask = cv2.GaussianBlur(mask, (k, k), 0)
+        masks.append(cv2.cvtColor(mask, cv2.COLOR_GRAY2BGR))
+        crop_boxes.append(crop_box)
+        blend_masks.append(prepare_blend_mask(mask, (x1, y1, x2, y2), crop_box))
+    return masks, crop_boxes, blend_masks
+
+
+def paste_deepcopy(frames, boxes, pred, idx, ring):
+    y1, y2, x1, x2 = boxes[idx]
+    combine_frame = copy.deepcopy(frames[idx])
+    combine_frame[y1:y2, x1:x2] = cv2.resize(pred, (x2 - x1, y2 - y1))
+    return combine_frame
+
+
+def paste_ring(frames, boxes, pred, idx, ring):
+    y1, y2, x1, x2 = boxes[idx]
+    combine_frame = ring.acquire(frames, idx, (y1, y2, x1, x2))
+    combine_frame[y1:y2, x1:x2] = cv2.resize(pred, (x2 - x1, y2 - y1))
+    return combine_frame
+
+
+def muse_float(frames, boxes, pred, idx, ring):
+    y1, y2, x1, x2 = boxes[idx]
+    face = cv2.resize(pred, (x2 - x1, y2 - y1))
+    return get_image_blending(copy.deepcopy(frames[idx]), face, (x1, y1, x2, y2),
+                              MASKS[0][idx], MASKS[1][idx])
+
+
+def muse_fixed(frames, boxes, pred, idx, ring):
+    y1, y2, x1, x2 = boxes[idx]
+    face = cv2.resize(pred, (x2 - x1, y2 - y1))
+    out = ring.acquire(frames, idx, (y1, y2, x1, x2))
+    return blend_face(out, face, (x1, y1, x2, y2), MASKS[2][idx])
+
+
+MODES = {
+    'deepcopy': paste_deepcopy,
+    'ring': paste_ring,
+    'muse-float': muse_float,
+    'muse-fixed': muse_fixed,
+}
+MASKS = None
+
+
+def mirror_index(size: int, index: int) -> int:
+    turn = index // size
+    res = index % size
+    return res if turn % 2 == 0 else size - res - 1
+
+
+def run(fn, frames, boxes, pred, count: int) -> dict:
+    ring = FrameRing(3)
+    #预热：让环形缓冲完成分配
+    for i in range(ring.size):
+        fn(frames, boxes, pred, mirror_index(len(frames), i), ring)
+    t = time.perf_counter()
+    for i in range(count):
+        fn(frames, boxes, pred, mirror_index(len(frames), i), ring)
+    elapsed = time.perf_counter() - t
+
+    #单独统计分配，tracemalloc本身会拖慢执行
+    tracemalloc.start()
+    alloc = 0
+    for i in range(min(count, 50)):
+        tracemalloc.reset_peak()
+        base = tracemalloc.get_traced_memory()[0]
+        out = fn(frames, boxes, pred, mirror_index(len(frames), i), ring)
+        alloc += tracemalloc.get_traced_memory()[1] - base
+        del out
+    tracemalloc.stop()
+    return {'fps': count / elapsed, 'alloc_kb_per_frame': alloc / min(count, 50) / 1024}
+
+
+def run_pool(fn, frames, boxes, pred, count: int, workers: int) -> dict:
+    pool = ComposePool(workers)
+    ring = FrameRing(pool.max_pending + 2)
+    t = time.perf_counter()
+    for i in range(count):
+        if pool.full():
+            future, _ = pool.pop()
+            future.result()
+        pool.submit(fn, frames, boxes, pred, mirror_index(len(frames), i), ring)
+    while pool.pending():
+        future, _ = pool.pop()
+        future.result()
+    elapsed = time.perf_counter() - t
+    stats = pool.stats()
+    pool.shutdown()
+    return {'fps': count / elapsed, 'utilisation': stats['utilisation']}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--width', type=int, default=1920)
+    parser.add_argument('--height', type=int, default=1080)
+    parser.add_argument('--face', type=int, default=300, help="face roi size")
+    parser.add_argument('--cycle', type=int, default=50, help="background frames in the avatar cycle")
+    parser.add_argument('--frames', type=int, default=500)
+    parser.add_argument('--modes', nargs='+', default=list(MODES))
+    parser.add_argument('--workers', type=int, default=1, help="also run each mode on a ComposePool with this many threads")
+    args = parser.parse_args()
+
+    global MASKS
+    frames, boxes, pred = make_avatar(args.width, args.height, args.cycle, args.face)
+    MASKS = make_masks(boxes)
+    print(f"{args.width}x{args.height}, face {args.face}px, {args.frames} frames")
+    print(f"{'mode':>10} {'frames/s':>10} {'alloc KB/frame':>15}")
+    for mode in args.modes:
+        res = run(MODES[mode], frames, boxes, pred, args.frames)
+        print(f"{mode:>10} {res['fps']:>10.1f} {res['alloc_kb_per_frame']:>15.1f}")
+        if args.workers > 1:
+            res = run_pool(MODES[mode], frames, boxes, pred, args.frames, args.workers)
+            print(f"{'x' + str(args.workers):>10} {res['fps']:>10.1f}  utilisation {res['utilisation']}")
+    if 'muse-float' in args.modes and 'muse-fixed' in args.modes:
+        diff = 0
+        for i in range(args.cycle):
+            a = muse_float(frames, boxes, pred, i, None)
+            b = muse_fixed(frames, boxes, pred, i, FrameRing(1)).astype(np.int16)
+            diff = max(diff, int(np.abs(a.astype(np.int16) - b).max()))
+        print(f"max pixel difference muse-float vs muse-fixed: {diff}")
+
+
+if __name__ == '__main__':
+    main()
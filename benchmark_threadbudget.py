@@ -0,0 +1,95 @@
+"""
+线程预算基准测试
+模拟 N 个会话，每个会话有推理线程(torch CPU卷积)和贴回线程(OpenCV缩放/模糊)，
+比较不使用线程预算(每个调用开满核心)和使用 ThreadBudget 时的总吞吐，
+可用 --weights 比较不同的阶段权重
+
+用法:
+    python benchmark_threadbudget.py --sessions 1 2 4 8 --seconds 10 --weights infer=2,process=2
+"""
+
+import os
+import time
+import argparse
+import threading
+
+import cv2
+import numpy as np
+import torch
+
+from threadbudget import ThreadBudget, parse_weights
+
+
+def infer_worker(stop, counter, sessionid, budget):
+    conv = torch.nn.Conv2d(6, 32, 3, padding=1).eval()
+    x = torch.randn(4, 6, 96, 96)
+    with torch.no_grad():
+        while not stop.is_set():
+            if budget is not None:
+                budget.apply('infer', sessionid)
+            conv(x)
+            counter[0] += 1
+    if budget is not None:
+        budget.release('infer', sessionid)
+
+
+def process_worker(stop, counter, sessionid, budget):
+    frame = np.random.randint(0, 255, (1080, 1920, 3), dtype=np.uint8)
+    face = np.random.randint(0, 255, (256, 256, 3), dtype=np.uint8)
+    while not stop.is_set():
+        if budget is not None:
+            budget.apply('process', sessionid)
+        out = frame.copy()
+        out[400:700, 800:1100] = cv2.resize(face, (300, 300))
+        cv2.GaussianBlur(out[400:700, 800:1100], (5, 5), 0)
+        counter[0] += 1
+    if budget is not None:
+        budget.release('process', sessionid)
+
+
+def run(sessions: int, seconds: float, budget) -> dict:
+    if budget is None:
+        #默认行为：每个调用都使用全部核心
+        torch.set_num_threads(os.cpu_count())
+        cv2.setNumThreads(os.cpu_count())
+    stop = threading.Event()
+    infer_counters = [[0] for _ in range(sessions)]
+    process_counters = [[0] for _ in range(sessions)]
+    threads = []
+    for k in range(sessions):
+        threads.append(threading.Thread(target=infer_worker, args=(stop, infer_counters[k], k, budget)))
+        threads.append(threading.Thread(target=process_worker, args=(stop, process_counters[k], k, budget)))
+    for t in threads:
+        t.start()
+    time.sleep(seconds)
+    stop.set()
+    for t in threads:
+        t.join()
+    infer = sum(c[0] for c in infer_counters) / seconds
+    process = sum(c[0] for c in process_counters) / seconds
+    return {'infer_batches_per_s': infer, 'frames_per_s': process,
+            'min_session_fps': min(c[0] for c in process_counters) / seconds}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sessions', type=int, nargs='+', default=[1, 2, 4, 8])
+    parser.add_argument('--seconds', type=float, default=10)
+    parser.add_argument('--cores', type=int, default=os.cpu_count())
+    parser.add_argument('--affinity', action='store_true')
+    parser.add_argument('--weights', type=str, default='', help="stage weights, e.g. infer=2,process=2; empty for equal shares")
+    args = parser.parse_args()
+
+    weights = parse_weights(args.weights)
+    print(f"cpu cores: {os.cpu_count()}, budget: {args.cores}, affinity: {args.affinity}, weights: {weights}")
+    print(f"{'sessions':>8} {'mode':>10} {'infer/s':>10} {'frames/s':>10} {'min sess fps':>13}")
+    for n in args.sessions:
+        for mode in ('default', 'budget'):
+            budget = ThreadBudget(args.cores, weights, args.affinity) if mode == 'budget' else None
+            res = run(n, args.seconds, budget)
+            print(f"{n:>8} {mode:>10} {res['infer_batches_per_s']:>10.1f} "
+                  f"{res['frames_per_s']:>10.1f} {res['min_session_fps']:>13.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,94 @@
+"""
+渲染线程到track的帧交接基准测试
+模拟多个会话：每个会话一个渲染线程按批(batch_size帧，推理按2倍实时速度)送入视频帧
+和两倍的音频帧，事件循环中每个track按实时速度取帧(同PlayerStreamTrack.recv)。
+比较每帧 run_coroutine_threadsafe(asyncio.Queue.put) 和 FrameQueue 直接交接时
+事件循环线程的CPU占用
+
+用法:
+    python benchmark_track_queue.py --sessions 20 --seconds 10
+"""
+
+import time
+import asyncio
+import argparse
+import threading
+
+from framequeue import FrameQueue
+
+VIDEO_PTIME = 0.040
+AUDIO_PTIME = 0.020
+
+
+def producer(quit_event, loop, mode, video, audio, batch_size):
+    """渲染线程：每批batch_size帧，播放缓冲超过两批时等待(同render_delay)"""
+    while not quit_event.is_set():
+        time.sleep(VIDEO_PTIME * batch_size * 0.5)  #推理耗时
+        for _ in range(batch_size):
+            items = [(video, ('frame', None))] + [(audio, ('frame', None))] * 2
+            for q, item in items:
+                if mode == 'asyncio':
+                    asyncio.run_coroutine_threadsafe(q.put(item), loop)
+                else:
+                    while not q.put(item, timeout=0.5) and not quit_event.is_set():
+                        pass
+        while video.qsize() >= batch_size * 2 and not quit_event.is_set():
+            time.sleep(VIDEO_PTIME * batch_size * 0.8)
+
+
+async def consumer(q, ptime, stop_at):
+    start = time.time()
+    count = 0
+    while time.time() < stop_at:
+        await q.get()
+        count += 1
+        wait = start + count * ptime - time.time()
+        if wait > 0:
+            await asyncio.sleep(wait)
+    return count
+
+
+async def run(mode: str, sessions: int, seconds: float, batch_size: int) -> dict:
+    loop = asyncio.get_running_loop()
+    quit_event = threading.Event()
+    consumers, threads = [], []
+    stop_at = time.time() + seconds
+    for _ in range(sessions):
+        if mode == 'asyncio':
+            video, audio = asyncio.Queue(maxsize=100), asyncio.Queue(maxsize=200)
+        else:
+            video, audio = FrameQueue(maxsize=100), FrameQueue(maxsize=200)
+        consumers.append(consumer(video, VIDEO_PTIME, stop_at))
+        consumers.append(consumer(audio, AUDIO_PTIME, stop_at))
+        thread = threading.Thread(target=producer, args=(quit_event, loop, mode, video, audio, batch_size), daemon=True)
+        threads.append(thread)
+    cpu = time.thread_time()
+    wall = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    counts = await asyncio.gather(*consumers)
+    cpu = time.thread_time() - cpu
+    wall = time.perf_counter() - wall
+    quit_event.set()
+    for thread in threads:
+        thread.join()
+    return {'loop_cpu': cpu / wall, 'video_fps': sum(counts[::2]) / wall / sessions}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sessions', type=int, default=20)
+    parser.add_argument('--seconds', type=float, default=10)
+    parser.add_argument('--batch_size', type=int, default=16)
+    parser.add_argument('--modes', nargs='+', default=['asyncio', 'framequeue'])
+    args = parser.parse_args()
+
+    print(f"{args.sessions} sessions, batch {args.batch_size}, {args.seconds}s")
+    print(f"{'mode':>12} {'loop CPU %':>11} {'video fps/session':>18}")
+    for mode in args.modes:
+        res = asyncio.run(run(mode, args.sessions, args.seconds, args.batch_size))
+        print(f"{mode:>12} {res['loop_cpu'] * 100:>11.1f} {res['video_fps']:>18.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,160 @@
+###############################################################################
+#  Output frame compositor
+#  贴回时不再对每帧背景做 deepcopy：输出写入一组预分配的缓冲(环形复用)，
+#  背景用一次整帧拷贝填充；缓冲上次的内容来自同一背景帧时只恢复上次写过的区域。
+#  ComposePool 把贴回和转换VideoFrame分给多个线程并行(OpenCV/NumPy执行时释放GIL)，
+#  结果按提交顺序取出
+###############################################################################
+
+import time
+import threading
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+import metrics
+
+Box = Tuple[int, int, int, int]  #(y1, y2, x1, x2)，与numpy切片顺序一致
+
+
+class FrameRing:
+    """
+    预分配的输出帧环形缓冲
+
+    使用方法:
+        ring = FrameRing(size=4)
+        frame = ring.acquire(frame_list_cycle, idx, (y1, y2, x1, x2))
+        frame[y1:y2, x1:x2] = face     # 只能写声明的区域
+
+    返回的缓冲在之后第size次acquire时被复用，调用方需在此之前用完
+    (VideoFrame.from_ndarray、录制管道、虚拟摄像头都会复制数据)
+    """
+
+    def __init__(self, size: int = 4):
+        self.size = size
+        self._buffers: List[Optional[np.ndarray]] = [None] * size
+        self._sources: List[Optional[Tuple[int, int]]] = [None] * size  #缓冲当前内容来自哪个背景帧
+        self._dirty: List[Optional[Box]] = [None] * size                #缓冲上次被写过的区域
+        self._next = 0
+        self._lock = threading.Lock()
+        self.allocations = 0
+        self.full_copies = 0
+        self.roi_restores = 0
+
+    def acquire(self, backgrounds: Sequence[np.ndarray], idx: int, box: Box) -> np.ndarray:
+        """
+        取下一个输出缓冲，内容为背景帧 backgrounds[idx]
+
+        Args:
+            backgrounds: 背景帧列表(形象的 frame_list_cycle)
+            idx: 背景帧序号
+            box: 调用方随后要写入的区域 (y1, y2, x1, x2)
+        """
+        background = backgrounds[idx]
+        source = (id(backgrounds), idx)
+        with self._lock:
+            slot = self._next
+            self._next = (slot + 1) % self.size
+            buf = self._buffers[slot]
+            if buf is None or buf.shape != background.shape or buf.dtype != background.dtype:
+                buf = np.empty_like(background)
+                self._buffers[slot] = buf
+                self._sources[slot] = None
+                self.allocations += 1
+            if self._sources[slot] == source and self._dirty[slot] is not None:
+                y1, y2, x1, x2 = self._dirty[slot]
+                buf[y1:y2, x1:x2] = background[y1:y2, x1:x2]
+                self.roi_restores += 1
+            else:
+                np.copyto(buf, background)
+                self.full_copies += 1
+            self._sources[slot] = source
+            self._dirty[slot] = box
+        return buf
+
+    def stats(self) -> dict:
+        return {
+            'size': self.size,
+            'allocations': self.allocations,
+            'full_copies': self.full_copies,
+            'roi_restores': self.roi_restores,
+        }
+
+
+class ComposePool:
+    """
+    合成线程池，按提交顺序输出
+
+    使用方法:
+        pool = ComposePool(workers=4, sessionid=sessionid)
+        pool.submit(compose, frame, idx, tag=audio_frames)
+        pool.submit(None, tag=silent_item)  # 不需要合成的帧只占位，保持顺序
+        future, tag = pool.pop()            # 最早提交的任务，占位时future为None
+        result = future.result()
+
+    在途的任务最多 max_pending 个，输出缓冲(FrameRing)的大小需大于该数量
+    """
+
+    def __init__(self, workers: int, sessionid=0, max_pending: int = 0):
+        """
+        Args:
+            workers: 线程数
+            sessionid: 用于线程名和指标标签
+            max_pending: 最多在途的任务数，默认线程数的两倍
+        """
+        self.workers = workers
+        self.sessionid = sessionid
+        self.max_pending = max_pending or workers * 2
+        self._executor = ThreadPoolExecutor(workers, thread_name_prefix=f'compose{sessionid}')
+        self._pending: deque = deque()
+        self._lock = threading.Lock()
+        self._busy: Dict[str, float] = {}  #线程名 -> 累计忙碌时间
+        self._start = time.perf_counter()
+        self.jobs = 0
+
+    def _run(self, fn: Callable, args: tuple):
+        name = threading.current_thread().name
+        t = time.perf_counter()
+        try:
+            return fn(*args)
+        finally:
+            elapsed = time.perf_counter() - t
+            with self._lock:
+                self._busy[name] = self._busy.get(name, 0.0) + elapsed
+            metrics.COMPOSE_BUSY.inc(elapsed, sessionid=self.sessionid, worker=name.rsplit('_', 1)[-1])
+
+    def submit(self, fn: Optional[Callable], *args, tag=None) -> Optional[Future]:
+        future = self._executor.submit(self._run, fn, args) if fn is not None else None
+        self._pending.append((future, tag))
+        self.jobs += 1
+        return future
+
+    def pending(self) -> int:
+        return len(self._pending)
+
+    def full(self) -> bool:
+        return len(self._pending) >= self.max_pending
+
+    def pop(self) -> Tuple[Optional[Future], object]:
+        return self._pending.popleft()
+
+    def shutdown(self):
+        for future, _ in self._pending:
+            if future is not None:
+                future.cancel()
+        self._pending.clear()
+        self._executor.shutdown(wait=True)
+
+    def stats(self) -> dict:
+        elapsed = max(1e-6, time.perf_counter() - self._start)
+        with self._lock:
+            busy = dict(self._busy)
+        return {
+            'workers': self.workers,
+            'max_pending': self.max_pending,
+            'pending': len(self._pending),
+            'jobs': self.jobs,
+            'utilisation': {name.rsplit('_', 1)[-1]: round(b / elapsed, 3) for name, b in sorted(busy.items())},
+        }
@@ -0,0 +1,149 @@
+###############################################################################
+#  Session event hub
+#  按会话推送说话状态变化和TTS事件点(eventpoint)，代替前端轮询 /is_speaking。
+#  事件在帧真正送出(PlayerStreamTrack.recv)时发布，和音视频播放对齐
+###############################################################################
+
+import json
+import time
+import asyncio
+import threading
+from typing import Dict, Optional, Set
+
+from aiohttp import web
+
+from logger import logger
+
+
+class StateEvent(dict):
+    """随视频帧传递的状态标记，区别于TTS附加在音频帧上的eventpoint"""
+
+
+class EventHub:
+    """
+    会话事件分发
+
+    使用方法:
+        hub = get_event_hub()
+        hub.publish(sessionid, 'eventpoint', {...})   # 任意线程
+        await hub.stream(request, sessionid)           # SSE 接口
+    """
+
+    def __init__(self, max_pending: int = 100, heartbeat: float = 15):
+        """
+        Args:
+            max_pending: 每个订阅者最多缓存的事件数，超出时丢弃最旧的
+            heartbeat: SSE 心跳间隔(秒)
+        """
+        self.max_pending = max_pending
+        self.heartbeat = heartbeat
+        self._subscribers: Dict[int, Set[asyncio.Queue]] = {}
+        self._state: Dict[int, dict] = {}  #每个会话最近一次的状态，新订阅者连上时先发送
+        self._state_lock = threading.Lock()  #没有订阅者时_publish在发布线程中执行
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self.published = 0
+        self.dropped = 0
+
+    def publish(self, sessionid, event: str, data):
+        """发布事件，可在任意线程调用"""
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if self._loop is not None and running is not self._loop:
+            self._loop.call_soon_threadsafe(self._publish, sessionid, event, data)
+        else:
+            self._publish(sessionid, event, data)
+
+    def _publish(self, sessionid, event: str, data):
+        if event == 'state':
+            with self._state_lock:
+                self._state[sessionid] = data
+        item = (event, data, time.time())
+        self.published += 1
+        for q in self._subscribers.get(sessionid, ()):
+            self._put(q, item)
+
+    def _put(self, q: asyncio.Queue, item):
+        if q.full():
+            q.get_nowait()
+            self.dropped += 1
+        q.put_nowait(item)
+
+    def close_session(self, sessionid):
+        """会话销毁时清除该会话的状态，并结束它的所有事件流"""
+        with self._state_lock:
+            self._state.pop(sessionid, None)
+
+        def close():
+            with self._state_lock: #关闭前已排队的发布可能又写入了状态
+                self._state.pop(sessionid, None)
+            for q in self._subscribers.pop(sessionid, ()):
+                self._put(q, None)
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(close)
+
+    def subscribe(self, sessionid) -> asyncio.Queue:
+        self._loop = asyncio.get_running_loop()
+        q = asyncio.Queue(maxsize=self.max_pending)
+        self._subscribers.setdefault(sessionid, set()).add(q)
+        with self._state_lock:
+            state = self._state.get(sessionid)
+        if state is not None:
+            q.put_nowait(('state', state, time.time()))
+        return q
+
+    def unsubscribe(self, sessionid, q: asyncio.Queue):
+        subscribers = self._subscribers.get(sessionid)
+        if subscribers is not None:
+            subscribers.discard(q)
+            if not subscribers:
+                del self._subscribers[sessionid]
+
+    async def stream(self, request: web.Request, sessionid) -> web.StreamResponse:
+        """以 Server-Sent-Events 推送会话事件，直到会话结束或客户端断开"""
+        resp = web.StreamResponse(headers={
+            'Content-Type': 'text/event-stream',
+            'Cache-Control': 'no-cache',
+            'X-Accel-Buffering': 'no',
+        })
+        await resp.prepare(request)
+        q = self.subscribe(sessionid)
+        logger.info(f'event stream opened for session {sessionid}')
+        try:
+            while True:
+                try:
+                    item = await asyncio.wait_for(q.get(), self.heartbeat)
+                except asyncio.TimeoutError:
+                    await resp.write(b': ping\n\n')
+                    continue
+                if item is None:
+                    await resp.write(b'event: close\ndata: {}\n\n')
+                    break
+                event, data, ts = item
+                payload = json.dumps({'sessionid': sessionid, 'time': ts, 'data': data}, ensure_ascii=False, default=str)
+                await resp.write(f'event: {event}\ndata: {payload}\n\n'.encode('utf-8'))
+        except ConnectionResetError:
+            pass
+        finally:
+            self.unsubscribe(sessionid, q)
+            logger.info(f'event stream closed for session {sessionid}')
+        return resp
+
+    def stats(self) -> dict:
+        return {
+            'subscribers': {sid: len(qs) for sid, qs in self._subscribers.items()},
+            'sessions_with_state': len(self._state),
+            'published': self.published,
+            'dropped': self.dropped,
+        }
+
+
+# 全局实例
+_event_hub = None
+
+def get_event_hub() -> EventHub:
+    global _event_hub
+    if _event_hub is None:
+        _event_hub = EventHub()
+    return _event_hub
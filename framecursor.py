@@ -0,0 +1,89 @@
+###############################################################################
+#  Frame cursor
+#  推理线程和休眠时的待机循环共用的帧序号，以及打断时成对丢弃特征和音频帧的约定：
+#  ASR每次产生特征时带上当前generation(与放入的音频帧在同一渲染线程中完成)，
+#  打断时generation加一；推理线程取到打断前产生的特征时不再取音频帧，直接丢弃
+###############################################################################
+
+import queue
+import asyncio
+from threading import RLock
+
+
+def drain_queue(q)->int:
+    '''清空队列，返回丢弃的数量。mp.Queue由后台线程写入，稍等一下以免漏掉刚放入的项'''
+    count = 0
+    timeout = 0.01 if hasattr(q,'cancel_join_thread') else None
+    while True:
+        try:
+            if timeout:
+                q.get(timeout=timeout)
+            else:
+                q.get_nowait()
+        except (queue.Empty,asyncio.QueueEmpty):
+            return count
+        count += 1
+
+
+class FrameCursor:
+    '''推理线程和休眠时的待机循环共用的帧序号，保证休眠/唤醒前后画面连续。
+    打断时generation加一，推理线程据此丢弃打断前产生的特征和推理结果'''
+    def __init__(self):
+        self.index = 0
+        self.generation = 0
+        self.lock = RLock()
+
+    def claim(self,n:int)->int:
+        '''占用接下来的n帧，返回起始序号'''
+        with self.lock:
+            start = self.index
+            self.index += n
+            return start
+
+    def rewind(self,n:int):
+        '''退回n个已占用但不会播放的帧序号'''
+        with self.lock:
+            self.index = max(0,self.index-n)
+
+    def interrupt(self,res_frame_queue,*queues)->int:
+        '''打断：generation加一，清空推理结果和其它流水线队列，退回被丢弃的结果帧的序号，
+        返回丢弃的结果帧数。只在这里持有锁，推理线程之后放入的旧结果由put按generation丢弃'''
+        with self.lock:
+            self.generation += 1
+            dropped = drain_queue(res_frame_queue)
+            for q in queues:
+                drain_queue(q)
+            self.index = max(0,self.index-dropped)
+            return dropped
+
+    def take(self,gen:int,audio_out_queue,batch_size:int):
+        '''取出一批特征对应的音频帧并占用帧序号，返回(audio_frames,起始序号)。
+        gen是特征产生时的generation，特征在打断前产生(对应的音频已被清空)时返回None'''
+        with self.lock:
+            if gen != self.generation:
+                return None
+            audio_frames = [audio_out_queue.get() for _ in range(batch_size*2)]
+            return audio_frames,self.claim(batch_size)
+
+    def next_batch(self,audio_feat_queue,audio_out_queue,batch_size:int,timeout:float=1):
+        '''推理线程取下一批特征和对应的音频帧，返回(gen,feat,audio_frames,起始序号)。
+        等待超时或特征在打断前产生时返回None'''
+        try:
+            gen,feat = audio_feat_queue.get(block=True, timeout=timeout)
+        except queue.Empty:
+            return None
+        taken = self.take(gen,audio_out_queue,batch_size)
+        if taken is None:
+            return None
+        audio_frames,index = taken
+        return gen,feat,audio_frames,index
+
+    def put(self,gen:int,res_frame_queue,items:list)->bool:
+        '''把一批结果帧放入res_frame_queue；推理期间发生了打断则丢弃并退回占用的帧序号'''
+        with self.lock:
+            if gen != self.generation:
+                self.index -= len(items)
+                return False
+            for item in items:
+                res_frame_queue.put(item)
+            return True
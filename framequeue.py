@@ -0,0 +1,107 @@
+###############################################################################
+#  Frame queue
+#  渲染线程(唯一生产者)到 PlayerStreamTrack.recv(唯一消费者，事件循环中)的有界帧队列。
+#  数据放在deque中直接交接，不再每帧 run_coroutine_threadsafe 调度一次协程；
+#  只有消费者正在等待空队列时才唤醒事件循环，播放缓冲非空时生产者不产生任何跨线程调度
+###############################################################################
+
+import asyncio
+import threading
+from collections import deque
+from typing import Optional
+
+
+class FrameQueue:
+    """
+    单生产者/单消费者帧队列，接口与 asyncio.Queue 相同的部分可直接替换track的_queue
+
+    使用方法:
+        q = FrameQueue(maxsize=100)
+        q.put((frame, eventpoint), timeout=0.5)   # 渲染线程，队列满时等待，超时返回False
+        frame, eventpoint = await q.get()         # 事件循环
+        q.get_nowait()                            # 空时抛出 asyncio.QueueEmpty
+    """
+
+    def __init__(self, maxsize: int = 0):
+        """
+        Args:
+            maxsize: 队列容量，0表示不限
+        """
+        self.maxsize = maxsize
+        self._items: deque = deque()
+        self._lock = threading.Lock()  #只保护等待者的交接，不保护数据
+        self._not_full = threading.Condition(self._lock)
+        self._waiter: Optional[asyncio.Future] = None
+        self._producer_blocked = False
+        self.puts = 0
+        self.wakeups = 0
+        self.full_waits = 0
+
+    def qsize(self) -> int:
+        return len(self._items)
+
+    def empty(self) -> bool:
+        return not self._items
+
+    def full(self) -> bool:
+        return 0 < self.maxsize <= len(self._items)
+
+    def put(self, item, timeout: Optional[float] = None) -> bool:
+        """生产者线程调用。队列满时最多等待timeout秒，仍然满则返回False"""
+        with self._lock:
+            if self.full():
+                self.full_waits += 1
+                self._producer_blocked = True
+                ok = self._not_full.wait_for(lambda: not self.full(), timeout)
+                self._producer_blocked = False
+                if not ok:
+                    return False
+            self._items.append(item)
+            waiter, self._waiter = self._waiter, None
+        self.puts += 1
+        if waiter is not None:
+            self.wakeups += 1
+            waiter.get_loop().call_soon_threadsafe(_wake, waiter)
+        return True
+
+    def put_nowait(self, item):
+        if not self.put(item, timeout=0):
+            raise asyncio.QueueFull
+
+    def get_nowait(self):
+        try:
+            item = self._items.popleft()
+        except IndexError:
+            raise asyncio.QueueEmpty
+        if self._producer_blocked:
+            with self._lock:
+                self._not_full.notify()
+        return item
+
+    async def get(self):
+        while not self._items:
+            with self._lock:
+                if self._items:
+                    break
+                waiter = self._waiter = asyncio.get_running_loop().create_future()
+            try:
+                await waiter
+            finally:
+                with self._lock:
+                    if self._waiter is waiter:
+                        self._waiter = None
+        return self.get_nowait()
+
+    def stats(self) -> dict:
+        return {
+            'size': len(self._items),
+            'maxsize': self.maxsize,
+            'puts': self.puts,
+            'wakeups': self.wakeups,
+            'full_waits': self.full_waits,
+        }
+
+
+def _wake(waiter: asyncio.Future):
+    if not waiter.done():
+        waiter.set_result(None)
@@ -31,7 +31,7 @@ class HubertASR(BaseASR):
         mel = self.audio_processor.get_hubert_from_16k_speech(inputs)
         mel_chunks=self.audio_processor.feature2chunks(feature_array=mel,fps=self.fps/2,batch_size=self.batch_size,audio_feat_length = self.audio_feat_length, start=self.stride_left_size/2)
 
-        self.feat_queue.put(mel_chunks)
+        self.put_feat(mel_chunks)
         self.frames = self.frames[-(self.stride_left_size + self.stride_right_size):]
         #print(f"Processing audio costs {(time.time() - start_time) * 1000}ms")
 
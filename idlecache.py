@@ -0,0 +1,160 @@
+###############################################################################
+#  Idle loop cache
+#  静音时输出的是形象背景帧的镜像循环，每个会话每一轮都要重新转换、重新H264编码同样的画面。
+#  这里把镜像循环按形象、编码格式和分辨率只编码一次(关键帧间隔固定)，各会话静音时直接
+#  发送缓存的packet。track只在关键帧处从实时编码切到缓存，切回实时编码时强制关键帧
+###############################################################################
+
+import threading
+import time
+from fractions import Fraction
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from logger import logger
+
+DEFAULT_BITRATE = 1000000  #与aiortc H264编码器的初始码率一致
+FPS = 25
+
+
+class IdlePacket:
+    """
+    放入视频track队列的待机帧：接续得上当前编码流时track直接发送packet，
+    否则用image现场编码
+    """
+    __slots__ = ('codec', 'pos', 'next_pos', 'data', 'keyframe', 'image')
+
+    def __init__(self, codec: str, pos: int, next_pos: int, data: bytes, keyframe: bool, image: np.ndarray):
+        self.codec = codec
+        self.pos = pos
+        self.next_pos = next_pos
+        self.data = data
+        self.keyframe = keyframe
+        self.image = image
+
+
+class IdleLoopCache:
+    """
+    一个形象镜像待机循环的预编码packet
+
+    镜像循环共 2*n 个位置，位置pos对应背景帧 pos (pos<n) 或 2n-1-pos，
+    每gop个位置一个IDR帧，循环末尾接回位置0(也是IDR)
+    """
+
+    def __init__(self, frames: Sequence[np.ndarray], codec: str = 'H264', gop: int = FPS,
+                 bitrate: int = DEFAULT_BITRATE):
+        self.frames = frames
+        self.codec = codec
+        self.gop = gop
+        self.bitrate = bitrate
+        self.length = 2 * len(frames)
+        self.packets: List[Optional[Tuple[bytes, bool]]] = []
+        self.ready = False
+        self.failed = False
+        self.build_time = 0.0
+        self.hits = 0
+
+    def build(self):
+        """编码整个镜像循环，在后台线程中执行"""
+        import av
+        start = time.perf_counter()
+        try:
+            height, width = self.frames[0].shape[:2]
+            ctx = av.CodecContext.create('libx264', 'w')
+            ctx.width = width
+            ctx.height = height
+            ctx.bit_rate = self.bitrate
+            ctx.pix_fmt = 'yuv420p'
+            ctx.framerate = Fraction(FPS, 1)
+            ctx.time_base = Fraction(1, FPS)
+            #与aiortc的H264编码器参数一致；固定关键帧间隔，关闭场景切换检测
+            ctx.options = {'level': '31', 'tune': 'zerolatency', 'g': str(self.gop),
+                           'keyint_min': str(self.gop), 'sc_threshold': '0'}
+            ctx.profile = 'Baseline'
+            packets = []
+            for pos in range(self.length):
+                frame = av.VideoFrame.from_ndarray(self.frames[self.frame_index(pos)], format='bgr24')
+                frame.pts = pos
+                packets.extend(ctx.encode(frame))
+            packets.extend(ctx.encode(None))
+            if len(packets) != self.length:
+                raise RuntimeError(f'encoder returned {len(packets)} packets for {self.length} frames')
+            self.packets = [(bytes(packet), packet.is_keyframe) for packet in packets]
+            self.build_time = time.perf_counter() - start
+            self.ready = True
+            logger.info(f'idle loop cache: {self.length} frames {width}x{height} {self.codec} '
+                        f'{self.nbytes() / 1024**2:.1f}MB in {self.build_time:.1f}s')
+        except Exception:
+            self.failed = True
+            logger.exception('build idle loop cache failed:')
+
+    def frame_index(self, pos: int) -> int:
+        n = len(self.frames)
+        return pos if pos < n else 2 * n - 1 - pos
+
+    def position(self, last_idx: Optional[int], idx: int) -> Optional[int]:
+        """根据相邻两帧的背景帧序号推断镜像循环中的位置，无法确定时返回None"""
+        n = len(self.frames)
+        if last_idx is None:
+            return None
+        if idx == last_idx: #在循环两端折返
+            return 0 if idx == 0 else (n if idx == n - 1 else None)
+        if idx == last_idx + 1:
+            return idx
+        if idx == last_idx - 1:
+            return 2 * n - 1 - idx
+        return None
+
+    def packet(self, pos: int) -> Optional[IdlePacket]:
+        if not self.ready:
+            return None
+        data, keyframe = self.packets[pos]
+        self.hits += 1
+        return IdlePacket(self.codec, pos, (pos + 1) % self.length, data, keyframe,
+                          self.frames[self.frame_index(pos)])
+
+    def nbytes(self) -> int:
+        return sum(len(data) for data, _ in self.packets)
+
+    def stats(self) -> dict:
+        return {
+            'frames': self.length,
+            'gop': self.gop,
+            'ready': self.ready,
+            'failed': self.failed,
+            'build_time': self.build_time,
+            'mb': self.nbytes() / 1024**2,
+            'hits': self.hits,
+        }
+
+
+# 全局缓存：(形象, 编码格式, 宽, 高, 关键帧间隔) -> IdleLoopCache
+_caches: Dict[tuple, IdleLoopCache] = {}
+_lock = threading.Lock()
+_gop = FPS
+
+def init_idle_cache(gop: int = FPS):
+    global _gop
+    _gop = gop
+
+def get_idle_cache(avatar_id: str, frames: Sequence[np.ndarray], codec: str = 'H264') -> IdleLoopCache:
+    """取某形象的待机循环缓存，第一次调用时在后台线程中编码，编码完成前ready为False"""
+    height, width = frames[0].shape[:2]
+    key = (avatar_id, codec, width, height, _gop)
+    with _lock:
+        cache = _caches.get(key)
+        if cache is None:
+            cache = _caches[key] = IdleLoopCache(frames, codec, _gop)
+            threading.Thread(target=cache.build, daemon=True, name=f'idlecache-{avatar_id}').start()
+    return cache
+
+def release_idle_cache(avatar_id: str):
+    """形象被卸载时删除它的缓存"""
+    with _lock:
+        for key in [k for k in _caches if k[0] == avatar_id]:
+            del _caches[key]
+
+def idle_cache_stats() -> dict:
+    with _lock:
+        return {'/'.join(str(k) for k in key): cache.stats() for key, cache in _caches.items()}
@@ -36,7 +36,12 @@ import torch.multiprocessing as mp
 from hubertasr import HubertASR
 import asyncio
 from av import AudioFrame, VideoFrame
-from basereal import BaseReal
+from basereal import BaseReal,FrameCursor
+from batchinfer import get_infer_service
+from admission import get_admission
+from threadbudget import apply_thread_budget,release_thread_budget
+from modelregistry import get_model_registry,resolve_model_path,load_weights
+import metrics
 
 #from imgcache import ImgCache
 
@@ -60,17 +65,24 @@ device = "cuda" if torch.cuda.is_available() else ("mps" if (hasattr(torch.backe
 print('Using {} for inference.'.format(device))
 
 def load_model(opt):
-    audio_processor = Audio2Feature()
+    hubert_path = resolve_model_path("facebook/hubert-large-ls960-ft")
+    audio_processor = get_model_registry().load('hubert', hubert_path, device, lambda: Audio2Feature(hubert_path))
     return audio_processor
 
+def _load_ultralight(path):
+    model = Model(6, 'hubert').to(device)  # 假设Model是你自定义的类
+    model.load_state_dict(load_weights(path, map_location=device))
+    return model.eval()
+
 def load_avatar(avatar_id):
     avatar_path = f"./data/avatars/{avatar_id}"
     full_imgs_path = f"{avatar_path}/full_imgs" 
     face_imgs_path = f"{avatar_path}/face_imgs" 
     coords_path = f"{avatar_path}/coords.pkl" 
     
-    model = Model(6, 'hubert').to(device)  # 假设Model是你自定义的类
-    model.load_state_dict(torch.load(f"{avatar_path}/ultralight.pth"))
+    #不同形象共用同一份权重文件时只加载一次
+    weights_path = f"{avatar_path}/ultralight.pth"
+    model = get_model_registry().load('ultralight', weights_path, device, lambda: _load_ultralight(weights_path))
     
     with open(coords_path, 'rb') as f:
         coord_list_cycle = pickle.load(f)
@@ -82,7 +94,7 @@ def load_avatar(avatar_id):
     input_face_list = sorted(input_face_list, key=lambda x: int(os.path.splitext(os.path.basename(x))[0]))
     face_list_cycle = read_imgs(input_face_list)
 
-    return model.eval(),frame_list_cycle,face_list_cycle,coord_list_cycle
+    return model,frame_list_cycle,face_list_cycle,coord_list_cycle
 
 
 @torch.no_grad()
@@ -93,6 +105,11 @@ def warm_up(batch_size,avatar,modelres):
     mel_batch = torch.ones(batch_size, 32, 32, 32).to(device)
     model(img_batch, mel_batch)
 
+@torch.no_grad()
+def infer_batch(model, img_batch, mel_batch):
+    pred = model(img_batch.cuda(), mel_batch.cuda())
+    return pred.cpu().numpy().transpose(0, 2, 3, 1) * 255.
+
 def read_imgs(img_list):
     frames = []
     logger.info('reading images...')
@@ -145,30 +162,27 @@ def __mirror_index(size, index):
         return size - res - 1 
 
 
-def inference(quit_event, batch_size, face_list_cycle, audio_feat_queue, audio_out_queue, res_frame_queue, model):
+def inference(quit_event, batch_size, face_list_cycle, audio_feat_queue, audio_out_queue, res_frame_queue, model,
+              infer_service=None, sessionid=0, cursor=None):
     length = len(face_list_cycle)
     index = 0
     count = 0
     counttime = 0
+    if cursor is None:
+        cursor = FrameCursor()
     logger.info('start inference')
 
     while not quit_event.is_set():
+        apply_thread_budget('infer',sessionid)
         starttime=time.perf_counter()
-        try:
-            mel_batch = audio_feat_queue.get(block=True, timeout=1)
-        except queue.Empty:
+        batch = cursor.next_batch(audio_feat_queue,audio_out_queue,batch_size)
+        if batch is None: #没有新特征，或特征在打断前产生(对应的音频已被清空)
             continue
-        is_all_silence=True
-        audio_frames = []
-        for _ in range(batch_size*2):
-            frame,type_,eventpoint = audio_out_queue.get()
-            audio_frames.append((frame,type_,eventpoint))
-            if type_==0:
-                is_all_silence=False
+        gen,mel_batch,audio_frames,index = batch  #和休眠时的待机循环共用帧序号
+        is_all_silence = all(type_!=0 for _,type_,_ in audio_frames)
         if is_all_silence:
-            for i in range(batch_size):
-                res_frame_queue.put((None,__mirror_index(length,index),audio_frames[i*2:i*2+2]))
-                index = index + 1
+            cursor.put(gen,res_frame_queue,[(None,__mirror_index(length,index+i),audio_frames[i*2:i*2+2])
+                                            for i in range(batch_size)])
         else:
             t = time.perf_counter()
             img_batch = []
@@ -197,20 +211,24 @@ def inference(quit_event, batch_size, face_list_cycle, audio_feat_queue, audio_o
             img_batch = torch.stack(img_batch).squeeze(1)
 
 
-            with torch.no_grad():
-                pred = model(img_batch.cuda(),mel_batch.cuda())
-            pred = pred.cpu().numpy().transpose(0, 2, 3, 1) * 255.
+            if infer_service is not None:
+                pred = infer_service.infer(sessionid, model, (img_batch, mel_batch))
+            else:
+                pred = infer_batch(model, img_batch, mel_batch)
 
-            counttime += (time.perf_counter() - t)
+            elapsed = time.perf_counter() - t
+            counttime += elapsed
+            if get_admission() is not None:
+                get_admission().record_infer(sessionid, batch_size, elapsed)
+            metrics.INFER_BATCH.observe(elapsed, sessionid=sessionid)
             count += batch_size
             if count >= 100:
                 logger.info(f"------actual avg infer fps:{count / counttime:.4f}")
                 count = 0
                 counttime = 0
-            for i,res_frame in enumerate(pred):
-                #self.__pushmedia(res_frame,loop,audio_track,video_track)
-                res_frame_queue.put((res_frame,__mirror_index(length,index),audio_frames[i*2:i*2+2]))
-                index = index + 1
+            #推理期间被打断时丢弃结果
+            cursor.put(gen,res_frame_queue,[(res_frame,__mirror_index(length,index+i),audio_frames[i*2:i*2+2])
+                                            for i,res_frame in enumerate(pred)])
 
 #            for i, pred_frame in enumerate(pred):
 #                pred_frame_uint8 = np.array(pred_frame, dtype=np.uint8)
@@ -219,6 +237,7 @@ def inference(quit_event, batch_size, face_list_cycle, audio_feat_queue, audio_o
 
         #print('total batch time:', time.perf_counter() - starttime)
 
+    release_thread_budget('infer',sessionid)
     logger.info('lightreal inference processor stop')
 
 
@@ -250,8 +269,8 @@ class LightReal(BaseReal):
 
     def paste_back_frame(self,pred_frame,idx:int):
         bbox = self.coord_list_cycle[idx]
-        combine_frame = copy.deepcopy(self.frame_list_cycle[idx])
         x1, y1, x2, y2 = bbox
+        combine_frame = self.frame_ring.acquire(self.frame_list_cycle,idx,(y1,y2,x1,x2))
 
         crop_img = self.face_list_cycle[idx]
         crop_img_ori = crop_img.copy()
@@ -271,7 +290,7 @@ class LightReal(BaseReal):
         
         infer_quit_event = Event()
         infer_thread = Thread(target=inference, args=(infer_quit_event,self.batch_size,self.face_list_cycle,self.asr.feat_queue,self.asr.output_queue,self.res_frame_queue,
-                                           self.model,))  #mp.Process
+                                           self.model,get_infer_service(),self.sessionid,self.frame_cursor))  #mp.Process
         infer_thread.start()
         
         process_quit_event = Event()
@@ -284,26 +303,37 @@ class LightReal(BaseReal):
         _starttime=time.perf_counter()
         #_totalframe=0
         while not quit_event.is_set(): 
+            apply_thread_budget('asr',self.sessionid)
+            if self.interrupt_event.is_set():
+                self.drain_pipeline()
             # update texture every frame
             # audio stream thread...
-            t = time.perf_counter()
-            self.asr.run_step()
+            if self.check_hibernate():
+                self.idle_step()
+            else:
+                t = time.perf_counter()
+                self.asr.run_step()
+                metrics.ASR_STEP.observe(time.perf_counter()-t,sessionid=self.sessionid)
 
             # if video_track._queue.qsize()>=2*self.opt.batch_size:
             #     print('sleep qsize=',video_track._queue.qsize())
             #     time.sleep(0.04*video_track._queue.qsize()*0.8)
-            if video_track and video_track._queue.qsize()>=5:
+            delay = self.render_delay(video_track,5)
+            if delay>0:
                 logger.debug('sleep qsize=%d',video_track._queue.qsize())
-                time.sleep(0.04*video_track._queue.qsize()*0.8)
+                self.interrupt_event.wait(delay) #有打断时立即醒来
                 
             # delay = _starttime+_totalframe*0.04-time.perf_counter() #40ms
             # if delay > 0:
             #     time.sleep(delay)
         #self.render_event.clear() #end infer process render
+        release_thread_budget('asr',self.sessionid)
         logger.info('lightreal thread stop')
 
         infer_quit_event.set()
         infer_thread.join()
+        if get_infer_service() is not None:
+            get_infer_service().release(self.sessionid)
 
         process_quit_event.set()
         process_thread.join()
@@ -58,7 +58,7 @@ class LipASR(BaseASR):
             else:
                 mel_chunks.append(mel[:, start_idx : start_idx + mel_step_size])
             i += 1
-        self.feat_queue.put(mel_chunks)
+        self.put_feat(mel_chunks)
         
         # discard the old part to save memory
         self.frames = self.frames[-(self.stride_left_size + self.stride_right_size):]
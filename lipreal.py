@@ -37,7 +37,12 @@ from lipasr import LipASR
 import asyncio
 from av import AudioFrame, VideoFrame
 from wav2lip.models import Wav2Lip
-from basereal import BaseReal
+from basereal import BaseReal,FrameCursor
+from batchinfer import get_infer_service
+from admission import get_admission
+from threadbudget import apply_thread_budget,release_thread_budget
+from modelregistry import get_model_registry,resolve_model_path,load_weights
+import metrics
 
 #from imgcache import ImgCache
 
@@ -49,13 +54,16 @@ print('Using {} for inference.'.format(device))
 
 def _load(checkpoint_path):
 	if device == 'cuda':
-		checkpoint = torch.load(checkpoint_path) #,weights_only=True
+		checkpoint = load_weights(checkpoint_path) #,weights_only=True
 	else:
-		checkpoint = torch.load(checkpoint_path,
-								map_location=lambda storage, loc: storage)
+		checkpoint = load_weights(checkpoint_path, map_location='cpu')
 	return checkpoint
 
 def load_model(path):
+	path = resolve_model_path(path)
+	return get_model_registry().load('wav2lip', path, device, lambda: _build_model(path))
+
+def _build_model(path):
 	model = Wav2Lip()
 	logger.info("Load checkpoint from: {}".format(path))
 	checkpoint = _load(path)
@@ -94,6 +102,11 @@ def warm_up(batch_size,model,modelres):
     mel_batch = torch.ones(batch_size, 1, 80, 16).to(device)
     model(mel_batch, img_batch)
 
+@torch.no_grad()
+def infer_batch(model,mel_batch,img_batch):
+    pred = model(mel_batch, img_batch)
+    return pred.cpu().numpy().transpose(0, 2, 3, 1) * 255.
+
 def read_imgs(img_list):
     frames = []
     logger.info('reading images...')
@@ -111,7 +124,8 @@ def __mirror_index(size, index):
     else:
         return size - res - 1 
 
-def inference(quit_event,batch_size,face_list_cycle,audio_feat_queue,audio_out_queue,res_frame_queue,model):
+def inference(quit_event,batch_size,face_list_cycle,audio_feat_queue,audio_out_queue,res_frame_queue,model,
+              infer_service=None,sessionid=0,cursor=None):
     
     #model = load_model("./models/wav2lip.pth")
     # input_face_list = glob.glob(os.path.join(face_imgs_path, '*.[jpJP][pnPN]*[gG]'))
@@ -123,27 +137,21 @@ def inference(quit_event,batch_size,face_list_cycle,audio_feat_queue,audio_out_q
     index = 0
     count=0
     counttime=0
+    if cursor is None:
+        cursor = FrameCursor()
     logger.info('start inference')
     while not quit_event.is_set():
+        apply_thread_budget('infer',sessionid)
         starttime=time.perf_counter()
-        mel_batch = []
-        try:
-            mel_batch = audio_feat_queue.get(block=True, timeout=1)
-        except queue.Empty:
+        batch = cursor.next_batch(audio_feat_queue,audio_out_queue,batch_size)
+        if batch is None: #没有新特征，或特征在打断前产生(对应的音频已被清空)
             continue
-            
-        is_all_silence=True
-        audio_frames = []
-        for _ in range(batch_size*2):
-            frame,type,eventpoint = audio_out_queue.get()
-            audio_frames.append((frame,type,eventpoint))
-            if type==0:
-                is_all_silence=False
+        gen,mel_batch,audio_frames,index = batch  #和休眠时的待机循环共用帧序号
+        is_all_silence = all(type!=0 for _,type,_ in audio_frames)
 
         if is_all_silence:
-            for i in range(batch_size):
-                res_frame_queue.put((None,__mirror_index(length,index),audio_frames[i*2:i*2+2]))
-                index = index + 1
+            cursor.put(gen,res_frame_queue,[(None,__mirror_index(length,index+i),audio_frames[i*2:i*2+2])
+                                            for i in range(batch_size)])
         else:
             # print('infer=======')
             t=time.perf_counter()
@@ -163,22 +171,27 @@ def inference(quit_event,batch_size,face_list_cycle,audio_feat_queue,audio_out_q
             img_batch = torch.FloatTensor(np.transpose(img_batch, (0, 3, 1, 2))).to(device)
             mel_batch = torch.FloatTensor(np.transpose(mel_batch, (0, 3, 1, 2))).to(device)
 
-            with torch.no_grad():
-                pred = model(mel_batch, img_batch)
-            pred = pred.cpu().numpy().transpose(0, 2, 3, 1) * 255.
+            if infer_service is not None:
+                pred = infer_service.infer(sessionid, model, (mel_batch, img_batch))
+            else:
+                pred = infer_batch(model, mel_batch, img_batch)
 
-            counttime += (time.perf_counter() - t)
+            elapsed = time.perf_counter() - t
+            counttime += elapsed
+            if get_admission() is not None:
+                get_admission().record_infer(sessionid, batch_size, elapsed)
+            metrics.INFER_BATCH.observe(elapsed, sessionid=sessionid)
             count += batch_size
             #_totalframe += 1
             if count>=100:
                 logger.info(f"------actual avg infer fps:{count/counttime:.4f}")
                 count=0
                 counttime=0
-            for i,res_frame in enumerate(pred):
-                #self.__pushmedia(res_frame,loop,audio_track,video_track)
-                res_frame_queue.put((res_frame,__mirror_index(length,index),audio_frames[i*2:i*2+2]))
-                index = index + 1
+            #推理期间被打断时丢弃结果
+            cursor.put(gen,res_frame_queue,[(res_frame,__mirror_index(length,index+i),audio_frames[i*2:i*2+2])
+                                            for i,res_frame in enumerate(pred)])
             #print('total batch time:',time.perf_counter()-starttime)            
+    release_thread_budget('infer',sessionid)
     logger.info('lipreal inference processor stop')
 
 class LipReal(BaseReal):
@@ -208,9 +221,8 @@ class LipReal(BaseReal):
 
     def paste_back_frame(self,pred_frame,idx:int):
         bbox = self.coord_list_cycle[idx]
-        combine_frame = copy.deepcopy(self.frame_list_cycle[idx])
-        #combine_frame = copy.deepcopy(self.imagecache.get_img(idx))
         y1, y2, x1, x2 = bbox
+        combine_frame = self.frame_ring.acquire(self.frame_list_cycle,idx,(y1,y2,x1,x2))
         res_frame = cv2.resize(pred_frame.astype(np.uint8),(x2-x1,y2-y1))
         #combine_frame = get_image(ori_frame,res_frame,bbox)
         #t=time.perf_counter()
@@ -227,7 +239,7 @@ class LipReal(BaseReal):
         infer_quit_event = Event()
         infer_thread = Thread(target=inference, args=(infer_quit_event,self.batch_size,self.face_list_cycle,
                                            self.asr.feat_queue,self.asr.output_queue,self.res_frame_queue,
-                                           self.model,))  #mp.Process
+                                           self.model,get_infer_service(),self.sessionid,self.frame_cursor))  #mp.Process
         infer_thread.start()
         
         process_quit_event = Event()
@@ -240,26 +252,37 @@ class LipReal(BaseReal):
         _starttime=time.perf_counter()
         #_totalframe=0
         while not quit_event.is_set(): 
+            apply_thread_budget('asr',self.sessionid)
+            if self.interrupt_event.is_set():
+                self.drain_pipeline()
             # update texture every frame
             # audio stream thread...
-            t = time.perf_counter()
-            self.asr.run_step()
+            if self.check_hibernate():
+                self.idle_step()
+            else:
+                t = time.perf_counter()
+                self.asr.run_step()
+                metrics.ASR_STEP.observe(time.perf_counter()-t,sessionid=self.sessionid)
 
             # if video_track._queue.qsize()>=2*self.opt.batch_size:
             #     print('sleep qsize=',video_track._queue.qsize())
             #     time.sleep(0.04*video_track._queue.qsize()*0.8)
-            if video_track and video_track._queue.qsize()>=5:
+            delay = self.render_delay(video_track,5)
+            if delay>0:
                 logger.debug('sleep qsize=%d',video_track._queue.qsize())
-                time.sleep(0.04*video_track._queue.qsize()*0.8)
+                self.interrupt_event.wait(delay) #有打断时立即醒来
                 
             # delay = _starttime+_totalframe*0.04-time.perf_counter() #40ms
             # if delay > 0:
             #     time.sleep(delay)
         #self.render_event.clear() #end infer process render
+        release_thread_budget('asr',self.sessionid)
         logger.info('lipreal thread stop')
 
         infer_quit_event.set()
         infer_thread.join()
+        if get_infer_service() is not None:
+            get_infer_service().release(self.sessionid)
 
         process_quit_event.set()
         process_thread.join()
@@ -1,48 +1,142 @@
+###############################################################################
+#  LLM backend
+#  OpenAI兼容接口的异步流式对话。进程内共用一个AsyncOpenAI客户端(连接池keep-alive)，
+#  每次对话在事件循环中作为任务运行，打断(flush_talk)时取消。
+#  base_url可指向任意OpenAI兼容服务，包括测试用的本地替身。
+#  可选的回答缓存：重复的问题直接重放上次回答的分句
+###############################################################################
+
 import time
 import os
-from basereal import BaseReal
+import asyncio
+from typing import Optional
+
 from logger import logger
+from llmcache import AnswerCache
+import metrics
+
+DEFAULT_BASE_URL = "https://dashscope.aliyuncs.com/compatible-mode/v1"
+DEFAULT_MODEL = "qwen-plus"
+SYSTEM_PROMPT = 'You are a helpful assistant.'
+
+
+class LLMBackend:
+    """
+    使用方法:
+        llm = get_llm()
+        llm.start(message, nerfreal)   # 事件循环中调用，返回asyncio.Task
+    """
+
+    def __init__(self, base_url: str = None, api_key: str = None, model: str = None,
+                 system_prompt: str = SYSTEM_PROMPT, timeout: float = 30, cache: AnswerCache = None):
+        self.base_url = base_url or DEFAULT_BASE_URL
+        # 如果您没有配置环境变量，请在此处用您的API Key进行替换；本地服务不校验key
+        self.api_key = api_key or os.getenv("LLM_API_KEY") or os.getenv("DASHSCOPE_API_KEY") or "EMPTY"
+        self.model = model or DEFAULT_MODEL
+        self.system_prompt = system_prompt
+        self.timeout = timeout
+        self.cache = cache
+        self._client = None
+        self.requests = 0
+        self.cancelled = 0
+
+    @property
+    def client(self):
+        if self._client is None:
+            from openai import AsyncOpenAI
+            self._client = AsyncOpenAI(api_key=self.api_key, base_url=self.base_url, timeout=self.timeout)
+        return self._client
+
+    async def stream(self, message: str):
+        """流式返回回答文本片段"""
+        start = time.perf_counter()
+        self.requests += 1
+        completion = await self.client.chat.completions.create(
+            model=self.model,
+            messages=[{'role': 'system', 'content': self.system_prompt},
+                      {'role': 'user', 'content': message}],
+            stream=True,
+            # 通过以下设置，在流式输出的最后一行展示token使用信息
+            stream_options={"include_usage": True}
+        )
+        first = True
+        try:
+            async for chunk in completion:
+                if len(chunk.choices) == 0 or not chunk.choices[0].delta.content:
+                    continue
+                if first:
+                    ttft = time.perf_counter() - start
+                    metrics.LLM_TTFT.observe(ttft, model=self.model)
+                    logger.info(f"llm Time to first token: {ttft:.3f}s")
+                    first = False
+                yield chunk.choices[0].delta.content
+        finally:
+            await completion.close()  #取消时关闭响应，连接回到连接池
+        logger.info(f"llm Time to last chunk: {time.perf_counter()-start:.3f}s")
+
+    async def respond(self, message: str, nerfreal):
+        """把回答分段送入TTS，开启缓存时命中的问题直接重放分段"""
+        if self.cache is not None:
+            sentences = self.cache.get(message)
+            if sentences is not None:
+                logger.info(f'llm cache hit, replay {len(sentences)} sentences')
+                nerfreal.tts.mark_utterance()
+                for sentence in sentences:
+                    nerfreal.put_msg_txt(sentence)
+                return
+        sentences = []
+
+        def emit(text):
+            logger.info(text)
+            nerfreal.put_msg_txt(text)
+            sentences.append(text)
+
+        segmenter = nerfreal.new_segmenter(emit)
+        async for msg in self.stream(message):
+            segmenter.feed(msg)
+        segmenter.flush()
+        if self.cache is not None: #被取消或出错的回答不缓存
+            self.cache.put(message, sentences)
+
+    def start(self, message: str, nerfreal) -> asyncio.Task:
+        """在当前事件循环中开始一次对话，会话打断时取消"""
+        task = asyncio.get_running_loop().create_task(self._run(message, nerfreal))
+        nerfreal.llm_tasks.add(task)
+        task.add_done_callback(nerfreal.llm_tasks.discard)
+        return task
+
+    async def _run(self, message: str, nerfreal):
+        try:
+            await self.respond(message, nerfreal)
+        except asyncio.CancelledError:
+            self.cancelled += 1
+            logger.info(f'llm response for session {nerfreal.sessionid} cancelled')
+            raise
+        except Exception:
+            logger.exception('llm response failed:')
+
+    def stats(self) -> dict:
+        return {
+            'base_url': self.base_url,
+            'model': self.model,
+            'requests': self.requests,
+            'cancelled': self.cancelled,
+            'cache': self.cache.stats() if self.cache is not None else None,
+        }
+
+
+# 全局实例
+_llm_backend: Optional[LLMBackend] = None
+
+def init_llm(base_url: str = None, model: str = None, api_key: str = None,
+             cache_size: int = 0, cache_ttl: float = 3600) -> LLMBackend:
+    global _llm_backend
+    cache = AnswerCache(cache_size, cache_ttl) if cache_size > 0 else None
+    _llm_backend = LLMBackend(base_url, api_key, model, cache=cache)
+    return _llm_backend
 
-def llm_response(message,nerfreal:BaseReal):
-    start = time.perf_counter()
-    from openai import OpenAI
-    client = OpenAI(
-        # 如果您没有配置环境变量，请在此处用您的API Key进行替换
-        api_key=os.getenv("DASHSCOPE_API_KEY"),
-        # 填写DashScope SDK的base_url
-        base_url="https://dashscope.aliyuncs.com/compatible-mode/v1",
-    )
-    end = time.perf_counter()
-    logger.info(f"llm Time init: {end-start}s")
-    completion = client.chat.completions.create(
-        model="qwen-plus",
-        messages=[{'role': 'system', 'content': 'You are a helpful assistant.'},
-                  {'role': 'user', 'content': message}],
-        stream=True,
-        # 通过以下设置，在流式输出的最后一行展示token使用信息
-        stream_options={"include_usage": True}
-    )
-    result=""
-    first = True
-    for chunk in completion:
-        if len(chunk.choices)>0:
-            #print(chunk.choices[0].delta.content)
-            if first:
-                end = time.perf_counter()
-                logger.info(f"llm Time to first chunk: {end-start}s")
-                first = False
-            msg = chunk.choices[0].delta.content
-            lastpos=0
-            #msglist = re.split('[,.!;:，。！?]',msg)
-            for i, char in enumerate(msg):
-                if char in ",.!;:，。！？：；" :
-                    result = result+msg[lastpos:i+1]
-                    lastpos = i+1
-                    if len(result)>10:
-                        logger.info(result)
-                        nerfreal.put_msg_txt(result)
-                        result=""
-            result = result+msg[lastpos:]
-    end = time.perf_counter()
-    logger.info(f"llm Time to last chunk: {end-start}s")
-    nerfreal.put_msg_txt(result)    
\ No newline at end of file
+def get_llm() -> LLMBackend:
+    global _llm_backend
+    if _llm_backend is None:
+        _llm_backend = LLMBackend(os.getenv("LLM_BASE_URL"), model=os.getenv("LLM_MODEL"))
+    return _llm_backend
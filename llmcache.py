@@ -0,0 +1,89 @@
+###############################################################################
+#  LLM answer cache
+#  按归一化后的问题缓存LLM回答的分句序列。命中时直接把分句送入TTS，
+#  不再等待LLM首字延迟；适合问题高度重复的展厅/导览场景
+###############################################################################
+
+import re
+import time
+import threading
+import unicodedata
+from collections import OrderedDict
+from typing import List, Optional
+
+import metrics
+
+_STRIP_RE = re.compile(r'[\s\W_]+', re.UNICODE)
+
+
+def normalize_question(text: str) -> str:
+    """全半角统一、大小写折叠，去掉空白和标点"""
+    text = unicodedata.normalize('NFKC', text).casefold()
+    return _STRIP_RE.sub('', text)
+
+
+class AnswerCache:
+    """
+    使用方法:
+        cache = AnswerCache(max_entries=256, ttl=3600)
+        sentences = cache.get(question)       # 未命中返回None
+        cache.put(question, sentences)
+    """
+
+    def __init__(self, max_entries: int = 256, ttl: float = 3600):
+        """
+        Args:
+            max_entries: 最多缓存的问题数，超出时淘汰最久未使用的
+            ttl: 回答的有效期(秒)，0表示不过期
+        """
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries: 'OrderedDict[str, tuple]' = OrderedDict()  #key -> (写入时间, 分句列表)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, question: str) -> Optional[List[str]]:
+        key = normalize_question(question)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and self.ttl > 0 and time.time() - entry[0] > self.ttl:
+                del self._entries[key]
+                entry = None
+            if entry is None:
+                self.misses += 1
+                metrics.LLM_CACHE.inc(result='miss')
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+        metrics.LLM_CACHE.inc(result='hit')
+        return list(entry[1])
+
+    def put(self, question: str, sentences: List[str]):
+        key = normalize_question(question)
+        if not key or not sentences:
+            return
+        with self._lock:
+            self._entries[key] = (time.time(), list(sentences))
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+                'ttl': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / total if total else 0,
+                'evictions': self.evictions,
+            }
@@ -0,0 +1,208 @@
+###############################################################################
+#  Prometheus-style metrics
+#  轻量的 Counter/Gauge/Histogram 实现，以 Prometheus 文本格式从 /metrics 导出
+###############################################################################
+
+import math
+import threading
+from typing import Dict, List, Sequence, Tuple
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_registry: List["_Metric"] = []
+_lock = threading.Lock()
+
+
+def _format_labels(labels: Tuple[Tuple[str, str], ...]) -> str:
+    if not labels:
+        return ''
+    parts = []
+    for k, v in labels:
+        v = str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        parts.append(f'{k}="{v}"')
+    return '{' + ','.join(parts) + '}'
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return '+Inf'
+    return repr(float(value))
+
+
+class _Metric:
+    kind = ''
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values: Dict[tuple, object] = {}
+        with _lock:
+            _registry.append(self)
+
+    def _key(self, labels: dict) -> tuple:
+        return tuple((name, str(labels.get(name, ''))) for name in self.labelnames)
+
+    def remove(self, **labels):
+        """删除匹配指定label的所有序列(会话结束时调用)"""
+        with _lock:
+            for key in list(self._values):
+                d = dict(key)
+                if all(d.get(k) == str(v) for k, v in labels.items()):
+                    del self._values[key]
+
+    def clear(self):
+        with _lock:
+            self._values.clear()
+
+    def _samples(self) -> List[str]:
+        raise NotImplementedError
+
+    def render(self) -> List[str]:
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.kind}']
+        with _lock:
+            lines.extend(self._samples())
+        return lines
+
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with _lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def _samples(self) -> List[str]:
+        return [f'{self.name}{_format_labels(k)} {_format_value(v)}' for k, v in self._values.items()]
+
+
+class Gauge(_Metric):
+    kind = 'gauge'
+
+    def set(self, value: float, **labels):
+        key = self._key(labels)
+        with _lock:
+            self._values[key] = value
+
+    def _samples(self) -> List[str]:
+        return [f'{self.name}{_format_labels(k)} {_format_value(v)}' for k, v in self._values.items()]
+
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with _lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[0][i] += 1
+                    break
+            state[1] += value
+            state[2] += 1
+
+    def _samples(self) -> List[str]:
+        lines = []
+        for key, (counts, total, count) in self._values.items():
+            cumulative = 0
+            for bound, c in zip(self.buckets, counts):
+                cumulative += c
+                labels = key + (('le', _format_value(bound) if bound == math.inf else repr(bound)),)
+                lines.append(f'{self.name}_bucket{_format_labels(labels)} {cumulative}')
+            lines.append(f'{self.name}_sum{_format_labels(key)} {_format_value(total)}')
+            lines.append(f'{self.name}_count{_format_labels(key)} {count}')
+        return lines
+
+
+def render() -> str:
+    """导出所有指标(Prometheus text format 0.0.4)"""
+    lines = []
+    for metric in list(_registry):
+        lines.extend(metric.render())
+    return '\n'.join(lines) + '\n'
+
+def merge_metrics(texts: Dict[int, str]) -> List[str]:
+    """
+    合并多个worker的Prometheus文本：同名指标的序列放在一起(HELP/TYPE只保留一份)，
+    每个序列加上 worker="N" 标签
+    """
+    headers: Dict[str, List[str]] = {}
+    samples: Dict[str, List[str]] = {}
+    for worker_id, text in texts.items():
+        family = None
+        for line in text.splitlines():
+            if not line:
+                continue
+            if line.startswith('#'):
+                parts = line.split(None, 3)
+                if len(parts) >= 3 and parts[1] in ('HELP', 'TYPE'):
+                    family = parts[2]
+                    headers.setdefault(family, [])
+                    if len(headers[family]) < 2:
+                        headers[family].append(line)
+                    samples.setdefault(family, [])
+                continue
+            label = f'worker="{worker_id}"'
+            brace = line.find('{')
+            space = line.find(' ')
+            if space == -1:
+                continue
+            if brace != -1 and brace < space:
+                sep = '' if line[brace + 1] == '}' else ','
+                line = f'{line[:brace + 1]}{label}{sep}{line[brace + 1:]}'
+            else:
+                line = f'{line[:space]}{{{label}}}{line[space:]}'
+            samples.setdefault(family, []).append(line)
+    lines = []
+    for family, family_samples in samples.items():
+        lines += headers.get(family, [])
+        lines += family_samples
+    return lines
+
+def remove_session(sessionid):
+    """删除某个会话的所有序列"""
+    for metric in list(_registry):
+        if 'sessionid' in metric.labelnames:
+            metric.remove(sessionid=sessionid)
+
+
+###############################################################################
+TTS_TTFB = Histogram('livetalking_tts_ttfb_seconds',
+                     'Time from TTS request start to first audio frame', ['backend'])
+LLM_TTFT = Histogram('livetalking_llm_ttft_seconds',
+                     'Time from LLM request start to first answer token', ['model'])
+LLM_CACHE = Counter('livetalking_llm_cache_total',
+                    'LLM answer cache lookups', ['result'])
+FIRST_AUDIO = Histogram('livetalking_first_audio_seconds',
+                        'Time from the first text of an answer reaching TTS to its first audio frame', ['sessionid'])
+ASR_STEP = Histogram('livetalking_asr_step_seconds',
+                     'ASR run_step duration', ['sessionid'])
+INFER_BATCH = Histogram('livetalking_infer_batch_seconds',
+                        'Lip-sync model inference latency per batch', ['sessionid'])
+PASTE_BACK = Histogram('livetalking_paste_back_seconds',
+                       'paste_back_frame duration per frame', ['sessionid'])
+COMPOSE_BUSY = Counter('livetalking_compose_busy_seconds_total',
+                       'Time each compositing worker spent on frames', ['sessionid', 'worker'])
+RVM_TIME = Histogram('livetalking_rvm_seconds',
+                     'RVM background removal duration per frame', ['sessionid'])
+QUEUE_DEPTH = Gauge('livetalking_queue_depth',
+                    'Current pipeline queue depth', ['sessionid', 'queue'])
+SESSIONS = Gauge('livetalking_sessions', 'Number of active sessions')
+FRAMES_DROPPED = Counter('livetalking_frames_dropped_total',
+                         'Frames dropped in the pipeline', ['sessionid', 'stage'])
+FRAMES_LATE = Counter('livetalking_frames_late_total',
+                      'Frames sent later than their presentation time', ['sessionid', 'kind'])
+UNDERRUNS = Counter('livetalking_playback_underruns_total',
+                    'Times the track had no buffered frame when playback needed one', ['sessionid', 'kind'])
+INTERRUPT_LATENCY = Histogram('livetalking_interrupt_latency_seconds',
+                              'Time from interrupt request to the first silent frame', ['sessionid'])
+SILENCE_FRAMES = Counter('livetalking_silence_frames_total',
+                         'Silence audio frames inserted because no audio was queued', ['sessionid'])
@@ -0,0 +1,171 @@
+###############################################################################
+#  Model registry
+#  按(模型类型, 路径, 设备)缓存已加载的模型，同一份权重只加载一次；
+#  所有模型从本地 models/ 目录解析，不访问 hub；权重尽量用mmap加载；
+#  开启懒加载时返回代理对象，首次使用时才真正加载
+###############################################################################
+
+import os
+import time
+import pickle
+import threading
+from typing import Callable, Dict, Tuple
+
+import torch
+
+from logger import logger
+from admission import get_rss_bytes
+
+MODEL_ROOT = './models'
+
+
+def resolve_model_path(name_or_path: str, root: str = MODEL_ROOT) -> str:
+    """
+    解析模型路径：本地路径直接返回；hub名称(如 facebook/hubert-large-ls960-ft)
+    映射到 models/<名称最后一段>。都不存在时原样返回，由调用方以 local_files_only
+    方式从本地hub缓存加载
+    """
+    if os.path.exists(name_or_path):
+        return name_or_path
+    local = os.path.join(root, os.path.basename(name_or_path.rstrip('/')))
+    if os.path.exists(local):
+        return local
+    logger.warning(f'model {name_or_path} not found under {root}, fall back to local hub cache; '
+                   f'download it into {local} to avoid this')
+    return name_or_path
+
+
+def load_weights(path: str, map_location=None):
+    """torch.load，优先mmap方式加载，不支持时(旧版torch/旧格式文件)回退到普通加载"""
+    try:
+        return torch.load(path, map_location=map_location, mmap=True, weights_only=True)
+    except (TypeError, RuntimeError, pickle.UnpicklingError) as e:
+        logger.debug(f'mmap load {path} failed({e}), fall back to torch.load')
+        return torch.load(path, map_location=map_location)
+
+
+class ModelInfo:
+    def __init__(self, key: Tuple[str, str, str], load_time: float, rss_delta: int):
+        self.key = key
+        self.load_time = load_time
+        self.rss_delta = rss_delta
+        self.hits = 0
+
+    def info(self) -> dict:
+        kind, path, device = self.key
+        return {
+            'kind': kind,
+            'path': path,
+            'device': device,
+            'load_time': self.load_time,
+            'load_rss_mb': self.rss_delta / 1024**2,
+            'hits': self.hits,
+        }
+
+
+class LazyModel:
+    """首次访问属性或调用时才加载的模型代理"""
+
+    def __init__(self, registry: 'ModelRegistry', kind: str, path: str, device, loader: Callable):
+        self._registry = registry
+        self._args = (kind, path, device, loader)
+        self._model = None
+
+    def get(self):
+        if self._model is None:
+            self._model = self._registry.get(*self._args)
+        return self._model
+
+    def __getattr__(self, name):
+        if name.startswith('__') or name in ('_registry', '_args', '_model'):
+            raise AttributeError(name)
+        return getattr(self.get(), name)
+
+    def __call__(self, *args, **kwargs):
+        return self.get()(*args, **kwargs)
+
+
+class ModelRegistry:
+    """
+    模型注册表
+
+    使用方法:
+        registry = get_model_registry()
+        model = registry.load('wav2lip', path, device, lambda: build_model(path))
+    """
+
+    def __init__(self, lazy: bool = False):
+        self.lazy = lazy
+        self._models: Dict[Tuple[str, str, str], object] = {}
+        self._infos: Dict[Tuple[str, str, str], ModelInfo] = {}
+        self._lock = threading.Lock()
+        self._loading: Dict[Tuple[str, str, str], threading.Lock] = {}
+        self._proxies: Dict[Tuple[str, str, str], LazyModel] = {}
+
+    @staticmethod
+    def make_key(kind: str, path: str, device) -> Tuple[str, str, str]:
+        #软链接到同一文件的权重共用一份
+        if os.path.exists(path):
+            path = os.path.realpath(path)
+        return (kind, path, str(device))
+
+    def get(self, kind: str, path: str, device, loader: Callable):
+        """返回已加载的模型，未加载时调用 loader() 加载"""
+        key = self.make_key(kind, path, device)
+        with self._lock:
+            if key in self._models:
+                self._infos[key].hits += 1
+                return self._models[key]
+            load_lock = self._loading.setdefault(key, threading.Lock())
+        with load_lock:
+            with self._lock:
+                if key in self._models:
+                    self._infos[key].hits += 1
+                    return self._models[key]
+            rss = get_rss_bytes()
+            t = time.perf_counter()
+            model = loader()
+            info = ModelInfo(key, time.perf_counter() - t, get_rss_bytes() - rss)
+            logger.info(f'model {kind} loaded from {path} on {device} in {info.load_time:.2f}s')
+            with self._lock:
+                self._models[key] = model
+                self._infos[key] = info
+                self._loading.pop(key, None)
+            return model
+
+    def owns(self, obj) -> bool:
+        """obj是否为注册表共享的模型(或其懒加载代理)"""
+        if isinstance(obj, LazyModel):
+            return True
+        with self._lock:
+            return any(obj is model for model in self._models.values())
+
+    def load(self, kind: str, path: str, device, loader: Callable):
+        """开启懒加载时返回代理，否则立即加载。同一模型返回同一个代理，跨会话批量推理按模型对象分组"""
+        if self.lazy:
+            key = self.make_key(kind, path, device)
+            with self._lock:
+                proxy = self._proxies.get(key)
+                if proxy is None:
+                    proxy = self._proxies[key] = LazyModel(self, kind, path, device, loader)
+                return proxy
+        return self.get(kind, path, device, loader)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                'lazy': self.lazy,
+                'rss_mb': get_rss_bytes() / 1024**2,
+                'models': [info.info() for info in self._infos.values()],
+            }
+
+
+# 全局实例，模型模块在app初始化前就可能用到，所以默认创建
+_model_registry = ModelRegistry()
+
+def init_model_registry(lazy: bool = False) -> ModelRegistry:
+    _model_registry.lazy = lazy
+    return _model_registry
+
+def get_model_registry() -> ModelRegistry:
+    return _model_registry
@@ -36,30 +36,50 @@ import torch.multiprocessing as mp
 
 from musetalk.utils.utils import get_file_type,get_video_fps,datagen
 #from musetalk.utils.preprocessing import get_landmark_and_bbox,read_imgs,coord_placeholder
-from musetalk.myutil import get_image_blending
-from musetalk.utils.utils import load_all_model
+from musetalk.myutil import prepare_blend_mask,blend_face
+from musetalk.models.vae import VAE
+from musetalk.models.unet import UNet,PositionalEncoding
 from musetalk.whisper.audio2feature import Audio2Feature
 
 from museasr import MuseASR
 import asyncio
 from av import AudioFrame, VideoFrame
-from basereal import BaseReal
+from basereal import BaseReal,FrameCursor
+from batchinfer import get_infer_service
+from admission import get_admission
+from threadbudget import apply_thread_budget,release_thread_budget
+from modelregistry import get_model_registry,resolve_model_path
+import metrics
 
 from tqdm import tqdm
 from logger import logger
 
-def load_model():
-    # load model weights
-    vae, unet, pe = load_all_model()
-    device = torch.device("cuda" if torch.cuda.is_available() else ("mps" if (hasattr(torch.backends, "mps") and torch.backends.mps.is_available()) else "cpu"))
-    timesteps = torch.tensor([0], device=device)
-    pe = pe.half().to(device)
+def _load_vae(path,device):
+    vae = VAE(model_path=path)
     vae.vae = vae.vae.half().to(device)
     #vae.vae.share_memory().to(device)
+    return vae
+
+def _load_unet(config,path,device):
+    unet = UNet(unet_config=config,model_path=path,device=device)
     unet.model = unet.model.half().to(device)
     #unet.model.share_memory()
+    return unet
+
+def load_model():
+    # load model weights
+    device = torch.device("cuda" if torch.cuda.is_available() else ("mps" if (hasattr(torch.backends, "mps") and torch.backends.mps.is_available()) else "cpu"))
+    registry = get_model_registry()
+    vae_path = resolve_model_path(os.path.join("models", "sd-vae"))
+    unet_path = resolve_model_path(os.path.join("models", "musetalkV15", "unet.pth"))
+    unet_config = os.path.join("models", "musetalkV15", "musetalk.json")
+    whisper_path = resolve_model_path("./models/whisper")
+    vae = registry.load('musetalk_vae', vae_path, device, lambda: _load_vae(vae_path,device))
+    unet = registry.load('musetalk_unet', unet_path, device, lambda: _load_unet(unet_config,unet_path,device))
+    timesteps = torch.tensor([0], device=device)
+    pe = PositionalEncoding(d_model=384).half().to(device)
     # Initialize audio processor and Whisper model
-    audio_processor = Audio2Feature(model_path="./models/whisper")
+    audio_processor = registry.load('whisper', whisper_path, device, lambda: Audio2Feature(model_path=whisper_path))
     return vae, unet, pe, timesteps, audio_processor
 
 def load_avatar(avatar_id):
@@ -89,7 +109,10 @@ def load_avatar(avatar_id):
         mask_coords_list_cycle = pickle.load(f)
     input_mask_list = glob.glob(os.path.join(mask_out_path, '*.[jpJP][pnPN]*[gG]'))
     input_mask_list = sorted(input_mask_list, key=lambda x: int(os.path.splitext(os.path.basename(x))[0]))
-    mask_list_cycle = read_imgs(input_mask_list)
+    #mask按单通道读取，预计算每帧人脸框内的定点alpha，运行时只做整数混合
+    mask_list_cycle = []
+    for mask_path,face_box,crop_box in zip(input_mask_list,coord_list_cycle,mask_coords_list_cycle):
+        mask_list_cycle.append(prepare_blend_mask(cv2.imread(mask_path,cv2.IMREAD_GRAYSCALE),face_box,crop_box))
     return frame_list_cycle,mask_list_cycle,coord_list_cycle,mask_coords_list_cycle,input_latent_list_cycle
 
 @torch.no_grad()
@@ -111,6 +134,19 @@ def warm_up(batch_size,model):
                               encoder_hidden_states=audio_feature_batch).sample
     vae.decode_latents(pred_latents)
 
+@torch.no_grad()
+def infer_batch(model,whisper_batch,latent_batch):
+    vae, unet, pe, timesteps, _ = model
+    audio_feature_batch = torch.from_numpy(whisper_batch)
+    audio_feature_batch = audio_feature_batch.to(device=unet.device,
+                                                    dtype=unet.model.dtype)
+    audio_feature_batch = pe(audio_feature_batch)
+    latent_batch = latent_batch.to(dtype=unet.model.dtype)
+    pred_latents = unet.model(latent_batch, 
+                                timesteps, 
+                                encoder_hidden_states=audio_feature_batch).sample
+    return vae.decode_latents(pred_latents)
+
 def read_imgs(img_list):
     frames = []
     logger.info('reading images...')
@@ -130,7 +166,7 @@ def __mirror_index(size, index):
 
 @torch.no_grad()
 def inference(quit_event,batch_size,input_latent_list_cycle,audio_feat_queue,audio_out_queue,res_frame_queue,
-              vae, unet, pe,timesteps): #vae, unet, pe,timesteps
+              model,infer_service=None,sessionid=0,cursor=None): #vae, unet, pe,timesteps
     
     # vae, unet, pe = load_diffusion_model()
     # device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
@@ -143,24 +179,20 @@ def inference(quit_event,batch_size,input_latent_list_cycle,audio_feat_queue,aud
     index = 0
     count=0
     counttime=0
+    if cursor is None:
+        cursor = FrameCursor()
     logger.info('start inference')
     while not quit_event.is_set():
+        apply_thread_budget('infer',sessionid)
         starttime=time.perf_counter()
-        try:
-            whisper_chunks = audio_feat_queue.get(block=True, timeout=1)
-        except queue.Empty:
+        batch = cursor.next_batch(audio_feat_queue,audio_out_queue,batch_size)
+        if batch is None: #没有新特征，或特征在打断前产生(对应的音频已被清空)
             continue
-        is_all_silence=True
-        audio_frames = []
-        for _ in range(batch_size*2):
-            frame,type,eventpoint = audio_out_queue.get()
-            audio_frames.append((frame,type,eventpoint))
-            if type==0:
-                is_all_silence=False
+        gen,whisper_chunks,audio_frames,index = batch  #和休眠时的待机循环共用帧序号
+        is_all_silence = all(type!=0 for _,type,_ in audio_frames)
         if is_all_silence:
-            for i in range(batch_size):
-                res_frame_queue.put((None,__mirror_index(length,index),audio_frames[i*2:i*2+2]))
-                index = index + 1
+            cursor.put(gen,res_frame_queue,[(None,__mirror_index(length,index+i),audio_frames[i*2:i*2+2])
+                                            for i in range(batch_size)])
         else:
             # print('infer=======')
             t=time.perf_counter()
@@ -173,20 +205,10 @@ def inference(quit_event,batch_size,input_latent_list_cycle,audio_feat_queue,aud
             latent_batch = torch.cat(latent_batch, dim=0)
             
             # for i, (whisper_batch,latent_batch) in enumerate(gen):
-            audio_feature_batch = torch.from_numpy(whisper_batch)
-            audio_feature_batch = audio_feature_batch.to(device=unet.device,
-                                                            dtype=unet.model.dtype)
-            audio_feature_batch = pe(audio_feature_batch)
-            latent_batch = latent_batch.to(dtype=unet.model.dtype)
-            # print('prepare time:',time.perf_counter()-t)
-            # t=time.perf_counter()
-
-            pred_latents = unet.model(latent_batch, 
-                                        timesteps, 
-                                        encoder_hidden_states=audio_feature_batch).sample
-            # print('unet time:',time.perf_counter()-t)
-            # t=time.perf_counter()
-            recon = vae.decode_latents(pred_latents)
+            if infer_service is not None:
+                recon = infer_service.infer(sessionid, model, (whisper_batch, latent_batch))
+            else:
+                recon = infer_batch(model, whisper_batch, latent_batch)
             # infer_inqueue.put((whisper_batch,latent_batch,sessionid))
             # recon,outsessionid = infer_outqueue.get()
             # if outsessionid != sessionid:
@@ -194,18 +216,22 @@ def inference(quit_event,batch_size,input_latent_list_cycle,audio_feat_queue,aud
 
             # print('vae time:',time.perf_counter()-t)
             #print('diffusion len=',len(recon))
-            counttime += (time.perf_counter() - t)
+            elapsed = time.perf_counter() - t
+            counttime += elapsed
+            if get_admission() is not None:
+                get_admission().record_infer(sessionid, batch_size, elapsed)
+            metrics.INFER_BATCH.observe(elapsed, sessionid=sessionid)
             count += batch_size
             #_totalframe += 1
             if count>=100:
                 logger.info(f"------actual avg infer fps:{count/counttime:.4f}")
                 count=0
                 counttime=0
-            for i,res_frame in enumerate(recon):
-                #self.__pushmedia(res_frame,loop,audio_track,video_track)
-                res_frame_queue.put((res_frame,__mirror_index(length,index),audio_frames[i*2:i*2+2]))
-                index = index + 1
+            #推理期间被打断时丢弃结果
+            cursor.put(gen,res_frame_queue,[(res_frame,__mirror_index(length,index+i),audio_frames[i*2:i*2+2])
+                                            for i,res_frame in enumerate(recon)])
             #print('total batch time:',time.perf_counter()-starttime)            
+    release_thread_budget('infer',sessionid)
     logger.info('musereal inference processor stop')
 
 class MuseReal(BaseReal):
@@ -222,6 +248,7 @@ class MuseReal(BaseReal):
         self.idx = 0
         self.res_frame_queue = mp.Queue(self.batch_size*2)
 
+        self.model = model
         self.vae, self.unet, self.pe, self.timesteps, self.audio_processor = model
         self.frame_list_cycle,self.mask_list_cycle,self.coord_list_cycle,self.mask_coords_list_cycle, self.input_latent_list_cycle = avatar
         #self.__loadavatar()
@@ -270,14 +297,12 @@ class MuseReal(BaseReal):
 
     def paste_back_frame(self,pred_frame,idx:int):
         bbox = self.coord_list_cycle[idx]
-        ori_frame = copy.deepcopy(self.frame_list_cycle[idx])
         x1, y1, x2, y2 = bbox
 
         res_frame = cv2.resize(pred_frame.astype(np.uint8),(x2-x1,y2-y1))
-        mask = self.mask_list_cycle[idx]
-        mask_crop_box = self.mask_coords_list_cycle[idx]
+        ori_frame = self.frame_ring.acquire(self.frame_list_cycle,idx,(y1,y2,x1,x2)) #只在人脸框内混合
 
-        combine_frame = get_image_blending(ori_frame,res_frame,bbox,mask,mask_crop_box)
+        combine_frame = blend_face(ori_frame,res_frame,bbox,self.mask_list_cycle[idx])
         return combine_frame
             
     def render(self,quit_event,loop=None,audio_track=None,video_track=None):
@@ -291,7 +316,7 @@ class MuseReal(BaseReal):
         infer_quit_event = Event()
         infer_thread = Thread(target=inference, args=(infer_quit_event,self.batch_size,self.input_latent_list_cycle,
                                            self.asr.feat_queue,self.asr.output_queue,self.res_frame_queue,
-                                           self.vae, self.unet, self.pe,self.timesteps)) #mp.Process
+                                           self.model,get_infer_service(),self.sessionid,self.frame_cursor)) #mp.Process
         infer_thread.start()
         
         process_quit_event = Event()
@@ -304,10 +329,17 @@ class MuseReal(BaseReal):
         _starttime=time.perf_counter()
         #_totalframe=0
         while not quit_event.is_set(): #todo
+            apply_thread_budget('asr',self.sessionid)
+            if self.interrupt_event.is_set():
+                self.drain_pipeline()
             # update texture every frame
             # audio stream thread...
-            t = time.perf_counter()
-            self.asr.run_step()
+            if self.check_hibernate():
+                self.idle_step()
+            else:
+                t = time.perf_counter()
+                self.asr.run_step()
+                metrics.ASR_STEP.observe(time.perf_counter()-t,sessionid=self.sessionid)
             #self.test_step(loop,audio_track,video_track)
             # totaltime += (time.perf_counter() - t)
             # count += self.opt.batch_size
@@ -315,9 +347,10 @@ class MuseReal(BaseReal):
             #     print(f"------actual avg infer fps:{count/totaltime:.4f}")
             #     count=0
             #     totaltime=0
-            if video_track and video_track._queue.qsize()>=1.5*self.opt.batch_size:
+            delay = self.render_delay(video_track,1.5*self.opt.batch_size)
+            if delay>0:
                 logger.debug('sleep qsize=%d',video_track._queue.qsize())
-                time.sleep(0.04*video_track._queue.qsize()*0.8)
+                self.interrupt_event.wait(delay) #有打断时立即醒来
             # if video_track._queue.qsize()>=5:
             #     print('sleep qsize=',video_track._queue.qsize())
             #     time.sleep(0.04*video_track._queue.qsize()*0.8)
@@ -325,10 +358,13 @@ class MuseReal(BaseReal):
             # delay = _starttime+_totalframe*0.04-time.perf_counter() #40ms
             # if delay > 0:
             #     time.sleep(delay)
+        release_thread_budget('asr',self.sessionid)
         logger.info('musereal thread stop')
 
         infer_quit_event.set()
         infer_thread.join()
+        if get_infer_service() is not None:
+            get_infer_service().release(self.sessionid)
 
         process_quit_event.set()
         process_thread.join()
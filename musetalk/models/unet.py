@@ -9,6 +9,8 @@ import time
 import numpy as np
 import os
 
+from modelregistry import load_weights
+
 class PositionalEncoding(nn.Module):
     def __init__(self, d_model=384, max_len=5000):
         super(PositionalEncoding, self).__init__()
@@ -41,7 +43,7 @@ class UNet():
             self.device = device
         else:
             self.device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
-        weights = torch.load(model_path) if torch.cuda.is_available() else torch.load(model_path, map_location=self.device)
+        weights = load_weights(model_path, map_location=self.device)
         self.model.load_state_dict(weights)
         if use_float16:
             self.model = self.model.half()
@@ -24,4 +24,38 @@ def get_image_blending(image,face,face_box,mask_array,crop_box):
     body[y_s:y_e, x_s:x_e] = cv2.blendLinear(face_large,body[y_s:y_e, x_s:x_e],mask_image,1-mask_image)
 
     #body.paste(face_large, crop_box[:2], mask_image)
-    return body
\ No newline at end of file
+    return body
+
+def prepare_blend_mask(mask_array,face_box,crop_box):
+    '''
+    加载形象时预计算混合用的alpha：取mask在人脸框内的部分，转成0~256的定点数(uint16，
+    混合时>>8即除以256)，并跳过顶部alpha全为0的行(人脸上半部分不参与混合)。
+    返回 (top, alpha)，alpha形状为(h-top, w, 1)
+    '''
+    if mask_array.ndim == 3:
+        mask_array = cv2.cvtColor(mask_array,cv2.COLOR_BGR2GRAY)
+    x, y, x1, y1 = face_box
+    x_s, y_s, x_e, y_e = crop_box
+    face_mask = mask_array[y-y_s:y1-y_s, x-x_s:x1-x_s]
+    rows = np.flatnonzero(face_mask.any(axis=1))
+    top = int(rows[0]) if len(rows) else face_mask.shape[0]
+    alpha = (face_mask[top:].astype(np.uint32)*256 + 127)//255
+    return top, np.ascontiguousarray(alpha.astype(np.uint16)[:, :, None])
+
+def blend_face(body,face,face_box,blend_mask):
+    '''
+    把face按预计算的alpha原地混合进body，和get_image_blending等价(误差不超过1)。
+    crop_box内人脸框以外的区域混合前后不变，所以只处理人脸框内alpha非零的行，全程整数运算
+    '''
+    top, alpha = blend_mask
+    x, y, x1, y1 = face_box
+    roi = body[y+top:y1, x:x1]
+    out = face[top:].astype(np.uint16)
+    out *= alpha
+    background = roi.astype(np.uint16)
+    background *= 256 - alpha
+    out += background
+    out += 128
+    out >>= 8
+    roi[...] = out
+    return body
@@ -0,0 +1,129 @@
+###############################################################################
+#  Offline batch render
+#  把音频文件或TTS合成的语音走一遍和直播相同的 ASR -> 推理 -> 贴回 流程，
+#  不做实时节奏控制，尽可能快地生成帧并直接封装为MP4
+###############################################################################
+
+import os
+import time
+from fractions import Fraction
+from threading import Thread, Event
+
+import numpy as np
+import av
+
+from logger import logger
+
+VIDEO_FPS = 25
+SAMPLE_RATE = 16000
+
+
+class Mp4Writer:
+    """H264 + AAC 封装"""
+
+    def __init__(self, path: str, fps: int = VIDEO_FPS, crf: int = 20):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.path = path
+        self.container = av.open(path, mode='w')
+        self.vstream = self.container.add_stream('libx264', rate=fps)
+        self.vstream.pix_fmt = 'yuv420p'
+        self.vstream.options = {'preset': 'veryfast', 'crf': str(crf)}
+        self.astream = self.container.add_stream('aac', rate=SAMPLE_RATE)
+        self.astream.codec_context.layout = 'mono'
+        self.astream.codec_context.time_base = Fraction(1, SAMPLE_RATE)
+        self.frames = 0
+        self.samples = 0
+
+    def write(self, image: np.ndarray, audio_frames):
+        if self.frames == 0:
+            self.vstream.height, self.vstream.width = image.shape[:2]
+        frame = av.VideoFrame.from_ndarray(image, format='bgr24')
+        frame.pts = self.frames
+        self.frames += 1
+        for packet in self.vstream.encode(frame):
+            self.container.mux(packet)
+        for audio, _, _ in audio_frames:
+            pcm = (audio * 32767).astype(np.int16).reshape(1, -1)
+            aframe = av.AudioFrame.from_ndarray(pcm, format='s16', layout='mono')
+            aframe.sample_rate = SAMPLE_RATE
+            aframe.pts = self.samples
+            self.samples += pcm.shape[1]
+            for packet in self.astream.encode(aframe):
+                self.container.mux(packet)
+
+    def close(self):
+        for packet in self.vstream.encode(None):
+            self.container.mux(packet)
+        for packet in self.astream.encode(None):
+            self.container.mux(packet)
+        self.container.close()
+
+
+def render_offline(nerfreal, out_path: str, audio: bytes = None, text: str = None, timeout: float = 30) -> dict:
+    """
+    离线渲染一个会话对象，返回统计信息(含实时率)。调用方负责构建和销毁会话
+
+    Args:
+        nerfreal: 尚未开始渲染的会话对象
+        out_path: 输出MP4路径
+        audio: 音频文件内容(任意soundfile支持的格式)
+        text: 需要TTS合成的文本
+        timeout: 超过这么多秒没有新帧时放弃
+    """
+    t_start = time.perf_counter()
+    if text:
+        #直接在当前线程合成，全部语音进入ASR队列后再开始渲染
+        nerfreal.tts.txt_to_audio((text, {}))
+    if audio:
+        nerfreal.put_audio_file(audio)
+    expected = nerfreal.asr.queue.qsize()
+    if expected == 0:
+        raise ValueError('nothing to render')
+    tts_time = time.perf_counter() - t_start
+
+    writer = Mp4Writer(out_path)
+    done = Event()
+    state = {'speech': 0, 'last': time.time()}
+
+    def sink(image, audio_frames):
+        if done.is_set():
+            return
+        speech = sum(1 for _, type, _ in audio_frames if type == 0)
+        if state['speech'] == 0 and speech == 0: #跳过开头的静音
+            return
+        writer.write(image, audio_frames)
+        state['speech'] += speech
+        state['last'] = time.time()
+        if state['speech'] >= expected:
+            done.set()
+
+    nerfreal.frame_sink = sink
+    nerfreal.opt.transport = 'offline'  #会话独立的opt副本，不影响其他会话
+    quit_event = Event()
+    t_render = time.perf_counter()
+    thread = Thread(target=nerfreal.render, args=(quit_event,))
+    thread.start()
+    while not done.wait(1):
+        if time.time() - state['last'] > timeout:
+            logger.warning(f'offline render stalled, {state["speech"]}/{expected} audio chunks rendered')
+            break
+    quit_event.set()
+    thread.join()
+    writer.close()
+
+    render_time = time.perf_counter() - t_render
+    duration = writer.frames / VIDEO_FPS
+    result = {
+        'path': out_path,
+        'frames': writer.frames,
+        'duration': duration,
+        'tts_time': tts_time,
+        'render_time': render_time,
+        'total_time': time.perf_counter() - t_start,
+        'complete': done.is_set(),
+        #实时率：处理耗时/视频时长，小于1表示快于实时
+        'rtf': render_time / duration if duration > 0 else None,
+    }
+    logger.info(f"offline render {out_path}: {writer.frames} frames, {duration:.1f}s in {render_time:.1f}s, "
+                f"rtf={result['rtf'] or 0:.3f}")
+    return result
@@ -0,0 +1,225 @@
+###############################################################################
+#  Session lifecycle manager
+#  负责会话的构建与确定性销毁：等待会话拥有的所有线程退出、关闭录制管道、
+#  释放队列和显存，并确认内存已回收；同时统计每个会话的内存占用
+###############################################################################
+
+import gc
+import time
+import asyncio
+import weakref
+from collections import deque
+from typing import Callable, Dict, Optional
+
+import torch
+
+from logger import logger
+from admission import get_rss_bytes
+from eventhub import get_event_hub
+import metrics
+
+
+def _gpu_allocated() -> int:
+    if torch.cuda.is_available():
+        return torch.cuda.memory_allocated()
+    return 0
+
+
+class SessionInfo:
+    def __init__(self, sessionid, nerfreal, rss_delta: int, gpu_delta: int, build_time: float):
+        self.sessionid = sessionid
+        self.ref = weakref.ref(nerfreal)
+        self.created = time.time()
+        self.rss_delta = rss_delta
+        self.gpu_delta = gpu_delta
+        self.build_time = build_time
+        self.player = None
+        self.detached = None    #连接断开等待重连的开始时间
+        self.expire = None      #宽限期到期后销毁会话的定时器
+        self.reconnects = 0
+
+    def info(self) -> dict:
+        nerfreal = self.ref()
+        data = {
+            'sessionid': self.sessionid,
+            'created': self.created,
+            'build_time': self.build_time,
+            'build_rss_mb': self.rss_delta / 1024**2,
+            'build_gpu_mb': self.gpu_delta / 1024**2,
+            'detached': self.detached,
+            'reconnects': self.reconnects,
+        }
+        if nerfreal is not None:
+            data['owned_mb'] = nerfreal.owned_bytes() / 1024**2
+            data['queues'] = nerfreal.get_queue_depths()
+            data['speaking'] = nerfreal.is_speaking()
+            data['hibernating'] = nerfreal.hibernating
+            data['interrupt_latency'] = nerfreal.interrupt_latency
+            if nerfreal.compose_pool is not None:
+                data['compose'] = nerfreal.compose_pool.stats()
+        if self.player is not None:
+            data['underruns'] = {'audio': self.player.audio.underruns, 'video': self.player.video.underruns}
+            data['idle_packets'] = self.player.video.idle_packets
+        return data
+
+
+class SessionManager:
+    """
+    会话生命周期管理
+
+    使用方法:
+        manager = SessionManager(nerfreals, build_nerfreal)
+        nerfreal = manager.build(sessionid)        # 代替直接调用 build_nerfreal
+        nerfreal = manager.prebuild(sessionid)     # 预热池构建，manager.adopt(sessionid)后才计入会话统计
+        manager.attach_player(sessionid, player)
+        manager.detach(sessionid, grace)           # 连接断开，保留会话等待重连
+        player = manager.reattach(sessionid)       # 新连接接入已有会话
+        await manager.close(sessionid)             # 连接关闭时调用
+    """
+
+    def __init__(self, sessions: Dict, build_fn: Callable, history: int = 50):
+        """
+        Args:
+            sessions: app中的 sessionid->BaseReal 字典
+            build_fn: 构建会话的函数 build_fn(sessionid, *args) -> BaseReal
+            history: 保留最近多少个已销毁会话的回收记录
+        """
+        self.sessions = sessions
+        self.build_fn = build_fn
+        self._infos: Dict[int, SessionInfo] = {}
+        self._prebuilt: Dict[int, SessionInfo] = {}   #预热池中还没有连接取用的会话
+        self._closed = deque(maxlen=history)
+
+    def _build(self, sessionid, *args):
+        rss = get_rss_bytes()
+        gpu = _gpu_allocated()
+        t = time.perf_counter()
+        nerfreal = self.build_fn(sessionid, *args)
+        info = SessionInfo(sessionid, nerfreal, get_rss_bytes() - rss,
+                           _gpu_allocated() - gpu, time.perf_counter() - t)
+        return nerfreal, info
+
+    def build(self, sessionid, *args):
+        nerfreal, self._infos[sessionid] = self._build(sessionid, *args)
+        return nerfreal
+
+    def prebuild(self, sessionid, *args):
+        """预热池构建会话，还没有连接取用，不计入会话统计"""
+        nerfreal, self._prebuilt[sessionid] = self._build(sessionid, *args)
+        return nerfreal
+
+    def adopt(self, sessionid):
+        """预热池的会话交给/offer时调用，开始计入会话统计"""
+        info = self._prebuilt.pop(sessionid, None)
+        if info is not None:
+            self._infos[sessionid] = info
+
+    def attach_player(self, sessionid, player):
+        info = self._infos.get(sessionid)
+        if info is not None:
+            info.player = player
+
+    def detach(self, sessionid, grace: float):
+        """连接断开：会话继续渲染，保留grace秒等待同一个sessionid重连，超时后销毁"""
+        info = self._infos.get(sessionid)
+        if info is None or info.player is None:
+            asyncio.ensure_future(self.close(sessionid))
+            return
+        if info.expire is not None:
+            info.expire.cancel()
+        info.detached = time.time()
+        info.player.detach()
+        info.expire = asyncio.get_event_loop().call_later(
+            grace, lambda: asyncio.ensure_future(self.close(sessionid)))
+        logger.info(f'session {sessionid} detached, wait {grace}s for reconnect')
+
+    def reattach(self, sessionid):
+        """
+        新的连接接入已断开、仍在宽限期内的会话，返回会话的player；
+        会话不存在、已超时销毁或仍有连接在观看时返回None，sessionid可被猜到，不能抢占在线会话
+        """
+        info = self._infos.get(sessionid)
+        if info is None or info.player is None or self.sessions.get(sessionid) is None:
+            return None
+        if info.detached is None:
+            logger.warning(f'session {sessionid} is still connected, refuse reattach')
+            return None
+        if info.expire is not None:
+            info.expire.cancel()
+            info.expire = None
+        logger.info(f'session {sessionid} reattached after {time.time()-info.detached:.1f}s')
+        info.detached = None
+        info.reconnects += 1
+        info.player.reattach()
+        return info.player
+
+    async def close(self, sessionid):
+        """销毁会话，可重复调用"""
+        #用列表传递会话对象，避免本协程持有引用导致无法确认是否已回收
+        holder = [self.sessions.pop(sessionid, None)]
+        info = self._infos.pop(sessionid, None)
+        if holder[0] is None and info is None:
+            return
+        get_event_hub().close_session(sessionid)
+        player = info.player if info is not None else None
+        if info is not None:
+            info.player = None
+            if info.expire is not None:
+                info.expire.cancel()
+                info.expire = None
+        result = await asyncio.get_event_loop().run_in_executor(None, self._teardown, sessionid, holder, player, info)
+        if player is not None:
+            #线程已退出，这里停止track只会清空其队列
+            player.audio.stop()
+            player.video.stop()
+        self._closed.append(result)
+
+    def _teardown(self, sessionid, holder: list, player, info: Optional[SessionInfo]) -> dict:
+        nerfreal = holder.pop()
+        t = time.perf_counter()
+        rss_before = get_rss_bytes()
+        gpu_before = _gpu_allocated()
+        threads_ok = True
+        if player is not None:
+            threads_ok = player.shutdown() and threads_ok
+        if nerfreal is not None:
+            threads_ok = nerfreal.close() and threads_ok
+        from batchinfer import get_infer_service
+        if get_infer_service() is not None:
+            get_infer_service().release(sessionid)
+        metrics.remove_session(sessionid)
+        from avatarregistry import get_avatar_registry
+        if nerfreal is not None and get_avatar_registry() is not None:
+            get_avatar_registry().release(nerfreal.opt.avatar_id)
+
+        ref = weakref.ref(nerfreal) if nerfreal is not None else None
+        del nerfreal
+        gc.collect()
+        if torch.cuda.is_available():
+            torch.cuda.empty_cache()
+        freed = ref is None or ref() is None
+        result = {
+            'sessionid': sessionid,
+            'closed': time.time(),
+            'teardown_time': time.perf_counter() - t,
+            'threads_stopped': threads_ok,
+            'object_freed': freed,
+            'reclaimed_rss_mb': (rss_before - get_rss_bytes()) / 1024**2,
+            'reclaimed_gpu_mb': (gpu_before - _gpu_allocated()) / 1024**2,
+            'build_rss_mb': info.rss_delta / 1024**2 if info is not None else 0,
+        }
+        if not threads_ok or not freed:
+            logger.warning(f'session {sessionid} teardown incomplete: {result}')
+        else:
+            logger.info(f"session {sessionid} closed in {result['teardown_time']:.3f}s, "
+                        f"reclaimed rss {result['reclaimed_rss_mb']:.1f}MB gpu {result['reclaimed_gpu_mb']:.1f}MB")
+        return result
+
+    def stats(self) -> dict:
+        return {
+            'rss_mb': get_rss_bytes() / 1024**2,
+            'gpu_allocated_mb': _gpu_allocated() / 1024**2,
+            'sessions': [info.info() for info in list(self._infos.values())],
+            'prebuilt': len(self._prebuilt),
+            'closed': list(self._closed),
+        }
@@ -0,0 +1,105 @@
+###############################################################################
+#  Pre-warmed session pool
+#  预先构建并预热 BaseReal 实例，/offer 时直接取用，后台线程负责补充
+###############################################################################
+
+import time
+import queue
+from queue import Queue
+from threading import Thread, Event, Lock
+from typing import Callable, Optional, Tuple
+
+from logger import logger
+
+
+class SessionPool:
+    """
+    预热会话池
+
+    使用方法:
+        pool = SessionPool(build_nerfreal, new_sessionid, size=2)
+        pool.start()
+        item = pool.acquire()  # (sessionid, nerfreal)，池为空时返回None
+    """
+
+    def __init__(self, build_fn: Callable, id_fn: Callable, size: int = 1):
+        """
+        Args:
+            build_fn: 构建会话的函数 build_fn(sessionid) -> BaseReal
+            id_fn: 生成新sessionid的函数
+            size: 池中保持的预热实例数
+        """
+        self.build_fn = build_fn
+        self.id_fn = id_fn
+        self.size = size
+        self._pool: Queue = Queue()
+        self._wakeup = Event()
+        self._quit = Event()
+        self._reserved = set()  #正在构建或在池中等待的sessionid
+        self._lock = Lock()
+        self._thread: Optional[Thread] = None
+        self.hits = 0
+        self.misses = 0
+
+    def start(self):
+        if self._thread is None:
+            self._thread = Thread(target=self._refill, name="session-pool", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._quit.set()
+        self._wakeup.set()
+
+    def acquire(self) -> Optional[Tuple[int, object]]:
+        """取出一个预热好的会话，池为空时返回None并触发补充"""
+        try:
+            item = self._pool.get_nowait()
+            self.hits += 1
+            with self._lock:
+                self._reserved.discard(item[0])
+        except queue.Empty:
+            item = None
+            self.misses += 1
+            logger.info('session pool empty, build on demand')
+        self._wakeup.set()
+        return item
+
+    def reserved(self, sessionid: int) -> bool:
+        """sessionid是否已被池占用(正在构建或尚未取出)"""
+        with self._lock:
+            return sessionid in self._reserved
+
+    def qsize(self) -> int:
+        return self._pool.qsize()
+
+    def stats(self) -> dict:
+        return {'size': self.size, 'ready': self._pool.qsize(), 'hits': self.hits, 'misses': self.misses}
+
+    def _reserve(self) -> int:
+        """生成一个新的sessionid并占用，id_fn会调用reserved()检查，所以不能持锁调用"""
+        while True:
+            sessionid = self.id_fn()
+            with self._lock:
+                if sessionid not in self._reserved:
+                    self._reserved.add(sessionid)
+                    return sessionid
+
+    def _refill(self):
+        while not self._quit.is_set():
+            if self._pool.qsize() >= self.size:
+                self._wakeup.wait(1)
+                self._wakeup.clear()
+                continue
+            sessionid = self._reserve()
+            t = time.perf_counter()
+            try:
+                nerfreal = self.build_fn(sessionid)
+            except Exception:
+                with self._lock:
+                    self._reserved.discard(sessionid)
+                logger.exception('session pool build error')
+                self._quit.wait(5)
+                continue
+            self._pool.put((sessionid, nerfreal))
+            logger.info(f'session pool: prebuilt session {sessionid} in {time.perf_counter()-t:.3f}s, ready={self._pool.qsize()}')
+        logger.info('session pool thread stop')
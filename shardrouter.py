@@ -0,0 +1,393 @@
+###############################################################################
+#  Multi-process session sharding
+#  前端进程只做路由：启动N个worker进程(各自加载模型和avatar)，
+#  /offer 分配给负载最低的worker，其余接口按sessionid转发给所属worker
+#
+#  multipart上传(/humanaudio)的请求体原样流式转发、不在路由进程解析，
+#  sessionid必须放在url参数中: POST /humanaudio?sessionid=N
+###############################################################################
+
+import os
+import sys
+import json
+import time
+import asyncio
+import subprocess
+from typing import Dict, List, Optional
+
+import aiohttp
+from aiohttp import web
+import aiohttp_cors
+
+from logger import logger
+from metrics import merge_metrics
+
+#按sessionid转发给所属worker的接口
+SESSION_ROUTES = ["/human", "/humanaudio", "/set_audiotype", "/record", "/interrupt_talk", "/is_speaking"]
+
+#各worker各自的统计接口，路由进程向所有worker请求后按worker_id汇总
+FAN_OUT_ROUTES = ["/admin/avatars", "/admin/models", "/admin/llm", "/infer_stats"]
+
+
+class Worker:
+    def __init__(self, worker_id: int, port: int, proc: subprocess.Popen):
+        self.worker_id = worker_id
+        self.port = port
+        self.proc = proc
+        self.ready = False
+        self.sessions = set()   #worker上报的会话
+        self.pending = 0        #已分配但尚未出现在上报中的会话数
+        self.last_report = 0.0
+        self.capacity: Optional[dict] = None       #worker上报的 /capacity
+        self.session_stats: Optional[dict] = None  #worker上报的 /admin/sessions
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.port}"
+
+    @property
+    def load(self) -> int:
+        return len(self.sessions) + self.pending
+
+    def info(self) -> dict:
+        return {
+            'worker_id': self.worker_id,
+            'port': self.port,
+            'pid': self.proc.pid,
+            'alive': self.proc.poll() is None,
+            'ready': self.ready,
+            'sessions': sorted(self.sessions),
+            'load': self.load,
+            'last_report': self.last_report,
+        }
+
+
+class ShardRouter:
+    """
+    会话分片路由
+
+    使用方法:
+        router = ShardRouter(opt, sys.argv[1:])
+        router.start_workers()
+        app = router.create_app()
+    """
+
+    def __init__(self, opt, argv: List[str], poll_interval: float = 2.0):
+        self.opt = opt
+        self.argv = argv
+        self.poll_interval = poll_interval
+        self.workers: List[Worker] = []
+        self.owners: Dict[int, Worker] = {}  #sessionid -> worker
+        self._client: Optional[aiohttp.ClientSession] = None
+
+    def start_workers(self):
+        for k in range(self.opt.workers):
+            port = self.opt.listenport + 1 + k
+            #复用启动参数，后面的参数覆盖前面的同名参数
+            cmd = [sys.executable, sys.argv[0], *self.argv,
+                   '--workers', '0', '--listenport', str(port), '--worker_id', str(k)]
+            if getattr(self.opt, 'cpu_budget', 0) > 0:
+                #核心预算在worker之间均分
+                cmd += ['--cpu_budget', str(max(1, self.opt.cpu_budget // self.opt.workers))]
+            proc = subprocess.Popen(cmd, shell=False)
+            self.workers.append(Worker(k, port, proc))
+            logger.info(f'start worker {k} pid={proc.pid} port={port}')
+
+    def stop_workers(self):
+        for worker in self.workers:
+            if worker.proc.poll() is None:
+                worker.proc.terminate()
+        for worker in self.workers:
+            try:
+                worker.proc.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                worker.proc.kill()
+
+    def pick_worker(self) -> Optional[Worker]:
+        """选择负载最低的可用worker"""
+        candidates = [w for w in self.workers if w.ready and w.proc.poll() is None]
+        if not candidates:
+            return None
+        return min(candidates, key=lambda w: (w.load, w.worker_id))
+
+    async def poll_workers(self):
+        while True:
+            for worker in self.workers:
+                try:
+                    async with self._client.get(worker.url + '/worker_stats',
+                                                timeout=aiohttp.ClientTimeout(total=2)) as resp:
+                        data = (await resp.json())['data']
+                    sessions = set(data['sessions'])
+                    #新上报的会话抵消pending计数
+                    worker.pending = max(0, worker.pending - len(sessions - worker.sessions))
+                    for sessionid in worker.sessions - sessions:
+                        if self.owners.get(sessionid) is worker:
+                            del self.owners[sessionid]
+                    worker.sessions = sessions
+                    worker.capacity = data.get('capacity')
+                    worker.session_stats = data.get('session_stats')
+                    for sessionid in sessions:
+                        self.owners[sessionid] = worker
+                    worker.ready = True
+                    worker.last_report = time.time()
+                except Exception:
+                    worker.ready = False
+            await asyncio.sleep(self.poll_interval)
+
+    async def _forward(self, worker: Worker, request: web.Request, data) -> web.Response:
+        headers = {}
+        if 'Content-Type' in request.headers: #保留multipart的boundary
+            headers['Content-Type'] = request.headers['Content-Type']
+        async with self._client.request(request.method, worker.url + request.path_qs,
+                                        data=data, headers=headers) as resp:
+            body = await resp.read()
+            return web.Response(body=body, status=resp.status, content_type=resp.content_type)
+
+    async def offer(self, request: web.Request) -> web.Response:
+        body = await request.read()
+        try:
+            sessionid = json.loads(body).get('sessionid')
+        except (ValueError, AttributeError):
+            sessionid = None
+        if sessionid is not None and sessionid in self.owners: #重连交给会话所在的worker
+            return await self._forward(self.owners[sessionid], request, body)
+        worker = self.pick_worker()
+        if worker is None:
+            return web.Response(
+                status=503,
+                content_type="application/json",
+                text=json.dumps({"code": -1, "msg": "no worker available"}),
+            )
+        worker.pending += 1
+        try:
+            resp = await self._forward(worker, request, body)
+        except Exception:
+            worker.pending = max(0, worker.pending - 1)
+            raise
+        try:
+            sessionid = json.loads(resp.body)['sessionid']
+            self.owners[sessionid] = worker
+            logger.info(f'session {sessionid} placed on worker {worker.worker_id}, load={worker.load}')
+        except (ValueError, KeyError, TypeError):
+            worker.pending = max(0, worker.pending - 1)
+        return resp
+
+    async def render(self, request: web.Request) -> web.Response:
+        """离线渲染交给负载最低的worker，输出文件在共享的 data/renders 目录"""
+        worker = self.pick_worker()
+        if worker is None:
+            return web.Response(
+                status=503,
+                content_type="application/json",
+                text=json.dumps({"code": -1, "msg": "no worker available"}),
+            )
+        if request.content_type == 'multipart/form-data':
+            data = self._stream_body(request)
+        else:
+            data = await request.read()
+        return await self._forward(worker, request, data)
+
+    async def _stream_body(self, request: web.Request):
+        """请求体原样流式转发，不在路由进程缓存上传的文件"""
+        async for chunk in request.content.iter_chunked(64 * 1024):
+            yield chunk
+
+    async def session_route(self, request: web.Request) -> web.Response:
+        sessionid = request.query.get('sessionid')
+        if request.content_type == 'multipart/form-data':
+            if sessionid is None:
+                return web.Response(
+                    status=400,
+                    content_type="application/json",
+                    text=json.dumps({"code": -1, "msg": "multipart upload needs sessionid in the query string"}),
+                )
+            data = self._stream_body(request)
+        else:
+            data = await request.read()
+            if sessionid is None:
+                params = json.loads(data) if data else {}
+                sessionid = params.get('sessionid', 0)
+        sessionid = int(sessionid or 0)
+        worker = self.owners.get(sessionid)
+        if worker is None:
+            return web.Response(
+                content_type="application/json",
+                text=json.dumps({"code": -1, "msg": f"session {sessionid} not found"}),
+            )
+        return await self._forward(worker, request, data)
+
+    async def events(self, request: web.Request) -> web.StreamResponse:
+        """转发所属worker的事件流"""
+        sessionid = int(request.query.get('sessionid', 0))
+        worker = self.owners.get(sessionid)
+        if worker is None:
+            return web.Response(
+                content_type="application/json",
+                text=json.dumps({"code": -1, "msg": f"session {sessionid} not found"}),
+            )
+        async with self._client.get(worker.url + request.path_qs,
+                                    timeout=aiohttp.ClientTimeout(total=None)) as upstream:
+            resp = web.StreamResponse(status=upstream.status, headers={
+                'Content-Type': upstream.headers.get('Content-Type', 'text/event-stream'),
+                'Cache-Control': 'no-cache',
+            })
+            await resp.prepare(request)
+            async for chunk in upstream.content.iter_any():
+                await resp.write(chunk)
+        return resp
+
+    async def audio_ingest(self, request: web.Request) -> web.StreamResponse:
+        """转发音频推送WebSocket到所属worker"""
+        sessionid = int(request.query.get('sessionid', 0))
+        worker = self.owners.get(sessionid)
+        if worker is None:
+            return web.Response(
+                content_type="application/json",
+                text=json.dumps({"code": -1, "msg": f"session {sessionid} not found"}),
+            )
+        ws = web.WebSocketResponse(heartbeat=30)
+        await ws.prepare(request)
+        async with self._client.ws_connect(worker.url + request.path_qs) as upstream:
+            async def downstream():
+                async for msg in upstream:
+                    if msg.type == aiohttp.WSMsgType.TEXT:
+                        await ws.send_str(msg.data)
+            task = asyncio.ensure_future(downstream())
+            async for msg in ws:
+                if msg.type == aiohttp.WSMsgType.BINARY:
+                    await upstream.send_bytes(msg.data)
+                elif msg.type == aiohttp.WSMsgType.TEXT:
+                    await upstream.send_str(msg.data)
+            task.cancel()
+        return ws
+
+    def _reporting(self) -> List[Worker]:
+        return [w for w in self.workers if w.ready and w.proc.poll() is None]
+
+    async def capacity(self, request: web.Request) -> web.Response:
+        """汇总各worker上报的容量"""
+        workers = [dict(w.capacity, worker_id=w.worker_id) for w in self._reporting() if w.capacity is not None]
+        frees = [cap['free_sessions'] for cap in workers]
+        free = sum(frees) if frees and -1 not in frees else -1  # -1: 有worker尚无推理数据，容量未知
+        data = {
+            'sessions': sum(cap['sessions'] for cap in workers),
+            'free_sessions': free if workers else 0,
+            'reason': '' if free != 0 and workers else
+                      ('; '.join(sorted({cap['reason'] for cap in workers if cap['reason']})) or 'no worker available'),
+            'workers': workers,
+        }
+        return web.Response(
+            content_type="application/json",
+            text=json.dumps({"code": 0, "data": data}),
+        )
+
+    async def admin_sessions(self, request: web.Request) -> web.Response:
+        """汇总各worker上报的会话信息，每个会话附带所在的worker_id"""
+        sessions, workers = [], []
+        for w in self._reporting():
+            stats = w.session_stats
+            if stats is None:
+                continue
+            sessions += [dict(info, worker_id=w.worker_id) for info in stats['sessions']]
+            workers.append({'worker_id': w.worker_id, 'rss_mb': stats['rss_mb'],
+                            'gpu_allocated_mb': stats['gpu_allocated_mb'], 'closed': stats['closed']})
+        return web.Response(
+            content_type="application/json",
+            text=json.dumps({"code": 0, "data": {"sessions": sessions, "workers": workers}}),
+        )
+
+    async def _fetch_workers(self, path: str, read) -> Dict[int, object]:
+        """并发请求所有在线worker的GET接口，返回 worker_id -> await read(resp)，失败的worker不在结果中"""
+        results = {}
+
+        async def fetch(w: Worker):
+            try:
+                async with self._client.get(w.url + path, timeout=aiohttp.ClientTimeout(total=2)) as resp:
+                    results[w.worker_id] = await read(resp)
+            except Exception as e:
+                logger.warning(f'fetch {path} from worker {w.worker_id} failed: {e}')
+
+        await asyncio.gather(*(fetch(w) for w in self._reporting()))
+        return results
+
+    async def fan_out(self, request: web.Request) -> web.Response:
+        """FAN_OUT_ROUTES：各worker的返回按worker_id列出，没有应答的worker带error"""
+        results = await self._fetch_workers(request.path, lambda resp: resp.json())
+        workers = []
+        for w in self.workers:
+            if w.worker_id in results:
+                workers.append({'worker_id': w.worker_id, 'data': results[w.worker_id].get('data')})
+            else:
+                workers.append({'worker_id': w.worker_id, 'error': 'worker not available'})
+        return web.Response(
+            content_type="application/json",
+            text=json.dumps({"code": 0, "data": {"workers": workers}}),
+        )
+
+    async def metrics(self, request: web.Request) -> web.Response:
+        """合并各worker的 /metrics，每个序列加上worker标签"""
+        texts = await self._fetch_workers('/metrics', lambda resp: resp.text())
+        lines = ['# HELP livetalking_worker_up Whether the worker answered the metrics scrape',
+                 '# TYPE livetalking_worker_up gauge']
+        lines += [f'livetalking_worker_up{{worker="{w.worker_id}"}} {int(w.worker_id in texts)}' for w in self.workers]
+        lines += merge_metrics(texts)
+        return web.Response(
+            body=('\n'.join(lines) + '\n').encode('utf-8'),
+            headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8"},
+        )
+
+    async def admin_workers(self, request: web.Request) -> web.Response:
+        return web.Response(
+            content_type="application/json",
+            text=json.dumps({"code": 0, "data": [w.info() for w in self.workers]}),
+        )
+
+    async def on_startup(self, app):
+        self._client = aiohttp.ClientSession()
+        app['poll_task'] = asyncio.get_event_loop().create_task(self.poll_workers())
+
+    async def on_shutdown(self, app):
+        app['poll_task'].cancel()
+        await self._client.close()
+        self.stop_workers()
+
+    def create_app(self) -> web.Application:
+        appasync = web.Application(client_max_size=1024**2*100)
+        appasync.on_startup.append(self.on_startup)
+        appasync.on_shutdown.append(self.on_shutdown)
+        appasync.router.add_post("/offer", self.offer)
+        for path in SESSION_ROUTES:
+            appasync.router.add_post(path, self.session_route)
+        appasync.router.add_get("/events", self.events)
+        appasync.router.add_get("/ws/audio", self.audio_ingest)
+        appasync.router.add_post("/render", self.render)
+        appasync.router.add_get("/admin/workers", self.admin_workers)
+        appasync.router.add_get("/capacity", self.capacity)
+        appasync.router.add_get("/admin/sessions", self.admin_sessions)
+        appasync.router.add_get("/metrics", self.metrics)
+        for path in FAN_OUT_ROUTES:
+            appasync.router.add_get(path, self.fan_out)
+        os.makedirs('data/renders', exist_ok=True)
+        appasync.router.add_static('/renders', path='data/renders')
+        appasync.router.add_static('/', path='web')
+
+        cors = aiohttp_cors.setup(appasync, defaults={
+                "*": aiohttp_cors.ResourceOptions(
+                    allow_credentials=True,
+                    expose_headers="*",
+                    allow_headers="*",
+                )
+            })
+        for route in list(appasync.router.routes()):
+            cors.add(route)
+        return appasync
+
+
+def run_router(opt):
+    router = ShardRouter(opt, sys.argv[1:])
+    router.start_workers()
+    logger.info(f'start shard router with {opt.workers} workers; http://<serverip>:{opt.listenport}/admin/workers')
+    try:
+        web.run_app(router.create_app(), host='0.0.0.0', port=opt.listenport)
+    finally:
+        router.stop_workers()
@@ -0,0 +1,9 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+#测试中不写仓库根目录的livetalking.log，日志经root logger由caplog收集
+from logger import logger, fhandler
+logger.removeHandler(fhandler)
+fhandler.close()
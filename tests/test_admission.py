@@ -0,0 +1,67 @@
+from types import SimpleNamespace
+
+import pytest
+
+pytest.importorskip('torch', reason='pip install -r tests/requirements.txt')
+
+import admission
+from admission import AdmissionController
+
+
+class FakeSession:
+    def __init__(self, speaking=False, video=10):
+        self.speaking = speaking
+        self.video = video
+
+    def is_speaking(self):
+        return self.speaking
+
+    def get_queue_depths(self):
+        return {'video': self.video}
+
+
+def make_controller(monkeypatch, rss_mb=1000, max_mem=0, max_session=0, mode='reject'):
+    monkeypatch.setattr(admission, 'get_rss_bytes', lambda: rss_mb * 1024**2)
+    monkeypatch.setattr(admission, 'get_gpu_memory', lambda: (0, 0))
+    opt = SimpleNamespace(admission=mode, max_session=max_session, fps=50, admission_util=0.8,
+                          admission_max_mem=max_mem, admission_gpu_reserve=0)
+    return AdmissionController(opt)
+
+
+def test_unknown_capacity_without_samples(monkeypatch):
+    controller = make_controller(monkeypatch)
+    cap = controller.capacity([])
+    assert cap['free_sessions'] == -1
+    assert controller.check([]) == (True, '')
+
+
+def test_inference_capacity(monkeypatch):
+    controller = make_controller(monkeypatch)
+    controller.record_infer(1, 10, 0.1)  #每帧10ms，每个会话占用25%的推理时间
+    assert controller.capacity([FakeSession()])['free_sessions'] == 2
+    ok, reason = controller.check([FakeSession()] * 3)
+    assert not ok and reason == 'inference capacity'
+
+
+def test_starving_render_queues(monkeypatch):
+    controller = make_controller(monkeypatch)
+    sessions = [FakeSession(speaking=True, video=0), FakeSession()]
+    ok, reason = controller.check(sessions)
+    assert not ok and reason == 'render queues starving'
+
+
+def test_memory_limit(monkeypatch):
+    controller = make_controller(monkeypatch, rss_mb=1000, max_mem=1500)
+    monkeypatch.setattr(admission, 'get_rss_bytes', lambda: 1200 * 1024**2)
+    #每个会话约100MB，还能再放3个
+    assert controller.capacity([FakeSession(), FakeSession()])['free_sessions'] == 3
+    monkeypatch.setattr(admission, 'get_rss_bytes', lambda: 1500 * 1024**2)
+    assert controller.check([FakeSession()]) == (False, 'memory')
+
+
+def test_max_session_and_off_mode(monkeypatch):
+    controller = make_controller(monkeypatch, max_session=2)
+    assert controller.check([FakeSession()]) == (True, '')
+    assert controller.check([FakeSession()] * 2) == (False, 'max session')
+    controller = make_controller(monkeypatch, max_session=2, mode='off')
+    assert controller.check([FakeSession()] * 5) == (True, '')
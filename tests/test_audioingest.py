@@ -0,0 +1,116 @@
+import queue
+import threading
+
+import pytest
+
+np = pytest.importorskip('numpy', reason='pip install -r tests/requirements.txt')
+pytest.importorskip('aiohttp', reason='pip install -r tests/requirements.txt')
+
+from audioingest import AudioIngest, trim_backlog
+
+
+class FakeASR:
+    def __init__(self, maxsize=0):
+        self.queue = queue.Queue(maxsize)
+
+
+class FakeReal:
+    sessionid = 0
+    chunk = 320
+
+    def __init__(self, maxsize=0):
+        self.asr = FakeASR(maxsize)
+
+    def put_audio_frame(self, audio_chunk, datainfo={}):
+        self.asr.queue.put((audio_chunk, datainfo))
+
+
+def queued(nerfreal):
+    return list(nerfreal.asr.queue.queue)
+
+
+def push_chunks(ingest, eventpoints):
+    """按AudioIngest._push的方式送入若干块，不经过_trim"""
+    for eventpoint in eventpoints:
+        chunk = np.zeros(320, dtype=np.float32)
+        ingest._pushed[id(chunk)] = chunk
+        ingest.nerfreal.put_audio_frame(chunk, eventpoint)
+
+
+def test_trim_backlog_plan():
+    result = trim_backlog([{'status': 'start'}, {}, {}, {}], 3)
+    assert result.dropped == [0, 1]
+    assert result.moved == {2: {'status': 'start'}}
+    result = trim_backlog([{'a': 1}, {'b': 2}, {}], 2)
+    assert result.dropped == [1]
+    assert result.moved == {2: {'b': 2}}
+
+
+def test_trim_moves_eventpoint_to_next_kept_chunk():
+    nerfreal = FakeReal()
+    ingest = AudioIngest(nerfreal, max_buffer_ms=60)  #最多3块
+    push_chunks(ingest, [{'status': 'start'}, {}, {}, {}])
+
+    ingest._trim()
+
+    items = queued(nerfreal)
+    assert len(items) == 2
+    assert items[0][1] == {'status': 'start'}
+    assert ingest.dropped == 2
+
+
+def test_trim_keeps_chunks_whose_eventpoint_cannot_move():
+    nerfreal = FakeReal()
+    ingest = AudioIngest(nerfreal, max_buffer_ms=40)  #最多2块
+    push_chunks(ingest, [{'status': 'start'}, {'status': 'end'}, {}])
+
+    ingest._trim()
+
+    events = [datainfo for _, datainfo in queued(nerfreal)]
+    assert {'status': 'start'} in events
+    assert {'status': 'end'} in events
+
+
+def test_push_over_limit_keeps_utterance_events():
+    nerfreal = FakeReal()
+    ingest = AudioIngest(nerfreal, max_buffer_ms=100)
+    ingest.set_event({'status': 'start'})
+    ingest._push(np.zeros(320 * 20, dtype=np.float32))
+    ingest.set_event({'status': 'end'})
+    ingest._push(np.zeros(320, dtype=np.float32))
+
+    events = [datainfo for _, datainfo in queued(nerfreal) if datainfo]
+    assert events == [{'status': 'start'}, {'status': 'end'}]
+    assert ingest.dropped > 0
+
+
+def test_trim_leaves_audio_from_other_sources():
+    nerfreal = FakeReal()
+    ingest = AudioIngest(nerfreal, max_buffer_ms=40)  #最多2块
+    tts = np.ones(320, dtype=np.float32)
+    nerfreal.put_audio_frame(tts, {'status': 'tts'})
+    push_chunks(ingest, [{}, {}, {}])
+
+    ingest._trim()
+
+    items = queued(nerfreal)
+    assert items[0][0] is tts
+    assert len(items) == 2
+    assert ingest.dropped == 2
+
+
+def test_trim_wakes_blocked_producer():
+    nerfreal = FakeReal(maxsize=3)
+    ingest = AudioIngest(nerfreal, max_buffer_ms=60)
+    push_chunks(ingest, [{}, {}, {}])
+    done = threading.Event()
+
+    def producer():
+        nerfreal.put_audio_frame(np.zeros(320, dtype=np.float32), {})
+        done.set()
+
+    thread = threading.Thread(target=producer, daemon=True)
+    thread.start()
+    assert not done.wait(0.1)
+    ingest._trim()
+    assert done.wait(1)
@@ -0,0 +1,32 @@
+import pytest
+
+np = pytest.importorskip('numpy', reason='pip install -r tests/requirements.txt')
+torch = pytest.importorskip('torch', reason='pip install -r tests/requirements.txt')
+
+from avatarregistry import AvatarRegistry, estimate_bytes
+from modelregistry import get_model_registry
+
+
+def test_estimate_bytes_skips_shared_models():
+    shared = get_model_registry().get('test-shared', 'test-shared.pth', 'cpu', lambda: torch.nn.Linear(100, 100))
+    lazy = get_model_registry().load('test-lazy', 'test-lazy.pth', 'cpu', lambda: torch.nn.Linear(100, 100))
+    own = torch.nn.Linear(10, 10)
+    frames = [np.zeros((4, 4, 3), dtype=np.uint8)] * 2
+    avatar = (shared, lazy, own, frames)
+    assert estimate_bytes(avatar) == (10 * 10 + 10) * 4 + 2 * 48
+
+
+def test_lru_evicts_idle_avatars_only(tmp_path):
+    for name in ('a', 'b', 'c'):
+        (tmp_path / name).mkdir()
+    registry = AvatarRegistry(lambda avatar_id: np.zeros(1024**2, dtype=np.uint8), budget_mb=2, root=str(tmp_path))
+    registry.acquire('a')
+    registry.acquire('b')
+    registry.release('b')
+    registry.pin('c')
+    registry.acquire('c')
+    registry.release('c')
+    #a在用、c常驻，超出预算时只能淘汰b
+    loaded = [entry['avatar_id'] for entry in registry.stats()['loaded']]
+    assert loaded == ['a', 'c']
+    assert registry.evictions == 1
@@ -0,0 +1,64 @@
+import time
+
+import pytest
+
+np = pytest.importorskip('numpy', reason='pip install -r tests/requirements.txt')
+
+from compositor import ComposePool, FrameRing
+
+
+def backgrounds(n=3):
+    return [np.full((8, 8, 3), i + 1, dtype=np.uint8) for i in range(n)]
+
+
+def test_ring_restores_only_the_dirty_region():
+    frames = backgrounds()
+    ring = FrameRing(size=2)
+    box = (2, 4, 2, 4)
+    first = ring.acquire(frames, 0, box)
+    first[2:4, 2:4] = 200
+    ring.acquire(frames, 1, box)
+    #同一个缓冲、同一背景帧再次取到：只恢复上次写过的区域
+    again = ring.acquire(frames, 0, box)
+    assert again is first
+    assert np.array_equal(again, frames[0])
+    assert ring.stats() == {'size': 2, 'allocations': 2, 'full_copies': 2, 'roi_restores': 1}
+
+
+def test_ring_full_copy_when_background_changes():
+    frames = backgrounds()
+    ring = FrameRing(size=1)
+    buf = ring.acquire(frames, 0, (0, 2, 0, 2))
+    buf[0:2, 0:2] = 200
+    buf = ring.acquire(frames, 2, (0, 2, 0, 2))
+    assert np.array_equal(buf, frames[2])
+    assert ring.stats()['full_copies'] == 2
+
+
+def test_ring_reallocates_on_shape_change():
+    ring = FrameRing(size=1)
+    ring.acquire(backgrounds(), 0, (0, 1, 0, 1))
+    bigger = [np.zeros((16, 16, 3), dtype=np.uint8)]
+    buf = ring.acquire(bigger, 0, (0, 1, 0, 1))
+    assert buf.shape == (16, 16, 3)
+    assert ring.stats()['allocations'] == 2
+
+
+def test_compose_pool_keeps_submission_order():
+    pool = ComposePool(workers=3, max_pending=4)
+    try:
+        def slow(value, delay):
+            time.sleep(delay)
+            return value
+
+        pool.submit(slow, 'a', 0.1, tag=1)
+        pool.submit(None, tag=2)
+        pool.submit(slow, 'c', 0.0, tag=3)
+        assert pool.pending() == 3 and not pool.full()
+        results = []
+        while pool.pending():
+            future, tag = pool.pop()
+            results.append((future.result() if future is not None else None, tag))
+        assert results == [('a', 1), (None, 2), ('c', 3)]
+    finally:
+        pool.shutdown()
@@ -0,0 +1,105 @@
+import queue
+import threading
+import time
+
+from framecursor import FrameCursor, drain_queue
+from framequeue import FrameQueue
+
+BATCH = 2
+
+
+class FakePipeline:
+    """ASR一步产生 2*BATCH 个音频帧和一个特征(同run_step)，推理线程按inference的方式成对取出"""
+
+    def __init__(self):
+        self.cursor = FrameCursor()
+        self.feat_queue = queue.Queue(2)
+        self.output_queue = queue.Queue()
+        self.results = queue.Queue()
+        self.quit = threading.Event()
+        self.thread = threading.Thread(target=self.inference, daemon=True)
+
+    def run_step(self, step):
+        for _ in range(BATCH * 2):
+            self.output_queue.put(step)
+        self.feat_queue.put((self.cursor.generation, step))
+
+    def inference(self):
+        while not self.quit.is_set():
+            batch = self.cursor.next_batch(self.feat_queue, self.output_queue, BATCH, timeout=0.05)
+            if batch is None:
+                continue
+            gen, feat, audio_frames, index = batch
+            self.results.put((feat, audio_frames))
+
+    def interrupt(self):
+        """drain_pipeline中与推理线程相关的部分"""
+        return self.cursor.interrupt(self.results, self.feat_queue, self.output_queue)
+
+    def next_result(self):
+        return self.results.get(timeout=2)
+
+
+def test_interrupt_while_inference_blocked_keeps_features_and_audio_paired():
+    p = FakePipeline()
+    p.thread.start()
+    try:
+        p.run_step(1)
+        assert p.next_result() == (1, [1] * BATCH * 2)
+        time.sleep(0.1)  #推理线程阻塞在取特征上
+
+        p.interrupt()
+        for step in (2, 3):
+            p.run_step(step)
+            assert p.next_result() == (step, [step] * BATCH * 2)
+        assert p.output_queue.empty()
+    finally:
+        p.quit.set()
+        p.thread.join()
+
+
+def test_feature_produced_before_interrupt_is_dropped_with_its_audio():
+    p = FakePipeline()
+    #打断前产生的特征，mp.Queue的后台线程在清空之后才把它送到
+    stale_gen = p.cursor.generation
+    for _ in range(BATCH * 2):
+        p.output_queue.put('stale')
+    p.interrupt()
+    p.feat_queue.put((stale_gen, 'stale'))
+    p.thread.start()
+    try:
+        p.run_step(2)
+        assert p.next_result() == (2, [2] * BATCH * 2)
+        assert p.results.empty()
+        assert p.output_queue.empty()
+    finally:
+        p.quit.set()
+        p.thread.join()
+
+
+def test_interrupt_drops_pending_frames_and_rewinds_index():
+    cursor = FrameCursor()
+    res_frame_queue, feat_queue, output_queue = queue.Queue(), queue.Queue(), queue.Queue()
+    track = FrameQueue(maxsize=10)
+    gen = cursor.generation
+    start = cursor.claim(10)
+    assert cursor.put(gen, res_frame_queue, [(None, start + i, []) for i in range(4)])
+    for i in range(3):
+        track.put((f'frame{i}', None))
+    feat_queue.put((gen, 'feat'))
+    #推理线程正在处理的一批，打断之后才放入
+    inflight = cursor.claim(BATCH)
+
+    assert cursor.interrupt(res_frame_queue, feat_queue, output_queue) == 4
+    assert res_frame_queue.empty() and feat_queue.empty()
+    #待播放帧在锁外清空
+    cursor.rewind(drain_queue(track))
+    assert track.empty()
+    assert cursor.index == 10 + BATCH - 4 - 3
+    #打断前开始的推理结果被丢弃，并退回它占用的序号
+    assert not cursor.put(gen, res_frame_queue, [(None, inflight + i, []) for i in range(BATCH)])
+    assert res_frame_queue.empty()
+    assert cursor.index == 10 - 4 - 3
+    #打断后的结果正常放入
+    assert cursor.put(cursor.generation, res_frame_queue, [(None, cursor.claim(1), [])])
+    assert res_frame_queue.qsize() == 1
@@ -0,0 +1,70 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from framequeue import FrameQueue
+
+
+def test_fifo_and_nowait():
+    q = FrameQueue(maxsize=2)
+    assert q.empty()
+    q.put_nowait(1)
+    q.put_nowait(2)
+    assert q.full()
+    with pytest.raises(asyncio.QueueFull):
+        q.put_nowait(3)
+    assert q.get_nowait() == 1
+    assert q.get_nowait() == 2
+    with pytest.raises(asyncio.QueueEmpty):
+        q.get_nowait()
+
+
+def test_get_woken_by_producer_thread():
+    async def run():
+        q = FrameQueue()
+        threading.Timer(0.05, q.put, args=('frame',)).start()
+        item = await asyncio.wait_for(q.get(), 2)
+        return item, q.stats()
+
+    item, stats = asyncio.run(run())
+    assert item == 'frame'
+    assert stats['wakeups'] == 1
+
+
+def test_no_wakeup_when_consumer_not_waiting():
+    q = FrameQueue()
+    for i in range(5):
+        q.put(i)
+    assert q.stats()['wakeups'] == 0
+    assert q.qsize() == 5
+
+
+def test_full_put_times_out_and_resumes_after_get():
+    q = FrameQueue(maxsize=1)
+    q.put('a')
+    t = time.perf_counter()
+    assert not q.put('b', timeout=0.05)
+    assert time.perf_counter() - t >= 0.04
+
+    done = []
+    producer = threading.Thread(target=lambda: done.append(q.put('b', timeout=2)))
+    producer.start()
+    time.sleep(0.05)
+    assert q.get_nowait() == 'a'
+    producer.join(2)
+    assert done == [True]
+    assert q.get_nowait() == 'b'
+    assert q.stats()['full_waits'] == 2
+
+
+def test_cancelled_get_does_not_lose_items():
+    async def run():
+        q = FrameQueue()
+        with pytest.raises(asyncio.TimeoutError):
+            await asyncio.wait_for(q.get(), 0.05)
+        q.put('late')
+        return await asyncio.wait_for(q.get(), 1)
+
+    assert asyncio.run(run()) == 'late'
@@ -0,0 +1,50 @@
+from llmcache import AnswerCache, normalize_question
+
+
+def test_normalize_question_folds_width_case_and_punctuation():
+    assert normalize_question('  Ｈｅｌｌｏ，World！ ') == 'helloworld'
+    assert normalize_question('你好 吗？') == normalize_question('你好吗')
+    assert normalize_question('？！…') == ''
+
+
+def test_hit_miss_and_copy():
+    cache = AnswerCache()
+    assert cache.get('你好') is None
+    cache.put('你好', ['你好。', '有什么可以帮你？'])
+    sentences = cache.get('你好！')
+    assert sentences == ['你好。', '有什么可以帮你？']
+    sentences.append('changed')
+    assert cache.get('你好') == ['你好。', '有什么可以帮你？']
+    assert cache.stats()['hits'] == 2
+    assert cache.stats()['misses'] == 1
+
+
+def test_empty_question_or_answer_not_cached():
+    cache = AnswerCache()
+    cache.put('？？', ['answer'])
+    cache.put('question', [])
+    assert cache.stats()['entries'] == 0
+
+
+def test_lru_eviction():
+    cache = AnswerCache(max_entries=2)
+    cache.put('a', ['A'])
+    cache.put('b', ['B'])
+    cache.get('a')
+    cache.put('c', ['C'])
+    assert cache.get('b') is None
+    assert cache.get('a') == ['A']
+    assert cache.get('c') == ['C']
+    assert cache.stats()['evictions'] == 1
+
+
+def test_ttl_expiry(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr('llmcache.time.time', lambda: now[0])
+    cache = AnswerCache(ttl=10)
+    cache.put('q', ['A'])
+    now[0] += 5
+    assert cache.get('q') == ['A']
+    now[0] += 10
+    assert cache.get('q') is None
+    assert cache.stats()['entries'] == 0
@@ -0,0 +1,86 @@
+import math
+
+import metrics
+from metrics import Counter, Gauge, Histogram
+
+
+def test_counter_and_gauge_render_labels():
+    counter = Counter('test_requests_total', 'Requests', ['path'])
+    counter.inc(path='/a')
+    counter.inc(2, path='/a')
+    counter.inc(path='say "hi"\n')
+    gauge = Gauge('test_temperature', 'Temperature')
+    gauge.set(1.5)
+    assert counter.render() == [
+        '# HELP test_requests_total Requests',
+        '# TYPE test_requests_total counter',
+        'test_requests_total{path="/a"} 3.0',
+        'test_requests_total{path="say \\"hi\\"\\n"} 1.0',
+    ]
+    assert gauge.render()[2] == 'test_temperature 1.5'
+
+
+def test_histogram_buckets_are_cumulative():
+    hist = Histogram('test_latency_seconds', 'Latency', ['stage'], buckets=(0.1, 1.0))
+    for value in (0.05, 0.5, 0.5, 5):
+        hist.observe(value, stage='x')
+    assert hist.render()[2:] == [
+        'test_latency_seconds_bucket{stage="x",le="0.1"} 1',
+        'test_latency_seconds_bucket{stage="x",le="1.0"} 3',
+        'test_latency_seconds_bucket{stage="x",le="+Inf"} 4',
+        'test_latency_seconds_sum{stage="x"} 6.05',
+        'test_latency_seconds_count{stage="x"} 4',
+    ]
+    assert hist.buckets[-1] == math.inf
+
+
+def test_remove_session_drops_only_that_session():
+    gauge = Gauge('test_queue_depth', 'Depth', ['sessionid', 'queue'])
+    gauge.set(1, sessionid=1, queue='video')
+    gauge.set(2, sessionid=2, queue='video')
+    metrics.remove_session(1)
+    assert gauge.render()[2:] == ['test_queue_depth{sessionid="2",queue="video"} 2.0']
+
+
+def test_render_includes_registered_metrics():
+    text = metrics.render()
+    assert text.endswith('\n')
+    assert '# TYPE livetalking_sessions gauge' in text
+
+
+def test_merge_metrics_groups_families_and_labels_workers():
+    text = '\n'.join([
+        '# HELP a_total A',
+        '# TYPE a_total counter',
+        'a_total{stage="x"} 3.0',
+        '# HELP b B',
+        '# TYPE b gauge',
+        'b 2.0',
+        'b{} 1.0',
+        '',
+    ])
+    lines = metrics.merge_metrics({0: text, 1: text})
+    assert lines == [
+        '# HELP a_total A',
+        '# TYPE a_total counter',
+        'a_total{worker="0",stage="x"} 3.0',
+        'a_total{worker="1",stage="x"} 3.0',
+        '# HELP b B',
+        '# TYPE b gauge',
+        'b{worker="0"} 2.0',
+        'b{worker="0"} 1.0',
+        'b{worker="1"} 2.0',
+        'b{worker="1"} 1.0',
+    ]
+
+
+def test_merge_metrics_of_rendered_histogram():
+    hist = Histogram('test_merge_seconds', 'Merge', buckets=(1.0,))
+    hist.observe(0.5)
+    lines = metrics.merge_metrics({3: '\n'.join(hist.render())})
+    assert lines[2:] == [
+        'test_merge_seconds_bucket{worker="3",le="1.0"} 1',
+        'test_merge_seconds_bucket{worker="3",le="+Inf"} 1',
+        'test_merge_seconds_sum{worker="3"} 0.5',
+        'test_merge_seconds_count{worker="3"} 1',
+    ]
@@ -0,0 +1,74 @@
+import asyncio
+
+import pytest
+
+pytest.importorskip('torch', reason='pip install -r tests/requirements.txt')
+pytest.importorskip('aiohttp', reason='pip install -r tests/requirements.txt')
+
+from sessionmgr import SessionManager
+
+
+class FakeReal:
+    hibernating = False
+    interrupt_latency = None
+    compose_pool = None
+
+    def owned_bytes(self):
+        return 0
+
+    def get_queue_depths(self):
+        return {}
+
+    def is_speaking(self):
+        return False
+
+
+class FakePlayer:
+    def __init__(self):
+        self.reattached = 0
+
+    def detach(self):
+        pass
+
+    def reattach(self):
+        self.reattached += 1
+
+
+def make_manager():
+    sessions = {}
+    manager = SessionManager(sessions, lambda sessionid: FakeReal())
+    sessions[123456] = manager.build(123456)
+    player = FakePlayer()
+    manager.attach_player(123456, player)
+    return manager, player
+
+
+def test_reattach_live_session_refused():
+    manager, player = make_manager()
+    assert manager.reattach(123456) is None
+    assert player.reattached == 0
+
+
+def test_reattach_detached_session():
+    async def run():
+        manager, player = make_manager()
+        manager.detach(123456, grace=10)
+        assert manager.reattach(123456) is player
+        #接入后会话又在线，不能再次被接管
+        assert manager.reattach(123456) is None
+        assert player.reattached == 1
+
+    asyncio.run(run())
+
+
+def test_prebuilt_session_counted_after_adopt():
+    sessions = {}
+    manager = SessionManager(sessions, lambda sessionid: FakeReal())
+    nerfreal = manager.prebuild(654321)
+    assert manager.stats()['sessions'] == []
+    assert manager.stats()['prebuilt'] == 1
+
+    manager.adopt(654321)
+    sessions[654321] = nerfreal
+    assert [info['sessionid'] for info in manager.stats()['sessions']] == [654321]
+    assert manager.stats()['prebuilt'] == 0
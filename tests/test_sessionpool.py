@@ -0,0 +1,53 @@
+import itertools
+import threading
+import time
+
+from sessionpool import SessionPool
+
+
+def test_pool_reserves_ids_until_acquired():
+    building = threading.Event()
+    release = threading.Event()
+    ids = itertools.count(1)
+
+    def build(sessionid):
+        building.set()
+        release.wait(2)
+        return f'session-{sessionid}'
+
+    pool = SessionPool(build, lambda: next(ids), size=1)
+    pool.start()
+    try:
+        assert building.wait(2)
+        #构建中的sessionid已被占用，但还不能取出
+        assert pool.reserved(1)
+        assert pool.acquire() is None
+        release.set()
+        deadline = time.time() + 2
+        while pool.qsize() == 0 and time.time() < deadline:
+            time.sleep(0.01)
+        assert pool.acquire() == (1, 'session-1')
+        assert not pool.reserved(1)
+    finally:
+        pool.stop()
+
+
+def test_failed_build_releases_id(caplog):
+    attempts = []
+
+    def build(sessionid):
+        attempts.append(sessionid)
+        raise RuntimeError('boom')
+
+    pool = SessionPool(build, lambda: 7, size=1)
+    pool.start()
+    try:
+        deadline = time.time() + 2
+        while not attempts and time.time() < deadline:
+            time.sleep(0.01)
+        time.sleep(0.05)
+        assert attempts == [7]
+        assert not pool.reserved(7)
+        assert 'session pool build error' in caplog.text
+    finally:
+        pool.stop()
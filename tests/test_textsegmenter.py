@@ -0,0 +1,53 @@
+from textsegmenter import TextSegmenter, segment_chars_for, DEFAULT_SEGMENT_CHARS
+
+
+def make(**kwargs):
+    out = []
+    return TextSegmenter(out.append, **kwargs), out
+
+
+def test_first_segment_cut_at_first_clause():
+    segmenter, out = make(segment_chars=10, first_chars=4)
+    segmenter.feed('你好呀朋友，今天天气很好，我们一起去公园散步吧。')
+    assert out[0] == '你好呀朋友，'
+    #之后的片段至少segment_chars个字符，并在句末标点处切分
+    segmenter.flush()
+    assert out[1:] == ['今天天气很好，我们一起去公园散步吧。']
+
+
+def test_streaming_feed_matches_whole_text():
+    text = 'Hello there, this is a test. It should split the same way! Right?'
+    whole, whole_out = make(segment_chars=12)
+    whole.feed(text)
+    whole.flush()
+    streamed, streamed_out = make(segment_chars=12)
+    for char in text:
+        streamed.feed(char)
+    streamed.flush()
+    assert streamed_out == whole_out
+    assert ''.join(whole_out).replace(' ', '') == text.replace(' ', '')
+
+
+def test_long_text_without_punctuation_is_split():
+    segmenter, out = make(segment_chars=10, max_chars=20)
+    segmenter.feed('一' * 55)
+    segmenter.flush()
+    assert out == ['一' * 10, '一' * 20, '一' * 20, '一' * 5]
+
+
+def test_on_start_called_once_and_blank_segments_dropped():
+    started = []
+    out = []
+    segmenter = TextSegmenter(out.append, on_start=lambda: started.append(1))
+    segmenter.feed('')
+    segmenter.feed('   ')
+    segmenter.feed('好的。')
+    segmenter.flush()
+    assert started == [1]
+    assert out == ['好的。']
+    assert segmenter.segments == 1
+
+
+def test_segment_chars_for_unknown_tts():
+    assert segment_chars_for('edgetts') == 40
+    assert segment_chars_for('unknown') == DEFAULT_SEGMENT_CHARS
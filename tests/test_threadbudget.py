@@ -0,0 +1,29 @@
+import pytest
+
+pytest.importorskip('cv2', reason='pip install -r tests/requirements.txt')
+torch = pytest.importorskip('torch', reason='pip install -r tests/requirements.txt')
+
+from threadbudget import ThreadBudget, parse_weights
+
+
+def test_parse_weights():
+    assert parse_weights('') == {}
+    assert parse_weights('infer=2, process=1.5,') == {'infer': 2.0, 'process': 1.5}
+    with pytest.raises(ValueError):
+        parse_weights('infer')
+
+
+def test_cores_split_by_session_then_weight():
+    threads = torch.get_num_threads()
+    try:
+        budget = ThreadBudget(8, parse_weights('infer=3'))
+        budget.apply('infer', 1)
+        budget.apply('process', 1)
+        assert budget.stats()['sessions'] == {1: {'infer': 6, 'process': 2}}
+        budget.apply('infer', 2)
+        #两个会话各4核，会话2只有infer阶段
+        assert budget.stats()['sessions'] == {1: {'infer': 3, 'process': 1}, 2: {'infer': 4}}
+        budget.release('infer', 2)
+        assert list(budget.stats()['sessions']) == [1]
+    finally:
+        torch.set_num_threads(threads)
@@ -0,0 +1,101 @@
+###############################################################################
+#  Text segmenter
+#  把LLM流式输出或整段echo文本切成送给TTS的片段：第一段在第一个子句边界
+#  尽快送出，缩短首包音频延迟；之后的文本合并成较长的片段，减少TTS请求次数。
+#  片段长度按TTS后端单次请求的开销配置
+###############################################################################
+
+from typing import Callable
+
+CLAUSE_END = set(',，、;；:：')
+SENTENCE_END = set('.!?。！？\n')
+
+DEFAULT_SEGMENT_CHARS = 30
+#每次请求都要新建连接、且整段合成完才返回的后端用更长的片段
+SEGMENT_CHARS = {
+    'edgetts': 40,
+    'azuretts': 40,
+    'tencent': 30,
+    'doubao': 30,
+    'gpt-sovits': 20,
+    'cosyvoice': 20,
+    'fishtts': 20,
+    'xtts': 20,
+    'indextts2': 20,
+}
+
+
+def segment_chars_for(tts: str) -> int:
+    return SEGMENT_CHARS.get(tts, DEFAULT_SEGMENT_CHARS)
+
+
+class TextSegmenter:
+    """
+    使用方法:
+        segmenter = TextSegmenter(tts.put_msg_txt, segment_chars=30)
+        segmenter.feed(text)    # 可多次调用，流式文本逐段送入
+        segmenter.flush()       # 文本结束，送出剩余部分
+    """
+
+    def __init__(self, emit: Callable[[str], None], segment_chars: int = DEFAULT_SEGMENT_CHARS,
+                 first_chars: int = 4, max_chars: int = 0, on_start: Callable[[], None] = None):
+        """
+        Args:
+            emit: 接收片段的函数
+            segment_chars: 第一段之后每段至少的字符数，在此之后的第一个句末标点处切分
+            first_chars: 第一段至少的字符数，在此之后的第一个子句边界(逗号等)处切分
+            max_chars: 没有标点时的最大片段长度，默认segment_chars的两倍
+            on_start: 收到第一段文本时调用，用于统计到首包音频的延迟
+        """
+        self.emit = emit
+        self.segment_chars = segment_chars
+        self.first_chars = first_chars
+        self.max_chars = max_chars or segment_chars * 2
+        self.on_start = on_start
+        self.segments = 0
+        self._buf = ''
+        self._started = False
+
+    def feed(self, text: str):
+        if not text:
+            return
+        if not self._started:
+            self._started = True
+            if self.on_start is not None:
+                self.on_start()
+        self._buf += text
+        while True:
+            cut = self._next_cut()
+            if cut == 0:
+                break
+            self._emit(self._buf[:cut])
+            self._buf = self._buf[cut:]
+
+    def flush(self):
+        self._emit(self._buf)
+        self._buf = ''
+
+    def _emit(self, segment: str):
+        segment = segment.strip()
+        if segment:
+            self.segments += 1
+            self.emit(segment)
+
+    def _next_cut(self) -> int:
+        """返回下一个片段的结束位置，文本还不够切分时返回0"""
+        buf = self._buf
+        first = self.segments == 0
+        min_chars = self.first_chars if first else self.segment_chars
+        limit = self.segment_chars if first else self.max_chars
+        #只在limit之内找边界，整段送入与逐字流式送入的切分结果相同
+        for i, char in enumerate(buf[:limit]):
+            if i + 1 >= min_chars and (char in SENTENCE_END or (first and char in CLAUSE_END)):
+                return i + 1
+        #太长仍没有合适的边界：在最后一个子句边界或空格处切分，都没有则硬切
+        if len(buf) < limit:
+            return 0
+        for i in range(limit - 1, 0, -1):
+            if buf[i] in CLAUSE_END or buf[i] in SENTENCE_END:
+                return i + 1
+        space = buf.rfind(' ', 0, limit)
+        return space + 1 if space > 0 else limit
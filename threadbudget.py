@@ -0,0 +1,136 @@
+###############################################################################
+#  Thread budget manager
+#  在多个会话、多个处理阶段之间分配 torch intra-op 线程数、OpenCV 线程数
+#  以及(可选)CPU亲和性，避免每个调用都开满核心导致 CPU 超额订阅
+###############################################################################
+
+import os
+import threading
+from typing import Dict, List, Optional
+
+import cv2
+import torch
+
+from logger import logger
+
+def parse_weights(text: str) -> Dict[str, float]:
+    """解析 "asr=1,infer=2" 形式的权重配置，未配置的阶段权重为1(均分)"""
+    weights = {}
+    for item in filter(None, text.split(',')):
+        stage, value = item.split('=')
+        weights[stage.strip()] = float(value)
+    return weights
+
+
+class ThreadBudget:
+    """
+    全局CPU核心预算
+
+    每个会话的每个阶段线程在启动时调用 apply(stage, sessionid)，退出时调用
+    release(stage, sessionid)；循环中定期调用 apply() 可在会话数变化后重新分配。
+
+    torch.set_num_threads 在 OpenMP 构建下只影响调用线程，否则为进程级设置；
+    cv2.setNumThreads 为进程级设置，按会话数均分。
+    """
+
+    def __init__(self, total_cores: int, weights: Dict[str, float] = None, affinity: bool = False):
+        """
+        Args:
+            total_cores: 可分配的核心总数
+            weights: 各阶段权重，未配置的阶段为1
+            affinity: 是否给各会话绑定不相交的CPU核心
+        """
+        self.total_cores = max(1, total_cores)
+        self.weights = weights or {}
+        self.affinity = affinity and hasattr(os, 'sched_setaffinity')
+        try:
+            self.cpus = sorted(os.sched_getaffinity(0))[:self.total_cores]
+        except AttributeError:
+            self.cpus = list(range(self.total_cores))
+        self._lock = threading.Lock()
+        self._sessions: Dict[int, set] = {}  # sessionid -> 活动阶段
+        self._generation = 0
+        self._local = threading.local()
+
+    def _session_index(self, sessionid) -> int:
+        return list(self._sessions).index(sessionid)
+
+    def _threads_for(self, stage: str, sessionid) -> int:
+        """按权重计算某会话某阶段可用的线程数"""
+        stages = self._sessions.get(sessionid) or {stage}
+        session_share = self.total_cores / max(1, len(self._sessions))
+        weight_sum = sum(self.weights.get(s, 1.0) for s in stages)
+        return max(1, int(session_share * self.weights.get(stage, 1.0) / weight_sum))
+
+    def _cpus_for(self, sessionid) -> List[int]:
+        """给会话分配一段连续的CPU核心，会话数多于核心数时循环复用"""
+        num = max(1, len(self._sessions))
+        per_session = max(1, len(self.cpus) // num)
+        start = (self._session_index(sessionid) * per_session) % len(self.cpus)
+        return [self.cpus[(start + i) % len(self.cpus)] for i in range(per_session)]
+
+    def apply(self, stage: str, sessionid):
+        """在阶段线程内调用，设置当前线程的并行度"""
+        with self._lock:
+            if sessionid not in self._sessions:
+                self._sessions[sessionid] = set()
+                self._generation += 1
+            if stage not in self._sessions[sessionid]:
+                self._sessions[sessionid].add(stage)
+                self._generation += 1
+            if getattr(self._local, 'generation', -1) == self._generation:
+                return
+            self._local.generation = self._generation
+            nthreads = self._threads_for(stage, sessionid)
+            cv_threads = max(1, self.total_cores // max(1, len(self._sessions)))
+            cpus = self._cpus_for(sessionid) if self.affinity else None
+        torch.set_num_threads(nthreads)
+        cv2.setNumThreads(cv_threads)
+        if cpus:
+            try:
+                os.sched_setaffinity(0, cpus)  #Linux下0表示调用线程
+            except OSError as e:
+                logger.warning(f'set cpu affinity failed: {e}')
+        logger.debug(f'thread budget: session={sessionid} stage={stage} torch={nthreads} cv2={cv_threads} cpus={cpus}')
+
+    def release(self, stage: str, sessionid):
+        with self._lock:
+            stages = self._sessions.get(sessionid)
+            if stages is None:
+                return
+            stages.discard(stage)
+            if not stages:
+                del self._sessions[sessionid]
+            self._generation += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                'total_cores': self.total_cores,
+                'affinity': self.affinity,
+                'sessions': {sid: {stage: self._threads_for(stage, sid) for stage in stages}
+                             for sid, stages in self._sessions.items()},
+            }
+
+
+# 全局实例
+_thread_budget = None
+
+def init_thread_budget(total_cores: int, weights: str = '', affinity: bool = False) -> ThreadBudget:
+    global _thread_budget
+    if _thread_budget is None:
+        _thread_budget = ThreadBudget(total_cores, parse_weights(weights), affinity)
+        logger.info(f'thread budget: {total_cores} cores, weights={_thread_budget.weights}, affinity={affinity}')
+    return _thread_budget
+
+def get_thread_budget() -> Optional[ThreadBudget]:
+    return _thread_budget
+
+def apply_thread_budget(stage: str, sessionid):
+    """未启用线程预算时什么都不做"""
+    if _thread_budget is not None:
+        _thread_budget.apply(stage, sessionid)
+
+def release_thread_budget(stage: str, sessionid):
+    if _thread_budget is not None:
+        _thread_budget.release(stage, sessionid)
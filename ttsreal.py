@@ -47,6 +47,8 @@ if TYPE_CHECKING:
     from basereal import BaseReal
 
 from logger import logger
+import metrics
+from threadbudget import apply_thread_budget,release_thread_budget
 class State(Enum):
     RUNNING=0
     PAUSE=1
@@ -63,10 +65,18 @@ class BaseTTS:
 
         self.msgqueue = Queue()
         self.state = State.RUNNING
+        self.msg_start = None #当前消息开始合成的时间，用于统计首包延迟
+        self.utterance_start = None #一段回答/文本开始送入的时间，用于统计到首帧音频的延迟
+        self.thread = None
 
     def flush_talk(self):
         self.msgqueue.queue.clear()
         self.state = State.PAUSE
+        self.utterance_start = None
+
+    def mark_utterance(self):
+        '''一段回答或文本开始分段送入，之后的第一帧音频统计首包延迟'''
+        self.utterance_start = time.perf_counter()
 
     def put_msg_txt(self,msg:str,datainfo:dict={}): 
         if len(msg)>0:
@@ -75,19 +85,33 @@ class BaseTTS:
     def render(self,quit_event):
         process_thread = Thread(target=self.process_tts, args=(quit_event,))
         process_thread.start()
+        self.thread = process_thread
     
     def process_tts(self,quit_event):        
         while not quit_event.is_set():
+            apply_thread_budget('tts',self.parent.sessionid)
             try:
                 msg:tuple[str, dict] = self.msgqueue.get(block=True, timeout=1)
                 self.state=State.RUNNING
             except queue.Empty:
                 continue
+            self.msg_start = time.perf_counter()
             self.txt_to_audio(msg)
+            self.msg_start = None
+        release_thread_budget('tts',self.parent.sessionid)
         logger.info('ttsreal thread stop')
     
     def txt_to_audio(self,msg:tuple[str, dict]):
         pass
+
+    def put_audio_frame(self,audio_chunk,datainfo:dict={}):
+        if self.msg_start is not None:
+            metrics.TTS_TTFB.observe(time.perf_counter()-self.msg_start,backend=type(self).__name__)
+            self.msg_start = None
+        if self.utterance_start is not None:
+            metrics.FIRST_AUDIO.observe(time.perf_counter()-self.utterance_start,sessionid=self.parent.sessionid)
+            self.utterance_start = None
+        self.parent.put_audio_frame(audio_chunk,datainfo)
     
 
 ###########################################################################################
@@ -161,7 +185,7 @@ class EdgeTTS(BaseTTS):
             elif streamlen<self.chunk:
                 eventpoint={'status':'end','text':text}
                 eventpoint.update(**textevent) #eventpoint={'status':'end','text':text,'msgevent':textevent}
-            self.parent.put_audio_frame(stream[idx:idx+self.chunk],eventpoint)
+            self.put_audio_frame(stream[idx:idx+self.chunk],eventpoint)
             idx += self.chunk
         #if streamlen>0:  #skip last frame(not 20ms)
         #    self.queue.put(stream[idx:])
@@ -210,7 +234,7 @@ class EdgeTTS(BaseTTS):
                     logger.info(f"预设音频播放完成: {preset_id}")
                 
                 # 发送音频帧到父类处理（会触发视频生成）
-                self.parent.put_audio_frame(audio_data[idx:idx+self.chunk], eventpoint)
+                self.put_audio_frame(audio_data[idx:idx+self.chunk], eventpoint)
                 idx += self.chunk
             
             logger.info(f"预设音频 {preset_id} 播放完成")
@@ -325,12 +349,12 @@ class FishTTS(BaseTTS):
                         eventpoint={'status':'start','text':text}
                         eventpoint.update(**textevent) #eventpoint={'status':'start','text':text,'msgevent':textevent}
                         first = False
-                    self.parent.put_audio_frame(stream[idx:idx+self.chunk],eventpoint)
+                    self.put_audio_frame(stream[idx:idx+self.chunk],eventpoint)
                     streamlen -= self.chunk
                     idx += self.chunk
         eventpoint={'status':'end','text':text}
         eventpoint.update(**textevent) #eventpoint={'status':'end','text':text,'msgevent':textevent}
-        self.parent.put_audio_frame(np.zeros(self.chunk,np.float32),eventpoint) 
+        self.put_audio_frame(np.zeros(self.chunk,np.float32),eventpoint) 
 
 ###########################################################################################
 class SovitsTTS(BaseTTS):
@@ -424,12 +448,12 @@ class SovitsTTS(BaseTTS):
                         eventpoint={'status':'start','text':text}
                         eventpoint.update(**textevent) 
                         first = False
-                    self.parent.put_audio_frame(stream[idx:idx+self.chunk],eventpoint)
+                    self.put_audio_frame(stream[idx:idx+self.chunk],eventpoint)
                     streamlen -= self.chunk
                     idx += self.chunk
         eventpoint={'status':'end','text':text}
         eventpoint.update(**textevent) 
-        self.parent.put_audio_frame(np.zeros(self.chunk,np.float32),eventpoint)
+        self.put_audio_frame(np.zeros(self.chunk,np.float32),eventpoint)
 
 ###########################################################################################
 class CosyVoiceTTS(BaseTTS):
@@ -492,12 +516,12 @@ class CosyVoiceTTS(BaseTTS):
                         eventpoint={'status':'start','text':text}
                         eventpoint.update(**textevent) 
                         first = False
-                    self.parent.put_audio_frame(stream[idx:idx+self.chunk],eventpoint)
+                    self.put_audio_frame(stream[idx:idx+self.chunk],eventpoint)
                     streamlen -= self.chunk
                     idx += self.chunk
         eventpoint={'status':'end','text':text}
         eventpoint.update(**textevent) 
-        self.parent.put_audio_frame(np.zeros(self.chunk,np.float32),eventpoint) 
+        self.put_audio_frame(np.zeros(self.chunk,np.float32),eventpoint) 
 
 ###########################################################################################
 _PROTOCOL = "https://"
@@ -617,13 +641,13 @@ class TencentTTS(BaseTTS):
                         eventpoint={'status':'start','text':text}
                         eventpoint.update(**textevent) 
                         first = False
-                    self.parent.put_audio_frame(stream[idx:idx+self.chunk],eventpoint)
+                    self.put_audio_frame(stream[idx:idx+self.chunk],eventpoint)
                     streamlen -= self.chunk
                     idx += self.chunk
                 last_stream = stream[idx:] #get the remain stream
         eventpoint={'status':'end','text':text}
         eventpoint.update(**textevent) 
-        self.parent.put_audio_frame(np.zeros(self.chunk,np.float32),eventpoint) 
+        self.put_audio_frame(np.zeros(self.chunk,np.float32),eventpoint) 
 
 ###########################################################################################
 
@@ -749,13 +773,13 @@ class DoubaoTTS(BaseTTS):
                         eventpoint={'status':'start','text':text}
                         eventpoint.update(**textevent) 
                         first = False
-                    self.parent.put_audio_frame(stream[idx:idx + self.chunk], eventpoint)
+                    self.put_audio_frame(stream[idx:idx + self.chunk], eventpoint)
                     streamlen -= self.chunk
                     idx += self.chunk
                 last_stream = stream[idx:] #get the remain stream
         eventpoint={'status':'end','text':text}
         eventpoint.update(**textevent) 
-        self.parent.put_audio_frame(np.zeros(self.chunk, np.float32), eventpoint)
+        self.put_audio_frame(np.zeros(self.chunk, np.float32), eventpoint)
 
 ###########################################################################################
 class IndexTTS2(BaseTTS):
@@ -926,14 +950,14 @@ class IndexTTS2(BaseTTS):
                     eventpoint = {'status': 'start', 'text': text, 'msgevent': textevent}
                     first_chunk = False
                 
-                self.parent.put_audio_frame(stream[idx:idx + self.chunk], eventpoint)
+                self.put_audio_frame(stream[idx:idx + self.chunk], eventpoint)
                 idx += self.chunk
                 streamlen -= self.chunk
             
             # 只在最后一个片段发送end事件
             if is_last:
                 eventpoint = {'status': 'end', 'text': text, 'msgevent': textevent}
-                self.parent.put_audio_frame(np.zeros(self.chunk, np.float32), eventpoint)
+                self.put_audio_frame(np.zeros(self.chunk, np.float32), eventpoint)
             
             # 清理临时文件
             try:
@@ -1019,13 +1043,13 @@ class XTTS(BaseTTS):
                         eventpoint={'status':'start','text':text}
                         eventpoint.update(**textevent) 
                         first = False
-                    self.parent.put_audio_frame(stream[idx:idx+self.chunk],eventpoint)
+                    self.put_audio_frame(stream[idx:idx+self.chunk],eventpoint)
                     streamlen -= self.chunk
                     idx += self.chunk
                 last_stream = stream[idx:] #get the remain stream
         eventpoint={'status':'end','text':text}
         eventpoint.update(**textevent) 
-        self.parent.put_audio_frame(np.zeros(self.chunk,np.float32),eventpoint)  
+        self.put_audio_frame(np.zeros(self.chunk,np.float32),eventpoint)  
 
 ###########################################################################################
 class AzureTTS(BaseTTS):
@@ -1083,4 +1107,4 @@ class AzureTTS(BaseTTS):
 
             frame = (np.frombuffer(chunk, dtype=np.int16)
                        .astype(np.float32) / 32767.0)
-            self.parent.put_audio_frame(frame)
\ No newline at end of file
+            self.put_audio_frame(frame)
\ No newline at end of file
@@ -4,10 +4,11 @@ import numpy as np
 
 
 class Audio2Feature():
-    def __init__(self):
+    def __init__(self, model_path="facebook/hubert-large-ls960-ft"):
         self.device = 'cuda' if torch.cuda.is_available() else 'cpu'
-        self.processor = Wav2Vec2Processor.from_pretrained("facebook/hubert-large-ls960-ft")
-        self.model = HubertModel.from_pretrained("facebook/hubert-large-ls960-ft").to(self.device)
+        #只从本地路径或本地hub缓存加载，不联网下载
+        self.processor = Wav2Vec2Processor.from_pretrained(model_path, local_files_only=True)
+        self.model = HubertModel.from_pretrained(model_path, local_files_only=True).to(self.device)
 
 
     @torch.no_grad()
@@ -1,6 +1,7 @@
 var pc = null;
+var pcConfig = null;
 
-function negotiate() {
+function negotiate(sessionid) {
     pc.addTransceiver('video', { direction: 'recvonly' });
     pc.addTransceiver('audio', { direction: 'recvonly' });
     return pc.createOffer().then((offer) => {
@@ -26,6 +27,7 @@ function negotiate() {
             body: JSON.stringify({
                 sdp: offer.sdp,
                 type: offer.type,
+                sessionid: sessionid, // 重连时带上原会话，服务端在宽限期内复用
             }),
             headers: {
                 'Content-Type': 'application/json'
@@ -42,16 +44,8 @@ function negotiate() {
     });
 }
 
-function start() {
-    var config = {
-        sdpSemantics: 'unified-plan'
-    };
-
-    if (document.getElementById('use-stun').checked) {
-        config.iceServers = [{ urls: ['stun:stun.l.google.com:19302'] }];
-    }
-
-    pc = new RTCPeerConnection(config);
+function createPeerConnection() {
+    pc = new RTCPeerConnection(pcConfig);
 
     // connect audio / video
     pc.addEventListener('track', (evt) => {
@@ -62,6 +56,32 @@ function start() {
         }
     });
 
+    // 网络中断时用新连接接入原会话
+    pc.addEventListener('connectionstatechange', () => {
+        if (pc.connectionState === 'failed') {
+            reconnect();
+        }
+    });
+}
+
+function reconnect() {
+    var sessionid = parseInt(document.getElementById('sessionid').value);
+    pc.close();
+    createPeerConnection();
+    negotiate(isNaN(sessionid) ? undefined : sessionid);
+}
+
+function start() {
+    pcConfig = {
+        sdpSemantics: 'unified-plan'
+    };
+
+    if (document.getElementById('use-stun').checked) {
+        pcConfig.iceServers = [{ urls: ['stun:stun.l.google.com:19302'] }];
+    }
+
+    createPeerConnection();
+
     document.getElementById('start').style.display = 'none';
     negotiate();
     document.getElementById('stop').style.display = 'inline-block';
@@ -23,7 +23,7 @@ import time
 from typing import Tuple, Dict, Optional, Set, Union
 from av.frame import Frame
 from av.packet import Packet
-from av import AudioFrame
+from av import AudioFrame, VideoFrame
 import fractions
 import numpy as np
 
@@ -43,6 +43,29 @@ from aiortc import (
 logging.basicConfig()
 logger = logging.getLogger(__name__)
 from logger import logger as mylogger
+import metrics
+from framequeue import FrameQueue
+from idlecache import IdlePacket
+
+
+#aiortc没有让sender强制关键帧的公开接口，收到PLI/FIR时它设置RTCRtpSender的私有属性
+#__force_keyframe，下一帧编码为关键帧。按requirements.txt中固定的aiortc版本编写；
+#升级后属性不存在时只告警一次，切回实时编码后等接收端发现参考帧不连续发PLI再恢复
+_FORCE_KEYFRAME_ATTR = '_RTCRtpSender__force_keyframe'
+_force_keyframe_warned = False
+
+
+def force_keyframe(sender) -> bool:
+    """让sender下一帧编码为关键帧，效果等同收到接收端的PLI，不支持时返回False"""
+    global _force_keyframe_warned
+    if hasattr(sender, _FORCE_KEYFRAME_ATTR):
+        setattr(sender, _FORCE_KEYFRAME_ATTR, True)
+        return True
+    if not _force_keyframe_warned:
+        _force_keyframe_warned = True
+        mylogger.warning(f'{type(sender).__name__} has no {_FORCE_KEYFRAME_ATTR}, cannot force keyframes '
+                         'after the idle loop, check the aiortc version pinned in requirements.txt')
+    return False
 
 
 class PlayerStreamTrack(MediaStreamTrack):
@@ -50,13 +73,18 @@ class PlayerStreamTrack(MediaStreamTrack):
     A video track that returns an animated flag.
     """
 
-    def __init__(self, player, kind):
+    def __init__(self, player, kind, maxsize=100):
         super().__init__()  # don't forget this!
         self.kind = kind
         self._player = player
-        self._queue = asyncio.Queue(maxsize=100)
+        self._queue = FrameQueue(maxsize=maxsize) #渲染线程直接放入，recv中取出
         self.timelist = [] #记录最近包的时间戳
         self.current_frame_count = 0
+        self.underruns = 0
+        self.sender = None  #发送这个track的RTCRtpSender，切回实时编码时请求关键帧
+        self.codec = None   #协商的视频编码格式
+        self.idle_packets = 0
+        self._idle_next = None #正在发送预编码待机帧时，下一个能接上的循环位置
         if self.kind == 'video':
             self.framecount = 0
             self.lasttime = time.perf_counter()
@@ -78,6 +106,8 @@ class PlayerStreamTrack(MediaStreamTrack):
                 # wait = self.timelist[0] + len(self.timelist)*VIDEO_PTIME - time.time()               
                 if wait>0:
                     await asyncio.sleep(wait)
+                elif wait<-VIDEO_PTIME and self._player is not None:
+                    metrics.FRAMES_LATE.inc(sessionid=self._player.sessionid,kind='video')
                 # if len(self.timelist)>=100:
                 #     self.timelist.pop(0)
                 # self.timelist.append(time.time())
@@ -96,6 +126,8 @@ class PlayerStreamTrack(MediaStreamTrack):
                 # wait = self.timelist[0] + len(self.timelist)*AUDIO_PTIME - time.time()
                 if wait>0:
                     await asyncio.sleep(wait)
+                elif wait<-AUDIO_PTIME and self._player is not None:
+                    metrics.FRAMES_LATE.inc(sessionid=self._player.sessionid,kind='audio')
                 # if len(self.timelist)>=200:
                 #     self.timelist.pop(0)
                 #     self.timelist.pop(0)
@@ -126,7 +158,16 @@ class PlayerStreamTrack(MediaStreamTrack):
         #             frame = await self._queue.get()
         #     else:
         #         frame = await self._queue.get()
+        if self._queue.empty() and hasattr(self, "_timestamp") and self._player is not None:
+            #播放需要新帧时缓冲已空
+            self.underruns += 1
+            metrics.UNDERRUNS.inc(sessionid=self._player.sessionid,kind=self.kind)
         frame,eventpoint = await self._queue.get()
+        if isinstance(frame,IdlePacket):
+            frame = self._resolve_idle(frame)
+        elif frame is not None and self._idle_next is not None: #从预编码待机帧切回实时编码
+            self._idle_next = None
+            self.request_keyframe()
         pts, time_base = await self.next_timestamp()
         frame.pts = pts
         frame.time_base = time_base
@@ -145,6 +186,34 @@ class PlayerStreamTrack(MediaStreamTrack):
                 self.totaltime=0
         return frame
     
+    def reset_clock(self):
+        '''接入新的连接时时间戳从0开始，不按断开前的时钟追帧'''
+        if hasattr(self, "_timestamp"):
+            del self._timestamp
+        self.current_frame_count = 0
+        self._idle_next = None #新连接的解码器要从关键帧开始
+
+    def set_sender(self, sender, codec: Optional[str]):
+        self.sender = sender
+        self.codec = codec
+        self._idle_next = None
+
+    def request_keyframe(self):
+        '''下一帧实时编码为关键帧，效果等同收到接收端的PLI'''
+        if self.sender is not None:
+            force_keyframe(self.sender)
+
+    def _resolve_idle(self, idle: IdlePacket) -> Union[Frame, Packet]:
+        '''预编码的待机帧在关键帧处或紧接上一个缓存帧时直接发送，否则现场编码'''
+        if idle.codec == self.codec and (idle.keyframe or idle.pos == self._idle_next):
+            self._idle_next = idle.next_pos
+            self.idle_packets += 1
+            return Packet(idle.data)
+        if self._idle_next is not None:
+            self._idle_next = None
+            self.request_keyframe()
+        return VideoFrame.from_ndarray(idle.image, format="bgr24")
+
     def stop(self):
         super().stop()
         # Drain & delete remaining frames
@@ -177,10 +246,14 @@ class HumanPlayer:
         self.__audio: Optional[PlayerStreamTrack] = None
         self.__video: Optional[PlayerStreamTrack] = None
 
-        self.__audio = PlayerStreamTrack(self, kind="audio")
-        self.__video = PlayerStreamTrack(self, kind="video")
+        #提前渲染时视频队列要能容纳render_ahead帧，每帧视频对应两帧音频
+        video_maxsize = max(100, getattr(nerfreal.opt, 'render_ahead', 0) + 2*nerfreal.opt.batch_size)
+        self.__audio = PlayerStreamTrack(self, kind="audio", maxsize=2*video_maxsize)
+        self.__video = PlayerStreamTrack(self, kind="video", maxsize=video_maxsize)
 
         self.__container = nerfreal
+        self.sessionid = nerfreal.sessionid
+        self.__discard_task: Optional[asyncio.Task] = None
 
     def notify(self,eventpoint):
         if self.__container is not None:
@@ -200,6 +273,40 @@ class HumanPlayer:
         """
         return self.__video
 
+    def detach(self) -> None:
+        """
+        连接断开但会话保留等待重连时调用(事件循环中)：按实时速度丢弃待发送的帧，
+        渲染和TTS照常推进，重连后从当前画面继续
+        """
+        if self.__discard_task is None:
+            self.__discard_task = asyncio.get_event_loop().create_task(self.__discard_frames())
+
+    def reattach(self) -> None:
+        """新的连接接入：停止丢帧，两个track重新计时"""
+        if self.__discard_task is not None:
+            self.__discard_task.cancel()
+            self.__discard_task = None
+        self.__audio.reset_clock()
+        self.__video.reset_clock()
+
+    async def __discard_frames(self) -> None:
+        start = time.time()
+        count = 0
+        while True:
+            count += 1
+            wait = start + count * VIDEO_PTIME - time.time()
+            if wait > 0:
+                await asyncio.sleep(wait)
+            #每帧视频对应两帧音频
+            for track, n in ((self.__video, 1), (self.__audio, 2)):
+                for _ in range(n):
+                    try:
+                        frame, eventpoint = track._queue.get_nowait()
+                    except asyncio.QueueEmpty:
+                        break
+                    if eventpoint:
+                        self.notify(eventpoint)
+
     def _start(self, track: PlayerStreamTrack) -> None:
         self.__started.add(track)
         if self.__thread is None:
@@ -218,6 +325,24 @@ class HumanPlayer:
             )
             self.__thread.start()
 
+    def shutdown(self, timeout: float = 5) -> bool:
+        """
+        停止渲染线程并等待其退出(会阻塞，不要在事件循环中调用)。
+        返回线程是否已退出。
+        """
+        thread = self.__thread
+        alive = False
+        if thread is not None:
+            self.__thread_quit.set()
+            thread.join(timeout)
+            alive = thread.is_alive()
+            self.__thread = None
+        self.__container = None
+        if self.__discard_task is not None:
+            self.__discard_task.get_loop().call_soon_threadsafe(self.__discard_task.cancel)
+            self.__discard_task = None
+        return not alive
+
     def _stop(self, track: PlayerStreamTrack) -> None:
         self.__started.discard(track)
 
@@ -231,5 +356,23 @@ class HumanPlayer:
             #self.__container.close()
             self.__container = None
 
+    def set_video_sender(self, sender, sdp: str) -> None:
+        """新连接协商完成后调用，记录视频sender和协商的编码格式"""
+        self.__video.set_sender(sender, negotiated_video_codec(sdp))
+
     def __log_debug(self, msg: str, *args) -> None:
         mylogger.debug(f"HumanPlayer {msg}", *args)
+
+
+def negotiated_video_codec(sdp: str) -> Optional[str]:
+    """从SDP中取视频的首选编码格式(m=video行的第一个payload type)"""
+    payload = None
+    for line in sdp.splitlines():
+        if line.startswith('m='):
+            if payload is not None: #视频段结束
+                break
+            if line.startswith('m=video'):
+                payload = line.split()[3]
+        elif payload is not None and line.startswith(f'a=rtpmap:{payload} '):
+            return line.split()[1].split('/')[0]
+    return None